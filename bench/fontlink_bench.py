@@ -0,0 +1,679 @@
+#!/usr/bin/env python3
+
+"""Benchmarks of font sets, the linker, and persistence.
+
+Synthetic font trees are generated in a temporary directory (on tmpfs
+if available, so that the disk doesn't affect the results), and every
+benchmark is run in a separate process with its own XDG directories.
+
+Results are printed as JSON lines, one object per benchmark and
+number of fonts:
+
+    benchmark -- name of the benchmark.
+    fonts -- number of fonts.
+    wall_time -- time (seconds) of the measured operation.
+    peak_rss_kb -- peak resident set size of the process.
+    setup_rss_kb -- peak resident set size before the operation.
+    rw_syscalls -- numbers of read and write system calls made by the
+        operation, from /proc/self/io, or null.
+    syscalls -- numbers of all system calls of the operation by name,
+        or null if strace is not available or --strace is not given.
+
+Benchmarks of font sets need PyGObject with GTK 3, but not a display;
+if Gtk can't be imported without one, use xvfb-run. Benchmarks that
+can't run are reported with "skipped" instead of the measurements.
+
+Use --compare with an output of a previous run to check for
+regressions: the exit status is 1 if any benchmark became slower by
+more than --threshold times.
+
+--check-imports checks the startup imports instead: each entry module
+is imported in a fresh process, and the check fails (exit status 1)
+if it takes longer than --import-budget or loads a module that must
+only be loaded on first use (e.g. AppIndicator, dialogs). Results are
+printed as JSON lines with "module", "import_time", and "unexpected"
+(the list of such modules), or "skipped".
+
+--check-stat checks that a hung mount doesn't block the main thread:
+fonts are added from a directory where stat() sleeps for a long time
+(a local stand-in for a hung network mount) along with fonts from
+a normal directory. The check fails if adding them blocks for longer
+than a fraction of a second, or if the fonts from the hung directory
+are not enabled once their check is done. The result is printed as
+a JSON line with "main_thread_time", "checked_in_time" and
+"checked_later" (numbers of fonts), and "num_active".
+"""
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+
+_ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+_DEFAULT_SIZES = (1000, 10000, 50000, 200000)
+
+_FONTS_PER_DIR = 1000
+# Every n-th font is a PostScript font with AFM metrics.
+_PS_FONT_STEP = 20
+
+# Ignore changes of wall time of very fast benchmarks.
+_MIN_COMPARED_TIME = 0.01
+
+# Entry modules of the program and modules they must not import.
+_IMPORT_CHECKS = (
+    # Headless commands; the fontlink package imports gi, but no
+    # typelibs.
+    ('fontlink.cli', ('gi.repository',)),
+    # The graphical interface before options are handled.
+    ('fontlink.app', (
+        'gi.repository.AppIndicator3',
+        'fontlink.dialogs',
+        'fontlink.font_lib',
+        'fontlink.tray',
+        'fontlink.window',
+        'concurrent.futures',
+        )),
+    )
+
+_DEFAULT_IMPORT_BUDGET = 0.5
+
+# Time (seconds) stat() sleeps in the hung directory of --check-stat;
+# much longer than the timeout of stat_service.
+_HUNG_STAT_TIME = 0.5
+# Maximal time (seconds) adding fonts may block the main thread.
+_STAT_BUDGET = 0.5
+# Number of fonts in each directory of --check-stat.
+_STAT_CHECK_FONTS = 5
+
+
+def _get_tmp_root():
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm'
+    return None
+
+
+def _font_path(tree_dir, i):
+    dir_path = os.path.join(tree_dir, 'dir{:04}'.format(i // _FONTS_PER_DIR))
+    if i % _PS_FONT_STEP == 0:
+        return os.path.join(dir_path, 'font{:06}.pfb'.format(i))
+    return os.path.join(dir_path, 'font{:06}.ttf'.format(i))
+
+
+def _font_paths(tree_dir, num_fonts):
+    return [_font_path(tree_dir, i) for i in range(num_fonts)]
+
+
+def _make_tree(tree_dir, num_fonts):
+    """Create a tree of empty font files, if not yet created."""
+    done_file = os.path.join(tree_dir, '.done')
+    if os.path.exists(done_file):
+        return
+
+    for path in _font_paths(tree_dir, num_fonts):
+        dir_path, name = os.path.split(path)
+        os.makedirs(dir_path, exist_ok=True)
+        open(path, 'wb').close()
+        if name.endswith('.pfb'):
+            afm_dir = os.path.join(dir_path, 'afm')
+            os.makedirs(afm_dir, exist_ok=True)
+            open(os.path.join(afm_dir, name[:-4] + '.afm'), 'wb').close()
+
+    open(done_file, 'wb').close()
+
+
+# Benchmarks. Each function is called in a separate process, does the
+# setup, and returns a callable that performs the measured operation.
+
+
+def _import_fontlink():
+    sys.path.insert(1, _ROOT_DIR)
+    from fontlink import config
+    from fontlink import font_utils
+    from fontlink import linker
+
+    # Don't depend on fonts installed in the system.
+    font_utils.installed_fonts._set_fonts({})
+    linker.set_journal(config.LINKS_JOURNAL_FILE)
+
+
+def _bench_add_fonts(paths):
+    from fontlink.font_lib.models import FontSet
+
+    font_set = FontSet()
+    return lambda: font_set.add_fonts(paths)
+
+
+def _bench_set_state_all_on(paths):
+    from fontlink.font_lib.models import FontSet
+
+    font_set = FontSet()
+    font_set.add_fonts((path, False) for path in paths)
+    return lambda: font_set.set_state_all(True)
+
+
+def _bench_set_state_all_off(paths):
+    from fontlink.font_lib.models import FontSet
+
+    font_set = FontSet()
+    font_set.add_fonts(paths)
+    return lambda: font_set.set_state_all(False)
+
+
+def _bench_remove_fonts(paths):
+    from fontlink.font_lib.models import FontSet
+
+    font_set = FontSet()
+    font_set.add_fonts(paths)
+    # Every other font, as if selected in the list.
+    return lambda: font_set.remove_fonts(list(range(0, len(paths), 2)))
+
+
+def _make_json_sets(paths, num_sets=10):
+    set_size = max(1, len(paths) // num_sets)
+    return [
+        {'name': 'Set {}'.format(i),
+         'fonts': [{'enabled': i == 0, 'path': path}
+                   for path in paths[i * set_size:(i + 1) * set_size]]}
+        for i in range(num_sets)]
+
+
+def _bench_as_json_load(paths):
+    from fontlink.font_lib.models import SetStore
+
+    json_sets = _make_json_sets(paths)
+    set_store = SetStore()
+
+    def run():
+        set_store.as_json = json_sets
+    return run
+
+
+def _bench_as_json_save(paths):
+    from fontlink.font_lib.models import SetStore
+
+    set_store = SetStore()
+    set_store.as_json = _make_json_sets(paths)
+    for row in set_store:
+        set_store.get_font_set(row.iter)
+    return lambda: json.dumps(set_store.as_json)
+
+
+def _make_link_groups(paths):
+    from fontlink import config
+    from fontlink import linker
+
+    return [
+        (linker.Link(path, os.path.join(
+            config.FONTS_DIR, os.path.basename(path))),)
+        for path in paths]
+
+
+def _bench_create_links(paths):
+    from fontlink import linker
+
+    link_groups = _make_link_groups(paths)
+
+    def run():
+        for link_group in link_groups:
+            linker.create_links(link_group)
+    return run
+
+
+def _bench_create_links_batch(paths):
+    from fontlink import linker
+
+    link_groups = _make_link_groups(paths)
+    return lambda: linker.create_links_batch(link_groups)
+
+
+_BENCHMARKS = {
+    'add_fonts': _bench_add_fonts,
+    'set_state_all_on': _bench_set_state_all_on,
+    'set_state_all_off': _bench_set_state_all_off,
+    'remove_fonts': _bench_remove_fonts,
+    'as_json_load': _bench_as_json_load,
+    'as_json_save': _bench_as_json_save,
+    'create_links': _bench_create_links,
+    'create_links_batch': _bench_create_links_batch,
+    }
+
+
+def _get_rss_kb():
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _get_rw_syscalls():
+    try:
+        with open('/proc/self/io', 'r') as f:
+            fields = dict(line.split(': ') for line in f.read().splitlines())
+        return int(fields['syscr']), int(fields['syscw'])
+    except (KeyError, ValueError, OSError):
+        return None
+
+
+def _run_case(benchmark, tree_dir, num_fonts, setup_only):
+    """Run a benchmark in the current process and print the result."""
+    _import_fontlink()
+    paths = _font_paths(tree_dir, num_fonts)
+    run = _BENCHMARKS[benchmark](paths)
+    setup_rss = _get_rss_kb()
+    if setup_only:
+        return
+
+    rw_before = _get_rw_syscalls()
+    start = time.perf_counter()
+    run()
+    wall_time = time.perf_counter() - start
+    rw_after = _get_rw_syscalls()
+
+    if rw_before is None or rw_after is None:
+        rw_syscalls = None
+    else:
+        rw_syscalls = {
+            'read': rw_after[0] - rw_before[0],
+            'write': rw_after[1] - rw_before[1]}
+
+    print(json.dumps({
+        'wall_time': wall_time,
+        'peak_rss_kb': _get_rss_kb(),
+        'setup_rss_kb': setup_rss,
+        'rw_syscalls': rw_syscalls}))
+
+
+def _run_import_case(module):
+    """Import the module and print the time and loaded modules."""
+    sys.path.insert(1, _ROOT_DIR)
+    start = time.perf_counter()
+    __import__(module)
+    import_time = time.perf_counter() - start
+
+    print(json.dumps({
+        'import_time': import_time,
+        'modules': sorted(sys.modules)}))
+
+
+def _check_imports(budget, tmp_dir, out):
+    """Run the import checks and return the number of failures."""
+    num_failures = 0
+    for module, forbidden in _IMPORT_CHECKS:
+        work_dir = tempfile.mkdtemp(dir=tmp_dir)
+        env = dict(os.environ)
+        for var in ('XDG_CONFIG_HOME', 'XDG_CACHE_HOME', 'XDG_DATA_HOME'):
+            env[var] = os.path.join(work_dir, var.lower())
+
+        try:
+            proc = subprocess.run(
+                [sys.executable, os.path.abspath(__file__),
+                 '--import-case', module],
+                env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                universal_newlines=True)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        if proc.returncode != 0:
+            error = proc.stderr.strip().splitlines()
+            print(json.dumps(
+                {'module': module,
+                 'skipped': error[-1] if error else 'exit status {}'.format(
+                     proc.returncode)}),
+                file=out)
+            continue
+
+        case = json.loads(proc.stdout.strip().splitlines()[-1])
+        unexpected = [
+            name for name in case['modules']
+            if any(name == forbidden_name
+                   or name.startswith(forbidden_name + '.')
+                   for forbidden_name in forbidden)]
+        print(json.dumps(
+            {'module': module,
+             'import_time': case['import_time'],
+             'unexpected': unexpected}),
+            file=out)
+
+        if unexpected or case['import_time'] > budget:
+            num_failures += 1
+            print('Import check failed: {} ({:.3f} s{})'.format(
+                    module, case['import_time'],
+                    ', imports ' + ', '.join(unexpected)
+                    if unexpected else ''),
+                  file=sys.stderr)
+
+    return num_failures
+
+
+def _run_stat_case(tree_dir):
+    """Add fonts from a hung directory and print the results."""
+    hung_dir = os.path.join(tree_dir, 'hung')
+    paths = []
+    for dir_name in ('hung', 'ok'):
+        dir_path = os.path.join(tree_dir, dir_name)
+        os.makedirs(dir_path)
+        for i in range(_STAT_CHECK_FONTS):
+            path = os.path.join(dir_path, '{}{}.ttf'.format(dir_name, i))
+            open(path, 'wb').close()
+            paths.append(path)
+
+    real_stat = os.stat
+
+    def slow_stat(path, *args, **kwargs):
+        if os.fspath(path).startswith(hung_dir):
+            time.sleep(_HUNG_STAT_TIME)
+        return real_stat(path, *args, **kwargs)
+
+    # Installed before fontlink is imported, so that stat_service
+    # uses it as well.
+    os.stat = slow_stat
+    _import_fontlink()
+    from fontlink import file_status
+    from fontlink.font_set_core import FontSetCore
+    from fontlink.stat_service import service as stat_service
+
+    late_statuses = []
+    late_done = threading.Event()
+
+    def on_checked(statuses):
+        late_statuses.append(statuses)
+        late_done.set()
+
+    core = FontSetCore()
+    start = time.perf_counter()
+    statuses = file_status.cache.check_files(paths, callback=on_checked)
+    core.add_fonts(paths, statuses)
+    # As in the tooltip of a font.
+    stat_service.get_kind(paths[0])
+    main_thread_time = time.perf_counter() - start
+
+    # The directory and then each file are checked.
+    late_done.wait(_HUNG_STAT_TIME * (_STAT_CHECK_FONTS + 1) * 2)
+    for statuses in late_statuses:
+        core.update_files(statuses)
+
+    print(json.dumps({
+        'main_thread_time': main_thread_time,
+        'checked_in_time': len(statuses),
+        'checked_later': sum(len(s) for s in late_statuses),
+        'num_active': core.num_active}))
+
+
+def _check_stat(tmp_dir, out):
+    """Run the check of a hung mount and return True if it passed."""
+    work_dir = tempfile.mkdtemp(dir=tmp_dir)
+    env = dict(os.environ)
+    for var in ('XDG_CONFIG_HOME', 'XDG_CACHE_HOME', 'XDG_DATA_HOME'):
+        env[var] = os.path.join(work_dir, var.lower())
+
+    try:
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__),
+             '--stat-case', os.path.join(work_dir, 'fonts')],
+            env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if proc.returncode != 0:
+        error = proc.stderr.strip().splitlines()
+        print('Stat check failed: {}'.format(
+                error[-1] if error else 'exit status {}'.format(
+                    proc.returncode)),
+              file=sys.stderr)
+        return False
+
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    print(json.dumps(result), file=out)
+
+    if result['main_thread_time'] > _STAT_BUDGET:
+        print('Stat check failed: the main thread was blocked for '
+              '{:.3f} s'.format(result['main_thread_time']),
+              file=sys.stderr)
+        return False
+    if result['num_active'] != _STAT_CHECK_FONTS * 2:
+        print('Stat check failed: {} of {} fonts enabled'.format(
+                result['num_active'], _STAT_CHECK_FONTS * 2),
+              file=sys.stderr)
+        return False
+    return True
+
+
+def _parse_strace_summary(path):
+    """Return {syscall: count} from the output of "strace -c"."""
+    counts = {}
+    with open(path, 'r') as f:
+        for line in f:
+            fields = line.split()
+            # % time, seconds, usecs/call, calls, [errors], syscall
+            if (len(fields) < 5 or not fields[3].isdigit()
+                    or fields[-1] == 'total'):
+                continue
+            counts[fields[-1]] = int(fields[3])
+    return counts
+
+
+def _spawn_case(benchmark, tree_dir, num_fonts, work_dir, use_strace,
+                setup_only=False):
+    """Run the benchmark in a child process.
+
+    Returns a pair (result, syscalls), where result is a dict printed
+    by the child (None if setup_only is True), and syscalls is a
+    {syscall: count} dict or None.
+    """
+    env = dict(os.environ)
+    for var in ('XDG_CONFIG_HOME', 'XDG_CACHE_HOME', 'XDG_DATA_HOME'):
+        env[var] = os.path.join(work_dir, var.lower())
+
+    args = [sys.executable, os.path.abspath(__file__),
+            '--run-case', benchmark, tree_dir, str(num_fonts)]
+    if setup_only:
+        args.append('--setup-only')
+
+    strace_file = os.path.join(work_dir, 'strace.txt')
+    if use_strace:
+        args = ['strace', '-f', '-c', '-o', strace_file] + args
+
+    try:
+        proc = subprocess.run(
+            args, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True)
+        if proc.returncode != 0:
+            raise RuntimeError(
+                proc.stderr.strip().splitlines()[-1]
+                if proc.stderr.strip() else 'exit status {}'.format(
+                    proc.returncode))
+
+        result = None
+        if not setup_only:
+            result = json.loads(proc.stdout.strip().splitlines()[-1])
+        syscalls = None
+        if use_strace:
+            syscalls = _parse_strace_summary(strace_file)
+        return result, syscalls
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _measure(benchmark, tree_dir, num_fonts, tmp_dir, use_strace):
+    work_dir = tempfile.mkdtemp(dir=tmp_dir)
+    result, syscalls = _spawn_case(
+        benchmark, tree_dir, num_fonts, work_dir, use_strace)
+
+    if syscalls is not None:
+        # Subtract system calls of the startup and the setup.
+        work_dir = tempfile.mkdtemp(dir=tmp_dir)
+        _, setup_syscalls = _spawn_case(
+            benchmark, tree_dir, num_fonts, work_dir, use_strace,
+            setup_only=True)
+        for name, count in setup_syscalls.items():
+            if name in syscalls:
+                syscalls[name] = max(0, syscalls[name] - count)
+        syscalls = {name: count for name, count in syscalls.items() if count}
+
+    result['syscalls'] = syscalls
+    return result
+
+
+def _load_results(path):
+    results = {}
+    with open(path, 'r') as f:
+        for line in f:
+            if line.strip():
+                result = json.loads(line)
+                results[result['benchmark'], result['fonts']] = result
+    return results
+
+
+def _find_regressions(results, baseline, threshold):
+    regressions = []
+    for result in results:
+        old = baseline.get((result['benchmark'], result['fonts']))
+        if (old is None or 'wall_time' not in old
+                or 'wall_time' not in result):
+            continue
+
+        if (result['wall_time'] >= _MIN_COMPARED_TIME
+                and result['wall_time'] > old['wall_time'] * threshold):
+            regressions.append((result, old))
+    return regressions
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmarks of FontLink font sets and linker.')
+    parser.add_argument(
+        '--sizes', default=','.join(str(n) for n in _DEFAULT_SIZES),
+        help='comma-separated numbers of fonts (default: %(default)s)')
+    parser.add_argument(
+        '--benchmarks', default=','.join(_BENCHMARKS),
+        help='comma-separated benchmarks (default: all)')
+    parser.add_argument(
+        '--tmp-dir', default=_get_tmp_root(),
+        help='directory for font trees (default: /dev/shm)')
+    parser.add_argument(
+        '--keep-trees', action='store_true',
+        help='don\'t remove font trees, so they can be reused with '
+             'the same --tmp-dir')
+    parser.add_argument(
+        '--strace', action='store_true',
+        help='count all system calls with strace')
+    parser.add_argument(
+        '--output', help='write results to the file instead of stdout')
+    parser.add_argument(
+        '--compare', metavar='FILE',
+        help='results of a previous run to compare with')
+    parser.add_argument(
+        '--threshold', type=float, default=1.25,
+        help='slowdown factor treated as a regression '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--check-imports', action='store_true',
+        help='check startup imports instead of running benchmarks')
+    parser.add_argument(
+        '--import-budget', type=float, default=_DEFAULT_IMPORT_BUDGET,
+        help='maximal time (seconds) of importing an entry module '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--check-stat', action='store_true',
+        help='check that a hung mount doesn\'t block the main thread '
+             'instead of running benchmarks')
+    parser.add_argument('--run-case', nargs=3, help=argparse.SUPPRESS)
+    parser.add_argument('--import-case', help=argparse.SUPPRESS)
+    parser.add_argument('--stat-case', help=argparse.SUPPRESS)
+    parser.add_argument(
+        '--setup-only', action='store_true', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = _parse_args()
+
+    if args.run_case:
+        benchmark, tree_dir, num_fonts = args.run_case
+        _run_case(benchmark, tree_dir, int(num_fonts), args.setup_only)
+        return 0
+    if args.import_case:
+        _run_import_case(args.import_case)
+        return 0
+    if args.stat_case:
+        _run_stat_case(args.stat_case)
+        return 0
+    if args.check_imports:
+        tmp_dir = tempfile.mkdtemp(prefix='fontlink-bench-', dir=args.tmp_dir)
+        try:
+            return 1 if _check_imports(
+                args.import_budget, tmp_dir, sys.stdout) else 0
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    if args.check_stat:
+        tmp_dir = tempfile.mkdtemp(prefix='fontlink-bench-', dir=args.tmp_dir)
+        try:
+            return 0 if _check_stat(tmp_dir, sys.stdout) else 1
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    benchmarks = args.benchmarks.split(',')
+    for benchmark in benchmarks:
+        if benchmark not in _BENCHMARKS:
+            sys.exit('Unknown benchmark: {}'.format(benchmark))
+
+    use_strace = args.strace
+    if use_strace and shutil.which('strace') is None:
+        print('strace not found; system calls will not be counted',
+              file=sys.stderr)
+        use_strace = False
+
+    baseline = _load_results(args.compare) if args.compare else None
+
+    tmp_dir = tempfile.mkdtemp(prefix='fontlink-bench-', dir=args.tmp_dir)
+    out = open(args.output, 'w') if args.output else sys.stdout
+    results = []
+    try:
+        for num_fonts in sizes:
+            tree_dir = os.path.join(
+                args.tmp_dir or tempfile.gettempdir(),
+                'fontlink-bench-tree-{}'.format(num_fonts))
+            _make_tree(tree_dir, num_fonts)
+
+            for benchmark in benchmarks:
+                try:
+                    result = _measure(
+                        benchmark, tree_dir, num_fonts, tmp_dir, use_strace)
+                except RuntimeError as e:
+                    result = {'skipped': str(e)}
+
+                result = dict(
+                    benchmark=benchmark, fonts=num_fonts, **result)
+                results.append(result)
+                print(json.dumps(result, sort_keys=True), file=out)
+                out.flush()
+
+            if not args.keep_trees:
+                shutil.rmtree(tree_dir, ignore_errors=True)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    if baseline is None:
+        return 0
+
+    regressions = _find_regressions(results, baseline, args.threshold)
+    for result, old in regressions:
+        print('Regression: {} with {} fonts: {:.3f} s -> {:.3f} s'.format(
+                result['benchmark'], result['fonts'],
+                old['wall_time'], result['wall_time']),
+              file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,15 +1,23 @@
 
 from gettext import gettext as _
+import os
 import signal
+import time
 
 from gi.repository import Gio, Gtk, GLib
 
 from . import app_info
-from . import dialogs
-from . import window
-from . import tray
+from .async_writer import writer
+from . import config
+from . import content_index
+from . import fc_cache
+from . import file_status
+from . import font_metadata
+from . import font_utils
+from .link_worker import worker
 from .settings import settings
 from . import linker
+from .profiling import profiler
 
 
 class FontLink(Gtk.Application):
@@ -20,6 +28,7 @@ class FontLink(Gtk.Application):
     )
 
     def __init__(self):
+        self._init_time = time.monotonic()
         super().__init__(
             application_id='org.gtk.fontlink',
             flags=Gio.ApplicationFlags.FLAGS_NONE)
@@ -33,6 +42,15 @@ class FontLink(Gtk.Application):
             self._make_option(
                 'minimized', ord('m'),
                 _('Start minimized to the notification area')),
+            self._make_option(
+                'profile', 0,
+                _('Print timings of the startup and numbers of file '
+                  'system calls on exit')),
+            self._make_option(
+                'profile-dump', 0,
+                _('Also write cProfile statistics to the file'),
+                arg=GLib.OptionArg.FILENAME,
+                arg_description=_('FILE')),
             ])
 
         self._window = None
@@ -58,12 +76,32 @@ class FontLink(Gtk.Application):
             return 0
         self._activate_minimized = options.contains('minimized')
 
+        dump_path = options.lookup_value(
+            'profile-dump', GLib.VariantType('ay'))
+        if dump_path is not None:
+            profiler.enable(os.fsdecode(dump_path.get_bytestring()))
+        elif options.contains('profile'):
+            profiler.enable()
+        else:
+            profiler.enable_from_env()
+
         return -1
 
     def do_startup(self):
-        Gtk.Application.do_startup(self)
-
-        settings.load()
+        profiler.add_phase(
+            'imports', profiler.start_time, self._init_time)
+        with profiler.phase('gtk_startup'):
+            Gtk.Application.do_startup(self)
+
+        with profiler.phase('installed_fonts'):
+            font_utils.installed_fonts.load()
+        with profiler.phase('links_journal'):
+            linker.set_journal(config.LINKS_JOURNAL_FILE)
+        linker.add_change_callback(fc_cache.refresher.schedule)
+        with profiler.phase('settings'):
+            settings.load()
+        with profiler.phase('file_status'):
+            file_status.cache.load()
 
         for name in self._ACTIONS:
             action = Gio.SimpleAction.new(name, None)
@@ -71,14 +109,29 @@ class FontLink(Gtk.Application):
             self.add_action(action)
 
         Gtk.Window.set_default_icon_name(app_info.ICON)
-        self._window = window.MainWindow(self)
-        self._window.load_state()
+        with profiler.phase('window'):
+            from . import window
 
-        self._tray = tray.Tray(self._window)
+            self._window = window.MainWindow(self)
+        with profiler.phase('load_state'):
+            self._window.load_state()
+
+        if self._activate_minimized:
+            # The window can only be shown from the tray.
+            self._create_tray()
+        else:
+            # Loading AppIndicator takes time; show the window first.
+            GLib.idle_add(self._create_tray)
 
         GLib.unix_signal_add(GLib.PRIORITY_HIGH, signal.SIGTERM, self._on_quit)
         GLib.unix_signal_add(GLib.PRIORITY_HIGH, signal.SIGINT, self._on_quit)
 
+    def _create_tray(self):
+        with profiler.phase('tray'):
+            from . import tray
+
+            self._tray = tray.Tray(self._window)
+
     def do_activate(self):
         if self._activate_minimized:
             self._activate_minimized = False
@@ -87,14 +140,25 @@ class FontLink(Gtk.Application):
 
     def do_shutdown(self):
         settings.save()
-        linker.remove_all_links()
+        writer.flush()
+        file_status.cache.save()
+        content_index.index.save()
+        font_metadata.cache.save()
+        worker.cancel_all()
+        worker.wait()
+        # Links in separate directories of sets are reused in the next
+        # session.
+        linker.remove_all_links(config.FONTS_DIR)
         Gtk.Application.do_shutdown(self)
+        profiler.report()
 
     def _on_quit(self):
         self._window.save_state()
         self._window.destroy()
 
     def _about_cb(self, action, parameter):
+        from . import dialogs
+
         dialogs.about(self._window)
 
     def _quit_cb(self, action, parameter):
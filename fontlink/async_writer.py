@@ -0,0 +1,79 @@
+
+from collections import OrderedDict
+import threading
+import traceback
+
+from . import utils
+
+
+class AsyncWriter:
+    """Background writer of files.
+
+    Files are serialized and written atomically (see
+    utils.write_atomic()) in a separate thread. If a file is scheduled
+    again before the previous data was written, only the latest data
+    is written.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        # {key: callable}
+        self._pending = OrderedDict()
+        self._busy = False
+        self._thread = None
+
+    def write(self, path, get_data):
+        """Schedule writing of the file.
+
+        get_data -- callable that returns the contents of the file as
+            str. It's called in the writer thread, so it must not
+            access objects that may be changed in the meantime.
+        """
+        self.call(path, lambda: utils.write_atomic(path, get_data()))
+
+    def call(self, key, func):
+        """Schedule func() to be called in the writer thread.
+
+        This is for files that are not written as a whole, like
+        databases. Like write(), if func is scheduled with the same
+        key again before it was called, only the latest one is called.
+        OSError raised by func is ignored; other exceptions are
+        printed.
+        """
+        with self._cond:
+            self._pending[key] = func
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def flush(self):
+        """Block until all scheduled files are written."""
+        with self._cond:
+            while self._pending or self._busy:
+                self._cond.wait()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                key, func = self._pending.popitem(last=False)
+                self._busy = True
+
+            try:
+                func()
+            except OSError:
+                pass
+            except Exception:
+                # A failed write must not stop the writer, or flush()
+                # would wait forever.
+                traceback.print_exc()
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+
+writer = AsyncWriter()
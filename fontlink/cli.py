@@ -0,0 +1,203 @@
+
+from gettext import gettext as _, ngettext
+import argparse
+import json
+import os
+import sys
+
+from . import app_info
+from .async_writer import writer
+from . import config
+from . import fc_cache
+from . import file_status
+from . import font_utils
+from . import linker
+from .font_set_core import FontSetCore
+from .profiling import profiler
+from . import set_db
+from .settings import settings
+
+
+def is_cli(argv):
+    """Return True if argv (sys.argv) requests a headless command."""
+    return len(argv) > 1 and argv[1] in _COMMANDS
+
+
+def _error(message):
+    print('{}: {}'.format(app_info.NAME, message), file=sys.stderr)
+
+
+def _check_sets(json_sets):
+    """Raise ValueError if JSON sets don't have the expected fields."""
+    try:
+        for json_set in json_sets:
+            if not isinstance(json_set['name'], str):
+                raise TypeError('set name is not a string')
+            if not isinstance(json_set.get('dir', ''), str):
+                raise TypeError('set folder is not a string')
+            for json_font in json_set['fonts']:
+                if not isinstance(json_font['path'], str):
+                    raise TypeError('font path is not a string')
+                json_font['enabled']
+    except KeyError as e:
+        raise ValueError('malformed sets: missing {}'.format(e)) from e
+    except (TypeError, AttributeError) as e:
+        raise ValueError('malformed sets: {}'.format(e)) from e
+
+
+def _load_sets():
+    settings.load()
+    try:
+        if set_db.is_enabled():
+            json_sets = set_db.db.read_sets(with_fonts=True)
+        else:
+            with open(config.SETS_FILE, 'r', encoding='utf-8') as f:
+                json_sets = json.load(f)
+        _check_sets(json_sets)
+        return json_sets
+    except (ValueError, OSError) as e:
+        _error(_('Can\'t load sets: {error}').format(error=e))
+        return None
+
+
+def _cmd_sets(args):
+    json_sets = _load_sets()
+    if json_sets is None:
+        return 1
+
+    for json_set in json_sets:
+        print('{}\t{}'.format(json_set['name'], len(json_set['fonts'])))
+    return 0
+
+
+def _cmd_enable(args):
+    json_sets = _load_sets()
+    if json_sets is None:
+        return 1
+
+    sets_by_name = {json_set['name']: json_set for json_set in json_sets}
+    for name in args.sets:
+        if name not in sets_by_name:
+            _error(_('No such set: {set_name}').format(set_name=name))
+            return 1
+
+    font_utils.installed_fonts.load()
+    font_utils.installed_fonts.wait()
+    file_status.cache.load()
+
+    set_dirs = [
+        os.path.join(config.SET_LINKS_DIR, sets_by_name[name]['dir'])
+        for name in args.sets if 'dir' in sets_by_name[name]]
+
+    num_linked = 0
+    failures = []
+    # Links of previously enabled sets are kept.
+    with linker.reconcile(
+            config.FONTS_DIR, *set_dirs, remove_orphans=False):
+        for name in args.sets:
+            # Fonts keep their saved states, and sets with a separate
+            # folder are linked there, like in the main window.
+            json_set = sets_by_name[name]
+            core = FontSetCore()
+            if 'dir' in json_set:
+                failures.extend(core.set_separate_dir(
+                    True, json_set['dir'], json_set.get('active', True)))
+            slots, set_failures = core.add_fonts(
+                (f['path'], f['enabled']) for f in json_set['fonts'])
+            failures.extend(set_failures)
+            if core.is_active:
+                num_linked += sum(
+                    1 for slot in slots
+                    if core.is_enabled(slot) and core.is_linkable(slot))
+
+    file_status.cache.save()
+
+    for result in failures:
+        if result.status == linker.LinkStatus.COLLISION:
+            reason = _('another file with the same name exists')
+        else:
+            reason = result.error
+        _error('{}: {}'.format(result.link.target, reason))
+
+    print(ngettext('{num} font enabled', '{num} fonts enabled',
+                   num_linked).format(num=num_linked))
+    return 1 if failures else 0
+
+
+def _cmd_list(args):
+    links = linker.find_journaled_links(config.FONTS_DIR)
+    for target in sorted(links):
+        print(links[target])
+    return 0
+
+
+def _cmd_disable_all(args):
+    num_links = len(linker.find_journaled_links(config.FONTS_DIR))
+    with linker.reconcile(config.FONTS_DIR) as failures:
+        pass
+
+    for result in failures:
+        _error('{}: {}'.format(result.link.target, result.error))
+
+    num_removed = num_links - len(failures)
+    print(ngettext('{num} link removed', '{num} links removed',
+                   num_removed).format(num=num_removed))
+    return 1 if failures else 0
+
+
+_COMMANDS = {
+    'sets': _cmd_sets,
+    'enable': _cmd_enable,
+    'list': _cmd_list,
+    'disable-all': _cmd_disable_all,
+    }
+
+
+def _create_parser():
+    parser = argparse.ArgumentParser(
+        prog=app_info.NAME,
+        description=_('Manage font links without the graphical interface.'))
+    subparsers = parser.add_subparsers(dest='command')
+
+    subparsers.add_parser(
+        'sets', help=_('list sets and numbers of their fonts'))
+
+    parser_enable = subparsers.add_parser(
+        'enable',
+        help=_('link all fonts of the sets; the links stay after exit'))
+    parser_enable.add_argument('sets', nargs='+', metavar='SET')
+
+    subparsers.add_parser(
+        'list', help=_('list fonts linked by FontLink'))
+
+    subparsers.add_parser(
+        'disable-all', help=_('remove all links created by FontLink'))
+
+    return parser
+
+
+def main(args):
+    """Run a headless command.
+
+    Headless commands manage links without GTK. Links created from the
+    command line stay after the program exits and are recorded in the
+    journal, so they can be listed and removed later.
+
+    args -- command line arguments without the program name.
+
+    Returns the exit status.
+    """
+    args = _create_parser().parse_args(args)
+    profiler.enable_from_env()
+    linker.set_journal(config.LINKS_JOURNAL_FILE)
+    linker.add_change_callback(fc_cache.refresher.schedule)
+
+    with profiler.phase(args.command):
+        status = _COMMANDS[args.command](args)
+    # Wait for the journal to be synced.
+    writer.flush()
+    # Make the changes visible to applications before exiting.
+    with profiler.phase('fc-cache'):
+        fc_cache.refresher.refresh_now()
+    profiler.report()
+    return status
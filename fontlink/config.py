@@ -1,18 +1,64 @@
 
 import os
 
-from gi.repository import GLib
-
 from . import app_info
 
 # ICON_DIR will be set from the main script if FontLink will be launched
 # uninstalled.
 ICON_DIR = ''
 
-CONFIG_DIR = os.path.join(GLib.get_user_config_dir(), app_info.NAME)
+
+def _get_xdg_dir(env_var, default):
+    """Get XDG base directory the same way as GLib does.
+
+    GLib is not used directly so that the headless mode (see cli)
+    doesn't need to load GObject introspection.
+    """
+    path = os.environ.get(env_var)
+    if path:
+        return path
+    return os.path.join(os.path.expanduser('~'), default)
+
+
+_USER_CONFIG_DIR = _get_xdg_dir('XDG_CONFIG_HOME', '.config')
+_USER_CACHE_DIR = _get_xdg_dir('XDG_CACHE_HOME', '.cache')
+_USER_DATA_DIR = _get_xdg_dir(
+    'XDG_DATA_HOME', os.path.join('.local', 'share'))
+
+CONFIG_DIR = os.path.join(_USER_CONFIG_DIR, app_info.NAME)
 if not os.path.isdir(CONFIG_DIR):
     os.makedirs(CONFIG_DIR)
 
-FONTS_DIR = os.path.join(GLib.get_user_data_dir(), 'fonts')
+CACHE_DIR = os.path.join(_USER_CACHE_DIR, app_info.NAME)
+if not os.path.isdir(CACHE_DIR):
+    os.makedirs(CACHE_DIR)
+
+FONTS_DIR = os.path.join(_USER_DATA_DIR, 'fonts')
 if not os.path.isdir(FONTS_DIR):
     os.makedirs(FONTS_DIR)
+
+# Directories of links of sets that have a separate directory; see
+# FontSetCore.set_separate_dir(). They are created on demand.
+SET_LINKS_DIR = os.path.join(_USER_DATA_DIR, app_info.NAME, 'sets')
+
+SETS_FILE = os.path.join(CONFIG_DIR, 'sets.json')
+# Used instead of SETS_FILE if enabled; see set_db.
+SETS_DB_FILE = os.path.join(CONFIG_DIR, 'sets.sqlite')
+LINKS_JOURNAL_FILE = os.path.join(CONFIG_DIR, 'links.journal')
+
+# System directories where fontconfig keeps its caches. fc-cache
+# rewrites cache files whenever the set of system fonts changes, so the
+# modification times of these directories tell us if the fonts were
+# (un)installed since the last launch.
+#
+# User caches (~/.cache/fontconfig) are left out intentionally: they
+# are also rewritten every time FontLink refreshes the caches of its
+# links (see fc_cache), which would invalidate the index of installed
+# fonts on almost every launch. Fonts installed in user directories
+# are detected by other means; see InstalledFontIndex.
+FONTCONFIG_CACHE_DIRS = (
+    os.path.join(os.sep, 'var', 'cache', 'fontconfig'),
+    )
+
+# Legacy directory of user fonts, which FontLink doesn't touch.
+LEGACY_FONTS_DIR = os.path.join(os.path.expanduser('~'), '.fonts')
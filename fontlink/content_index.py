@@ -0,0 +1,160 @@
+
+import hashlib
+import json
+import mmap
+import os
+import threading
+
+from . import config
+from . import utils
+
+
+def _hash_file(path):
+    """Return the hex digest of the file contents or None on error."""
+    try:
+        with open(path, 'rb') as f:
+            digest = hashlib.blake2b(digest_size=16)
+            if os.fstat(f.fileno()).st_size > 0:
+                with mmap.mmap(
+                        f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    digest.update(data)
+            return digest.hexdigest()
+    except (OSError, ValueError):
+        return None
+
+
+class ContentIndex:
+    """Index of font files by their contents.
+
+    Files are mapped into memory and hashed with BLAKE2 by a pool of
+    worker threads; hashlib releases the GIL while hashing, so the
+    files are processed in parallel. Hashes are cached by path,
+    modification time, and size, and the cache is kept on disk, so
+    each file is read only once unless it's changed.
+
+    The index is thread-safe.
+    """
+
+    _FILE = os.path.join(config.CACHE_DIR, 'content_hashes.json')
+    _VERSION = 1
+
+    # Minimal number of files to hash them in the pool.
+    _MIN_POOL_FILES = 16
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        # {path: [mtime, size, digest]}
+        self._hashes = {}
+        self._dirty = False
+
+    def _load(self):
+        try:
+            with open(self._FILE, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+            if cache['version'] == self._VERSION:
+                self._hashes = cache['hashes']
+        except (KeyError, TypeError, ValueError, OSError):
+            pass
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            data = json.dumps(
+                {'version': self._VERSION, 'hashes': self._hashes},
+                ensure_ascii=False,
+                separators=(',', ':'))
+            self._dirty = False
+
+        try:
+            utils.write_atomic(self._FILE, data)
+        except OSError:
+            pass
+
+    def get_hashes(self, paths, parallel=True):
+        """Return {path: digest} for the paths.
+
+        parallel -- hash many files in a pool of threads. Pass False
+            if the caller is already one of many threads.
+
+        Paths of files that don't exist or can't be read are omitted.
+        """
+        with self._lock:
+            if not self._loaded:
+                self._load()
+                self._loaded = True
+
+        hashes = {}
+        to_hash = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+
+            key = [st.st_mtime_ns, st.st_size]
+            with self._lock:
+                entry = self._hashes.get(path)
+            if entry is not None and entry[:2] == key:
+                hashes[path] = entry[2]
+            else:
+                to_hash.append((path, key))
+
+        if not to_hash:
+            return hashes
+
+        paths_to_hash = [path for path, key in to_hash]
+        if not parallel or len(to_hash) < self._MIN_POOL_FILES:
+            digests = [_hash_file(path) for path in paths_to_hash]
+        else:
+            # Imported here, since it's not needed for small batches
+            # and takes a noticeable part of the startup.
+            from concurrent.futures import ThreadPoolExecutor
+
+            with ThreadPoolExecutor(
+                    max_workers=os.cpu_count() or 1) as executor:
+                digests = list(executor.map(_hash_file, paths_to_hash))
+
+        with self._lock:
+            for (path, key), digest in zip(to_hash, digests):
+                if digest is None:
+                    continue
+                hashes[path] = digest
+                self._hashes[path] = key + [digest]
+                self._dirty = True
+
+        return hashes
+
+    def find_duplicates(self, paths):
+        """Find files with identical contents.
+
+        Only files that have the same size as some other file are
+        hashed.
+
+        Returns a list of groups of identical files; each group is
+        a sorted list of at least two paths.
+        """
+        paths_by_size = {}
+        for path in paths:
+            try:
+                size = os.stat(path).st_size
+            except OSError:
+                continue
+            paths_by_size.setdefault(size, []).append(path)
+
+        hashes = self.get_hashes(
+            path
+            for same_size in paths_by_size.values() if len(same_size) > 1
+            for path in same_size)
+
+        paths_by_digest = {}
+        for path, digest in hashes.items():
+            paths_by_digest.setdefault(digest, []).append(path)
+
+        return sorted(
+            sorted(group) for group in paths_by_digest.values()
+            if len(group) > 1)
+
+
+index = ContentIndex()
@@ -1,5 +1,5 @@
 
-from gettext import gettext as _
+from gettext import gettext as _, ngettext
 import os
 
 from gi.repository import Gtk
@@ -7,6 +7,7 @@ from gi.repository import Gtk
 from . import app_info
 from .settings import settings
 from . import font_utils
+from . import linker
 
 
 def confirmation(parent, message, ok_text):
@@ -25,6 +26,46 @@ def confirmation(parent, message, ok_text):
     return response == Gtk.ResponseType.OK
 
 
+def link_failures(parent, failures, max_shown=10):
+    """Show the list of links that failed to be created or removed.
+
+    failures -- list of linker.LinkResult.
+    """
+    if not failures:
+        return
+
+    lines = []
+    for result in failures[:max_shown]:
+        if result.status == linker.LinkStatus.COLLISION:
+            reason = _('another file with the same name exists')
+        elif result.error is not None and result.error.strerror:
+            reason = result.error.strerror
+        else:
+            reason = _('unknown error')
+        lines.append('{}: {}'.format(
+            os.path.basename(result.link.target), reason))
+
+    if len(failures) > max_shown:
+        num_more = len(failures) - max_shown
+        lines.append(
+            ngettext('…and {num} more', '…and {num} more', num_more).format(
+                num=num_more))
+
+    dialog = Gtk.MessageDialog(
+        message_type=Gtk.MessageType.WARNING,
+        buttons=Gtk.ButtonsType.CLOSE,
+        text=ngettext(
+            '{num} font file could not be linked',
+            '{num} font files could not be linked',
+            len(failures)).format(num=len(failures)),
+        secondary_text='\n'.join(lines),
+        transient_for=parent,
+        destroy_with_parent=True
+        )
+    dialog.run()
+    dialog.destroy()
+
+
 def about(parent):
     dialog = Gtk.AboutDialog(
         program_name=app_info.TITLE,
@@ -76,3 +117,103 @@ def open_fonts(parent):
     dialog.destroy()
 
     return font_paths
+
+
+def open_folders(parent):
+    dialog = Gtk.FileChooserDialog(
+        title=_('Choose folders with fonts'),
+        action=Gtk.FileChooserAction.SELECT_FOLDER,
+        select_multiple=True,
+        transient_for=parent,
+        destroy_with_parent=True
+        )
+    dialog.add_buttons(
+        _('_Cancel'), Gtk.ResponseType.CANCEL,
+        _('_Add'), Gtk.ResponseType.OK,
+        )
+
+    path = settings.get('last_dir')
+    if not isinstance(path, str):
+        path = os.path.expanduser('~')
+    dialog.set_current_folder(path)
+
+    if dialog.run() == Gtk.ResponseType.OK:
+        paths = dialog.get_filenames()
+        settings['last_dir'] = dialog.get_current_folder()
+    else:
+        paths = []
+    dialog.destroy()
+
+    return paths
+
+
+def duplicates(parent, groups):
+    """Show groups of identical font files.
+
+    groups -- list of lists of paths; see
+        content_index.ContentIndex.find_duplicates().
+
+    Returns True if the duplicates (all files but the first in each
+    group) should be removed.
+    """
+    if not groups:
+        dialog = Gtk.MessageDialog(
+            message_type=Gtk.MessageType.INFO,
+            buttons=Gtk.ButtonsType.CLOSE,
+            text=_('No identical fonts found'),
+            transient_for=parent,
+            destroy_with_parent=True
+            )
+        dialog.run()
+        dialog.destroy()
+        return False
+
+    num_duplicates = sum(len(group) - 1 for group in groups)
+
+    dialog = Gtk.Dialog(
+        title=_('Duplicates'),
+        transient_for=parent,
+        destroy_with_parent=True,
+        default_width=500,
+        default_height=400
+        )
+    dialog.add_buttons(
+        _('_Close'), Gtk.ResponseType.CLOSE,
+        _('_Remove Duplicates'), Gtk.ResponseType.OK,
+        )
+
+    content_area = dialog.get_content_area()
+    content_area.set_spacing(6)
+
+    content_area.add(Gtk.Label(
+        label=ngettext(
+            '{num} font is identical to another one. The first font '
+            'of each group will be kept.',
+            '{num} fonts are identical to other ones. The first font '
+            'of each group will be kept.',
+            num_duplicates).format(num=num_duplicates),
+        wrap=True,
+        xalign=0.0,
+        margin=6))
+
+    store = Gtk.TreeStore(str)
+    for group in groups:
+        tree_iter = store.append(None, (group[0],))
+        for path in group[1:]:
+            store.append(tree_iter, (path,))
+
+    tree_view = Gtk.TreeView(model=store, headers_visible=False)
+    tree_view.append_column(
+        Gtk.TreeViewColumn('', Gtk.CellRendererText(), text=0))
+    tree_view.expand_all()
+
+    scrolled = Gtk.ScrolledWindow(
+        shadow_type=Gtk.ShadowType.IN,
+        expand=True)
+    scrolled.add(tree_view)
+    content_area.add(scrolled)
+
+    content_area.show_all()
+    response = dialog.run()
+    dialog.destroy()
+    return response == Gtk.ResponseType.OK
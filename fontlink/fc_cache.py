@@ -0,0 +1,104 @@
+
+import subprocess
+import threading
+
+
+class CacheRefresher:
+    """Coalesced refresh of fontconfig caches.
+
+    Changes of font directories are collected for a short time after
+    the first one, and then a single fc-cache pass over all changed
+    directories is run in a background thread. This way, applications
+    find up-to-date caches instead of rescanning the directories each
+    on its own, and many changes in a row (e.g. toggling fonts one by
+    one) cost only one rescan.
+    """
+
+    # Time (seconds) to collect changes before running fc-cache.
+    _DELAY = 0.5
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dirs = set()
+        self._timer = None
+        self._running = False
+        self._callbacks = []
+
+    @property
+    def is_busy(self):
+        """True if a refresh is pending or running."""
+        with self._lock:
+            return self._timer is not None or self._running
+
+    def add_callback(self, callback):
+        """Call callback(is_busy) when the refresh starts or ends.
+
+        is_busy is False once all scheduled changes are visible in the
+        fontconfig caches. The callback is called from an arbitrary
+        thread.
+        """
+        self._callbacks.append(callback)
+
+    def _notify(self, is_busy):
+        for callback in self._callbacks:
+            callback(is_busy)
+
+    def schedule(self, dirs):
+        """Schedule refresh of caches of the directories."""
+        with self._lock:
+            self._dirs.update(dirs)
+            if self._timer is not None or self._running:
+                return
+            self._start_timer()
+        self._notify(True)
+
+    def _start_timer(self):
+        self._timer = threading.Timer(self._DELAY, self._on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+            if self._running:
+                return
+            dirs = self._dirs
+            self._dirs = set()
+            self._running = True
+
+        _run_fc_cache(dirs)
+
+        with self._lock:
+            self._running = False
+            # Changes made while fc-cache was running.
+            if self._dirs:
+                self._start_timer()
+                return
+        self._notify(False)
+
+    def refresh_now(self):
+        """Refresh caches of all scheduled directories synchronously."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            dirs = self._dirs
+            self._dirs = set()
+
+        if dirs:
+            _run_fc_cache(dirs)
+        if not self.is_busy:
+            self._notify(False)
+
+
+def _run_fc_cache(dirs):
+    try:
+        subprocess.run(
+            ['fc-cache'] + sorted(dirs),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL)
+    except OSError:
+        pass
+
+
+refresher = CacheRefresher()
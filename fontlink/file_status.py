@@ -0,0 +1,214 @@
+
+from collections import namedtuple
+from functools import partial
+import json
+import os
+import stat
+import threading
+import time
+
+from . import config
+from . import font_utils
+from .stat_service import service as stat_service
+from . import utils
+
+
+# exists -- True if the path is a regular file.
+# mtime, size -- st_mtime_ns and st_size, or 0 if the file doesn't exist.
+#   They are as of the moment the file was first seen in the current
+#   state of its directory, and are not updated if only the contents of
+#   the file are changed.
+# metrics_path -- path to PS metrics (see font_utils.find_metrics()),
+#   or an empty string if the file is not a PS font or has no metrics.
+FileStatus = namedtuple('FileStatus', 'exists mtime size metrics_path')
+
+# Status of a file that doesn't exist.
+MISSING = FileStatus(False, 0, 0, '')
+
+
+def _stat_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class FileStatusCache:
+    """Persistent cache of font file statuses.
+
+    Entries are grouped by directory. The modification time of a
+    directory changes whenever a file is created, removed, or renamed
+    in it, so if the time is the same as when the entries were cached,
+    they are still valid, and a single stat() of the directory
+    replaces stat() of every file and the metrics search. Directories
+    with PostScript fonts also remember the modification times of
+    their metrics subdirectories.
+
+    A directory validated once is trusted for _REVALIDATE_INTERVAL
+    seconds, or until invalidate() is called.
+
+    The cache is thread-safe; files are checked without holding the
+    lock, so a hung mount doesn't block checks of other files. In the
+    main thread, use check_files() instead of get(), since the latter
+    can block.
+    """
+
+    _FILE = os.path.join(config.CACHE_DIR, 'file_status.json')
+    _VERSION = 1
+
+    _REVALIDATE_INTERVAL = 2.0
+
+    def __init__(self):
+        # {dir: {'mtime': int, 'subdirs': {name: mtime} or None,
+        #        'files': {name: [exists, mtime, size, metrics_path]}}}
+        self._dirs = {}
+        # {dir: monotonic time of the last validation}
+        self._validated = {}
+        self._dirty = False
+        # Guards the above, but is never held during file checks.
+        self._lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self._FILE, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+            if cache['version'] == self._VERSION:
+                with self._lock:
+                    self._dirs = cache['dirs']
+        except (KeyError, TypeError, ValueError, OSError):
+            pass
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            data = json.dumps(
+                {'version': self._VERSION, 'dirs': self._dirs},
+                ensure_ascii=False,
+                separators=(',', ':'))
+            self._dirty = False
+
+        try:
+            utils.write_atomic(self._FILE, data)
+        except OSError:
+            with self._lock:
+                self._dirty = True
+
+    def invalidate(self, dir_path):
+        """Force revalidation of the directory on the next access."""
+        with self._lock:
+            self._validated.pop(dir_path, None)
+        font_utils.invalidate_metrics(dir_path)
+
+    def _get_subdir_mtimes(self, dir_path):
+        subdirs = {}
+        for name in font_utils.METRICS_SUBDIRS:
+            mtime = _stat_mtime(os.path.join(dir_path, name))
+            if mtime is not None:
+                subdirs[name] = mtime
+        return subdirs
+
+    def _get_dir(self, dir_path):
+        """Return a valid entry of the directory or None if it's missing."""
+        now = time.monotonic()
+        with self._lock:
+            dir_entry = self._dirs.get(dir_path)
+            validated = self._validated.get(dir_path)
+            if (validated is not None
+                    and now - validated < self._REVALIDATE_INTERVAL):
+                return dir_entry
+            self._validated[dir_path] = now
+
+        mtime = _stat_mtime(dir_path)
+        if mtime is None:
+            # Keep the cached entry (if any): the directory may be on
+            # a share that is not mounted at the moment.
+            return None
+
+        if (dir_entry is not None
+                and dir_entry['mtime'] == mtime
+                and (dir_entry['subdirs'] is None
+                     or dir_entry['subdirs'] == self._get_subdir_mtimes(
+                         dir_path))):
+            return dir_entry
+
+        dir_entry = {'mtime': mtime, 'subdirs': None, 'files': {}}
+        with self._lock:
+            self._dirs[dir_path] = dir_entry
+            self._dirty = True
+        return dir_entry
+
+    def get(self, path):
+        """Return FileStatus of the font file."""
+        dir_path, name = os.path.split(path)
+        dir_entry = self._get_dir(dir_path)
+        if dir_entry is None:
+            return MISSING
+
+        file_entry = dir_entry['files'].get(name)
+        if file_entry is not None:
+            return FileStatus(*file_entry)
+
+        subdirs = None
+        try:
+            st = os.stat(path)
+        except OSError:
+            status = MISSING
+        else:
+            if not stat.S_ISREG(st.st_mode):
+                status = MISSING
+            else:
+                root_name, ext = os.path.splitext(name)
+                metrics_path = ''
+                if ext.lower() in font_utils.FONT_EXTENSIONS_PS:
+                    if dir_entry['subdirs'] is None:
+                        subdirs = self._get_subdir_mtimes(dir_path)
+                    metrics_path = font_utils.find_metrics(
+                        dir_path, root_name)
+                status = FileStatus(
+                    True, st.st_mtime_ns, st.st_size, metrics_path)
+
+        with self._lock:
+            if subdirs is not None and dir_entry['subdirs'] is None:
+                dir_entry['subdirs'] = subdirs
+            dir_entry['files'][name] = list(status)
+            self._dirty = True
+        return status
+
+    def _get_all(self, paths):
+        return {path: self.get(path) for path in paths}
+
+    def check_files(self, paths, timeout=None, callback=None):
+        """Return FileStatus of the font files without blocking.
+
+        The files are checked by stat_service, a directory at a time,
+        so a directory on a hung mount only delays its own files.
+
+        timeout -- see StatService.call().
+        callback -- if not None, callback({path: FileStatus}) is
+            called in another thread with the files of each directory
+            that was checked after the timeout.
+
+        Returns {path: FileStatus} of the files checked within the
+        timeout.
+        """
+        paths_by_dir = {}
+        for path in paths:
+            paths_by_dir.setdefault(os.path.dirname(path), []).append(path)
+
+        def on_dir_checked(dir_path, statuses):
+            if statuses is not None:
+                callback(statuses)
+
+        statuses = {}
+        for dir_statuses in stat_service.call(
+                {dir_path: partial(self._get_all, dir_paths)
+                 for dir_path, dir_paths in paths_by_dir.items()},
+                timeout,
+                None if callback is None else on_dir_checked).values():
+            if dir_statuses is not None:
+                statuses.update(dir_statuses)
+        return statuses
+
+
+cache = FileStatusCache()
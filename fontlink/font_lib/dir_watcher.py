@@ -0,0 +1,122 @@
+
+from collections import Counter
+import os
+
+from gi.repository import Gio, GLib
+
+from .. import file_status
+
+
+class DirWatcher:
+    """Watcher of directories with fonts.
+
+    There is a single Gio.FileMonitor per directory, no matter how many
+    fonts from this directory are in sets. Directories are reference
+    counted with watch_paths() and unwatch_paths(). Directories that
+    don't exist (e.g. on an unmounted drive) are watched too.
+
+    Changes are collected for a short time, after which callbacks are
+    called once with all changed directories. Mounting or unmounting
+    a volume is reported as a change of the watched directories on
+    it.
+    """
+
+    # Time (ms) to collect changes.
+    _DELAY = 500
+
+    _EVENTS = frozenset((
+        Gio.FileMonitorEvent.CREATED,
+        Gio.FileMonitorEvent.DELETED,
+        Gio.FileMonitorEvent.MOVED_IN,
+        Gio.FileMonitorEvent.MOVED_OUT,
+        Gio.FileMonitorEvent.RENAMED,
+        Gio.FileMonitorEvent.UNMOUNTED,
+        ))
+
+    def __init__(self):
+        self._refcounter = Counter()
+        self._monitors = {}
+        self._changed_dirs = set()
+        self._timeout_source = None
+        self._callbacks = []
+        self._volume_monitor = None
+
+    def add_callback(self, callback):
+        """Call callback(dir_paths) with a set of changed directories."""
+        self._callbacks.append(callback)
+
+    def watch_paths(self, paths):
+        """Start watching directories of the paths."""
+        if self._volume_monitor is None:
+            self._volume_monitor = Gio.VolumeMonitor.get()
+            self._volume_monitor.connect('mount-added', self._on_mount)
+            self._volume_monitor.connect('mount-removed', self._on_mount)
+
+        for path in paths:
+            dir_path = os.path.dirname(path)
+            self._refcounter[dir_path] += 1
+            if self._refcounter[dir_path] > 1:
+                continue
+
+            gfile = Gio.File.new_for_path(dir_path)
+            try:
+                monitor = gfile.monitor_directory(
+                    Gio.FileMonitorFlags.WATCH_MOUNTS, None)
+            except GLib.Error:
+                continue
+            monitor.connect('changed', self._on_changed, dir_path)
+            self._monitors[dir_path] = monitor
+
+    def unwatch_paths(self, paths):
+        """Stop watching directories of the paths."""
+        for path in paths:
+            dir_path = os.path.dirname(path)
+            if self._refcounter[dir_path] == 0:
+                continue
+
+            self._refcounter[dir_path] -= 1
+            if self._refcounter[dir_path] > 0:
+                continue
+
+            del self._refcounter[dir_path]
+            monitor = self._monitors.pop(dir_path, None)
+            if monitor is not None:
+                monitor.cancel()
+            self._changed_dirs.discard(dir_path)
+
+    def _on_changed(self, monitor, gfile, other_gfile, event_type,
+                    dir_path):
+        if event_type in self._EVENTS:
+            self._add_changed((dir_path,))
+
+    def _on_mount(self, volume_monitor, mount):
+        root = mount.get_root().get_path()
+        if root is None:
+            self._add_changed(self._refcounter)
+            return
+
+        prefix = root.rstrip('/') + '/'
+        self._add_changed(
+            dir_path for dir_path in self._refcounter
+            if dir_path == root or dir_path.startswith(prefix))
+
+    def _add_changed(self, dirs):
+        self._changed_dirs.update(dirs)
+        if self._changed_dirs and self._timeout_source is None:
+            self._timeout_source = GLib.timeout_add(
+                self._DELAY, self._on_timeout)
+
+    def _on_timeout(self):
+        self._timeout_source = None
+
+        changed_dirs = self._changed_dirs
+        self._changed_dirs = set()
+        for dir_path in changed_dirs:
+            file_status.cache.invalidate(dir_path)
+        for callback in self._callbacks:
+            callback(changed_dirs)
+
+        return GLib.SOURCE_REMOVE
+
+
+dir_watcher = DirWatcher()
@@ -3,10 +3,18 @@ from gettext import gettext as _, ngettext
 import json
 import os
 
-from gi.repository import Gtk, Gdk, Pango
+from gi.repository import Gtk, Gdk, GLib, Pango
 
 from .. import config
+from ..async_writer import writer
+from .. import fc_cache
+from .. import font_utils
+from .. import linker
+from ..profiling import profiler
+from .. import set_db
+from ..link_worker import worker
 from ..settings import settings
+from ..stat_service import FileKind, service as stat_service
 from .. import dialogs
 from .. import utils
 from .models import SetStore
@@ -15,9 +23,16 @@ from .font_list import FontList
 
 class FontLib(Gtk.Paned):
 
-    _FILE = os.path.join(config.CONFIG_DIR, 'sets.json')
+    _FILE = config.SETS_FILE
     _DEFAULT_SET_NAME = _('New set')
 
+    # Delay (seconds) between the first unsaved modification of sets
+    # or settings and saving them in background.
+    _AUTOSAVE_DELAY = 3
+
+    # Interval (ms) of updating the progress of the link worker.
+    _LINK_PROGRESS_INTERVAL = 100
+
     class _ViewColumn:
         TOGGLE = 0
         NAME = 1
@@ -27,8 +42,26 @@ class FontLib(Gtk.Paned):
         super().__init__()
         self._set_store = SetStore()
         self._font_list = FontList()
+        self._font_list.connect(
+            'populate-popup', self._on_font_list_populate_popup)
         self._create_ui()
 
+        self._dirty = False
+        self._autosave_source = None
+        # True while sets are loaded in background.
+        self._loading = False
+        self._link_progress_source = None
+        self._set_store.connect('modified', self._on_modified)
+        settings.add_change_callback(self._schedule_autosave)
+
+        if font_utils.installed_fonts.is_loading:
+            font_utils.installed_fonts.add_ready_callback(
+                lambda: GLib.idle_add(self._on_installed_fonts_ready))
+
+    def _on_installed_fonts_ready(self):
+        self._set_store.update_installed()
+        return GLib.SOURCE_REMOVE
+
     def _create_ui(self):
         grid = Gtk.Grid(orientation=Gtk.Orientation.VERTICAL)
 
@@ -53,6 +86,31 @@ class FontLib(Gtk.Paned):
         scrolled.add(self._set_list)
         grid.add(scrolled)
 
+        # Link worker progress
+
+        self._link_bar = Gtk.Grid(
+            column_spacing=6,
+            border_width=3,
+            no_show_all=True)
+        grid.add(self._link_bar)
+
+        self._link_progress = Gtk.ProgressBar(
+            show_text=True,
+            hexpand=True,
+            valign=Gtk.Align.CENTER)
+        self._link_progress.show()
+        self._link_bar.add(self._link_progress)
+
+        self._btn_cancel_links = Gtk.Button(
+            label=_('Cancel'),
+            tooltip_text=_('Stop enabling or disabling fonts'))
+        self._btn_cancel_links.connect('clicked', self._on_cancel_links)
+        self._btn_cancel_links.show()
+        self._link_bar.add(self._btn_cancel_links)
+
+        worker.add_callback(
+            lambda is_busy: GLib.idle_add(self._on_link_worker_busy, is_busy))
+
         # Columns
 
         toggle = Gtk.CellRendererToggle()
@@ -98,9 +156,61 @@ class FontLib(Gtk.Paned):
         btn_delete.connect('clicked', self._on_delete)
         toolbar.add(btn_delete)
 
+        separator = Gtk.SeparatorToolItem(draw=False)
+        separator.set_expand(True)
+        toolbar.add(separator)
+
+        self._fc_cache_spinner = Gtk.Spinner(
+            tooltip_text=_('Updating the font cache…'),
+            no_show_all=True)
+        spinner_item = Gtk.ToolItem()
+        spinner_item.add(self._fc_cache_spinner)
+        toolbar.add(spinner_item)
+
+        fc_cache.refresher.add_callback(
+            lambda is_busy: GLib.idle_add(self._on_fc_cache_busy, is_busy))
+
         self.pack1(grid, False, False)
         self.pack2(self._font_list, True, False)
 
+    def _on_fc_cache_busy(self, is_busy):
+        if is_busy:
+            self._fc_cache_spinner.show()
+            self._fc_cache_spinner.start()
+        else:
+            self._fc_cache_spinner.stop()
+            self._fc_cache_spinner.hide()
+        return GLib.SOURCE_REMOVE
+
+    def _on_link_worker_busy(self, is_busy):
+        if is_busy:
+            if self._loading:
+                self._link_progress.set_text(_('Loading sets…'))
+            else:
+                self._link_progress.set_text(_('Updating fonts…'))
+            self._link_progress.set_fraction(0.0)
+            self._btn_cancel_links.set_sensitive(not self._loading)
+            self._link_bar.show()
+            if self._link_progress_source is None:
+                self._link_progress_source = GLib.timeout_add(
+                    self._LINK_PROGRESS_INTERVAL,
+                    self._on_link_progress_timeout)
+        elif not worker.is_busy:
+            self._link_bar.hide()
+            if self._link_progress_source is not None:
+                GLib.source_remove(self._link_progress_source)
+                self._link_progress_source = None
+        return GLib.SOURCE_REMOVE
+
+    def _on_link_progress_timeout(self):
+        progress = worker.progress
+        if progress is not None:
+            self._link_progress.set_fraction(progress)
+        return GLib.SOURCE_CONTINUE
+
+    def _on_cancel_links(self, button):
+        self._set_store.cancel_link_jobs()
+
     def _on_button_press(self, widget, event):
         if not (event.type == Gdk.EventType.BUTTON_PRESS and
                 event.button == Gdk.BUTTON_SECONDARY):
@@ -141,6 +251,25 @@ class FontLib(Gtk.Paned):
         mi_rename.connect('activate', self._on_rename)
         menu.append(mi_rename)
 
+        mi_switch = Gtk.MenuItem(
+            label=_('Enable _Only This Set'),
+            use_underline=True,
+            tooltip_text=_(
+                'Enable the set and disable all others; fonts that are '
+                'in both stay enabled')
+            )
+        mi_switch.connect('activate', self._on_switch_exclusive)
+        menu.append(mi_switch)
+
+        mi_separate_dir = Gtk.CheckMenuItem(
+            label=_('_Separate Folder'),
+            use_underline=True,
+            tooltip_text=_(
+                'Link fonts to a separate folder, so that the whole set '
+                'is enabled or disabled at once')
+            )
+        menu.append(mi_separate_dir)
+
         menu.append(Gtk.SeparatorMenuItem())
 
         mi_delete = Gtk.MenuItem(
@@ -151,6 +280,15 @@ class FontLib(Gtk.Paned):
         mi_delete.connect('activate', self._on_delete)
         menu.append(mi_delete)
 
+        set_store, tree_iter = self._set_list.get_selection().get_selected()
+        if tree_iter is None:
+            mi_separate_dir.set_sensitive(False)
+        else:
+            font_set = set_store[tree_iter][SetStore.COL_FONTSET]
+            mi_separate_dir.set_active(font_set.core.dir_name is not None)
+        mi_separate_dir.connect('toggled', self._on_separate_dir)
+        mi_switch.set_sensitive(tree_iter is not None)
+
         menu.show_all()
         menu.popup(None, None, None, None, event.button, event.time)
 
@@ -182,7 +320,10 @@ class FontLib(Gtk.Paned):
     def _toggle_cell_data_func(self, column, cell, set_store, tree_iter, data):
         font_set = set_store[tree_iter][SetStore.COL_FONTSET]
 
-        if font_set.num_active == 0:
+        if font_set.core.dir_name is not None:
+            cell.props.inconsistent = False
+            cell.props.active = font_set.core.is_active
+        elif font_set.num_active == 0:
             cell.props.inconsistent = False
             cell.props.active = False
         elif font_set.num_active == len(font_set):
@@ -199,11 +340,92 @@ class FontLib(Gtk.Paned):
         set_store, tree_iter = selection.get_selected()
         if tree_iter is None:
             return
-        self._font_list.font_set = set_store[tree_iter][SetStore.COL_FONTSET]
+        self._font_list.font_set = set_store.get_font_set(tree_iter)
+
+    def _on_font_list_populate_popup(self, font_list, menu, font_path):
+        mi_other_sets = Gtk.MenuItem(
+            label=_('Show in _Other Sets'),
+            use_underline=True,
+            tooltip_text=_('Show the font in another set that contains it')
+            )
+        menu.append(Gtk.SeparatorMenuItem())
+        menu.append(mi_other_sets)
+
+        tree_iters = []
+        if font_path is not None:
+            tree_iters = [
+                tree_iter
+                for tree_iter in self._set_store.find_sets(font_path)
+                if (self._set_store[tree_iter][SetStore.COL_FONTSET]
+                    is not font_list.font_set)]
+        if not tree_iters:
+            mi_other_sets.set_sensitive(False)
+            return
+
+        submenu = Gtk.Menu()
+        for tree_iter in tree_iters:
+            mi_set = Gtk.MenuItem(
+                label=self._set_store[tree_iter][SetStore.COL_NAME])
+            mi_set.connect(
+                'activate', self._on_show_in_set,
+                self._set_store[tree_iter][SetStore.COL_FONTSET].core,
+                font_path)
+            submenu.append(mi_set)
+        mi_other_sets.set_submenu(submenu)
+
+    def _on_show_in_set(self, menu_item, core, font_path):
+        try:
+            tree_iter = self._set_store.get_iter_by_core(core)
+        except KeyError:
+            # The set was deleted.
+            return
+
+        self._set_list.set_cursor(self._set_store.get_path(tree_iter))
+        self._font_list.select_font(font_path)
 
     def _on_toggled(self, cell_toggle, tree_path):
-        font_set = self._set_store[tree_path][SetStore.COL_FONTSET]
-        font_set.set_state_all(font_set.num_active < len(font_set))
+        tree_iter = self._set_store.get_iter(tree_path)
+        core = self._set_store[tree_iter][SetStore.COL_FONTSET].core
+        if core.dir_name is not None:
+            failures = self._set_store.set_active(
+                tree_iter, not core.is_active)
+            dialogs.link_failures(self.get_toplevel(), failures)
+        else:
+            # Links are changed in background, so that the window
+            # doesn't freeze on slow file systems.
+            font_set = self._set_store.get_font_set(tree_iter)
+            font_set.set_state_all_async(
+                font_set.num_active < len(font_set),
+                callback=self._on_link_job_finished)
+
+    def _on_link_job_finished(self, failures):
+        dialogs.link_failures(self.get_toplevel(), failures)
+
+    def _on_switch_exclusive(self, menu_item):
+        set_store, tree_iter = self._set_list.get_selection().get_selected()
+        if tree_iter is None:
+            return
+
+        # States of all sets are changed, so nothing can be edited
+        # until the links are done.
+        self._set_list.set_sensitive(False)
+        self._font_list.set_sensitive(False)
+        set_store.switch_exclusive(tree_iter, self._on_switch_finished)
+
+    def _on_switch_finished(self, failures):
+        self._set_list.set_sensitive(True)
+        self._font_list.set_sensitive(True)
+        dialogs.link_failures(self.get_toplevel(), failures)
+
+    def _on_separate_dir(self, check_menu_item):
+        set_store, tree_iter = self._set_list.get_selection().get_selected()
+        if tree_iter is None:
+            return
+
+        dialogs.link_failures(
+            self.get_toplevel(),
+            set_store.set_separate_dir(
+                tree_iter, check_menu_item.get_active()))
 
     def _on_name_edited(self, cell_text, tree_path, new_name):
         new_name = new_name.strip()
@@ -264,42 +486,186 @@ class FontLib(Gtk.Paned):
                 _('_Delete')):
             return
 
-        row[SetStore.COL_FONTSET].remove_all_fonts()
-        set_store.remove(tree_iter)
+        self._font_list.cancel_import(row[SetStore.COL_FONTSET])
+        set_store.remove_set(tree_iter)
         if len(set_store) == 0:
             set_store.add_set(self._DEFAULT_SET_NAME)
             self._set_list.set_cursor(0)
 
     def add_fonts(self, paths):
-        """Add fonts to the currently selected set."""
+        """Add fonts to the currently selected set.
+
+        Fonts from directories are added recursively in background.
+        """
         font_set = self._font_list.font_set
-        if font_set is not None:
-            font_set.add_fonts(paths)
+        if font_set is None:
+            return
+
+        paths = list(paths)
+        if settings.get('skip_identical_fonts', False):
+            # Files are hashed in background anyway, so add everything
+            # in a single import; a second one would cancel the first.
+            self._font_list.import_folders(paths)
+            return
+
+        kinds = stat_service.get_kinds(paths)
+        files = []
+        dirs = []
+        for path in paths:
+            # Paths that don't respond are checked by the folder
+            # import in background, which also accepts font files.
+            if kinds[path] in (FileKind.DIR, FileKind.UNKNOWN):
+                dirs.append(path)
+            else:
+                files.append(path)
+
+        self._font_list.add_fonts(files)
+        if dirs:
+            self._font_list.import_folders(dirs)
+
+    def _on_modified(self, set_store):
+        if self._loading:
+            # Sets appended while loading are not modifications, and
+            # saving them now would lose the sets not loaded yet.
+            return
+
+        self._dirty = True
+        self._schedule_autosave()
+
+    def _schedule_autosave(self):
+        if self._autosave_source is None:
+            self._autosave_source = GLib.timeout_add_seconds(
+                self._AUTOSAVE_DELAY, self._on_autosave)
+
+    def _on_autosave(self):
+        self._autosave_source = None
+        self._save_sets()
+        settings.save()
+        return GLib.SOURCE_REMOVE
+
+    def _save_sets(self):
+        """Save sets in background if they were modified."""
+        if not self._dirty:
+            return
+        self._dirty = False
+
+        # The snapshot is taken here, in the main thread; only the
+        # serialization is done by the writer.
+        json_sets = self._set_store.as_json
+        if set_db.is_enabled():
+            cores = [row[SetStore.COL_FONTSET].core for row in self._set_store]
+            writer.call(
+                config.SETS_DB_FILE,
+                lambda: self._save_sets_to_db(json_sets, cores))
+        else:
+            writer.write(
+                self._FILE,
+                lambda: json.dumps(json_sets, ensure_ascii=False))
+
+    @staticmethod
+    def _save_sets_to_db(json_sets, cores):
+        """Save sets to set_db; called by the writer."""
+        ids = set_db.db.save(json_sets)
+        if ids is not None:
+            # New sets get their ids. Assigning an attribute is atomic,
+            # so it's safe to do from the writer thread; sets saved
+            # before the ids arrive are matched by name.
+            for core, set_id in zip(cores, ids):
+                core.db_id = set_id
 
     def save_state(self):
         settings['splitter_position'] = self.get_position()
+        # Sets that are not loaded yet would be lost.
+        if not self._loading:
+            settings['selected_set'] = (
+                self._set_list.get_cursor()[0][0] + 1)
 
-        settings['selected_set'] = self._set_list.get_cursor()[0][0] + 1
-        try:
-            with open(self._FILE, 'w', encoding='utf-8') as f:
-                json.dump(
-                    self._set_store.as_json, f, ensure_ascii=False, indent=2)
-        except OSError:
-            pass
+        if self._autosave_source is not None:
+            GLib.source_remove(self._autosave_source)
+            self._autosave_source = None
+
+        if not self._loading:
+            self._save_sets()
+        settings.save()
+        writer.flush()
 
     def load_state(self):
+        """Load sets in background.
+
+        The sets are linked by the link worker, so the window can be
+        shown before they are ready; the lists are insensitive until
+        then.
+        """
         self.set_position(
             settings.get('splitter_position', self.get_position()))
 
         try:
-            with open(self._FILE, 'r', encoding='utf-8') as f:
-                self._set_store.as_json = json.load(f)
-        except (KeyError, ValueError, OSError):
-            pass
+            set_dirs = [
+                entry.path for entry in os.scandir(config.SET_LINKS_DIR)
+                if entry.is_dir(follow_symlinks=False)]
+        except OSError:
+            set_dirs = []
+
+        read_fonts = None
+        with profiler.phase('read_sets'):
+            try:
+                if set_db.is_enabled():
+                    # Fonts are read set by set in the link worker.
+                    json_sets = set_db.db.read_sets()
+                    read_fonts = set_db.db.read_fonts
+                else:
+                    with open(self._FILE, 'r', encoding='utf-8') as f:
+                        json_sets = json.load(f)
+            except (ValueError, OSError):
+                json_sets = []
+
+        self._loading = True
+        profiler.begin('link_sets')
+        self._set_list.set_sensitive(False)
+        self._font_list.set_sensitive(False)
+        # Links left after a crash, as well as links in separate
+        # directories of sets, are reused, and those that are no
+        # longer needed are removed.
+        self._set_store.load_json_async(
+            json_sets,
+            linker.reconcile(config.FONTS_DIR, *set_dirs),
+            lambda: self._on_sets_loaded(set_dirs),
+            read_fonts)
+
+    def _on_sets_loaded(self, set_dirs):
+        profiler.end('link_sets')
+        self._loading = False
+        self._set_list.set_sensitive(True)
+        self._font_list.set_sensitive(True)
+        self._btn_cancel_links.set_sensitive(True)
+
+        # Sets linked before the index of installed fonts was ready
+        # missed the update.
+        if not font_utils.installed_fonts.is_loading:
+            self._set_store.update_installed()
+
+        # Directories of deleted sets are empty now.
+        used_dirs = set(
+            row[SetStore.COL_FONTSET].core.dir_name
+            for row in self._set_store)
+        for path in set_dirs:
+            if os.path.basename(path) in used_dirs:
+                continue
+            try:
+                os.rmdir(path)
+            except OSError:
+                pass
 
         if len(self._set_store) == 0:
             self._set_store.add_set(self._DEFAULT_SET_NAME)
+            # Loading is not a modification.
+            self._dirty = False
+            if self._autosave_source is not None:
+                GLib.source_remove(self._autosave_source)
+                self._autosave_source = None
 
         tree_path = max(0, settings.get('selected_set', 1) - 1)
+        if tree_path >= len(self._set_store):
+            tree_path = 0
         self._set_list.set_cursor(tree_path)
         self._set_list.scroll_to_cell(tree_path, None, False, 0, 0)
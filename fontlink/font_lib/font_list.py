@@ -1,11 +1,17 @@
 
 from gettext import gettext as _, ngettext
 import os
+import threading
 
-from gi.repository import Gtk, Gdk, GLib
+from gi.repository import Gtk, Gdk, GLib, GObject
 
+from .. import content_index
 from .. import dialogs
+from .. import font_metadata
 from .. import font_utils
+from ..font_scanner import FontScanner
+from ..settings import settings
+from ..stat_service import FileKind, service as stat_service
 from .models import FontSet
 
 
@@ -18,23 +24,59 @@ def _show_uri(uri, window):
 
 class FontList(Gtk.Grid):
 
+    __gsignals__ = {
+        # Emitted with Gtk.Menu before the context menu is shown, and
+        # the path of the font if exactly one font is selected (or
+        # None), so that the owner can add its own items.
+        'populate-popup': (
+            GObject.SignalFlags.RUN_LAST, None, (object, object)),
+        }
+
     class _ViewColumn:
         TOGGLE = 0
         NAME = 1
+        FAMILY = 2
+        STYLE = 3
 
     class _PathAction:
         OPEN = 0
         OPEN_DIR = 1
         COPY = 2
 
+    # Interval (ms) of polling the folder import for new fonts.
+    _IMPORT_POLL_INTERVAL = 100
+    # Maximum number of fonts added to the set per poll, so that
+    # the UI stays responsive during the import of huge folders.
+    _IMPORT_BATCH_SIZE = 2000
+
     def __init__(self):
         super().__init__(orientation=Gtk.Orientation.VERTICAL)
+        self._scanner = None
+        self._import_font_set = None
+        self._font_set = None
+        self._font_set_handlers = []
+        self._duplicates_search = None
+        self._metadata_reader = None
+        self._metadata_paths = []
+        # Gtk.ListStore with rows of fonts matching the filter (in the
+        # format of FontSet) and a set of their slots, or None if the
+        # filter is empty.
+        self._filter = None
+        self._matches = None
         self._create_ui()
 
     def _create_ui(self):
+        self._filter_entry = Gtk.SearchEntry(
+            placeholder_text=_('Filter fonts'),
+            tooltip_text=_(
+                'Show only fonts whose names contain all the words'),
+            margin=3)
+        self._filter_entry.connect('search-changed', self._on_filter_changed)
+        self.add(self._filter_entry)
+
         self._font_list = Gtk.TreeView(
             fixed_height_mode=True,
-            headers_visible=False,
+            headers_visible=True,
             rubber_banding=True,
             has_tooltip=True)
         self._font_list.connect('button-press-event', self._on_button_press)
@@ -52,27 +94,60 @@ class FontList(Gtk.Grid):
         scrolled.add(self._font_list)
         self.add(scrolled)
 
+        # Folder import progress
+
+        self._import_bar = Gtk.Grid(
+            column_spacing=6,
+            border_width=3,
+            no_show_all=True)
+        self.add(self._import_bar)
+
+        self._import_progress = Gtk.ProgressBar(
+            show_text=True,
+            hexpand=True,
+            valign=Gtk.Align.CENTER)
+        self._import_progress.show()
+        self._import_bar.add(self._import_progress)
+
+        btn_cancel_import = Gtk.Button(
+            label=_('Cancel'),
+            tooltip_text=_('Stop adding fonts from folders'))
+        btn_cancel_import.connect('clicked', self._on_cancel_import)
+        btn_cancel_import.show()
+        self._import_bar.add(btn_cancel_import)
+
         # Columns
 
         toggle = Gtk.CellRendererToggle()
         toggle.connect('toggled', self._on_toggled)
-        col_toggle = Gtk.TreeViewColumn(
-            '', toggle,
-            active=FontSet.COL_ENABLED,
-            activatable=FontSet.COL_LINKABLE
-            )
+        col_toggle = Gtk.TreeViewColumn('', toggle)
+        col_toggle.set_cell_data_func(toggle, self._toggle_data_func)
         col_toggle.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
         self._font_list.append_column(col_toggle)
 
         name = Gtk.CellRendererText()
         col_name = Gtk.TreeViewColumn(
             _('Fonts'), name,
-            text=FontSet.COL_NAME,
-            sensitive=FontSet.COL_LINKABLE
+            text=FontSet.COL_NAME
             )
+        col_name.set_cell_data_func(name, self._name_data_func)
         col_name.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
         col_name.set_sort_column_id(FontSet.COL_NAME)
+        col_name.set_resizable(True)
+        col_name.set_fixed_width(200)
         self._font_list.append_column(col_name)
+        self._col_name = col_name
+
+        for title, key in (
+                (_('Family'), 'family'),
+                (_('Style'), 'style')):
+            cell = Gtk.CellRendererText()
+            col = Gtk.TreeViewColumn(title, cell)
+            col.set_cell_data_func(cell, self._metadata_data_func, key)
+            col.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+            col.set_resizable(True)
+            col.set_fixed_width(150)
+            self._font_list.append_column(col)
 
         # Toolbar
 
@@ -87,6 +162,13 @@ class FontList(Gtk.Grid):
         btn_add.connect('clicked', self._on_add)
         toolbar.add(btn_add)
 
+        btn_add_folder = Gtk.ToolButton(
+            label=_('Add Folder…'),
+            icon_name='folder-new',
+            tooltip_text=_('Add all fonts from folders'))
+        btn_add_folder.connect('clicked', self._on_add_folder)
+        toolbar.add(btn_add_folder)
+
         btn_remove = Gtk.ToolButton(
             label=_('Remove'),
             icon_name='list-remove',
@@ -106,6 +188,89 @@ class FontList(Gtk.Grid):
         self._btn_clear = btn_clear
         toolbar.add(btn_clear)
 
+    # The model of the view is either the current set or the store of
+    # filtered fonts, so cell data functions take the core from
+    # self._font_set.
+
+    def _toggle_data_func(self, column, cell, model, tree_iter, data):
+        slot = model.get_value(tree_iter, FontSet.COL_SLOT)
+        cell.props.active = self._font_set.core.is_enabled(slot)
+        cell.props.activatable = self._font_set.core.is_linkable(slot)
+
+    def _name_data_func(self, column, cell, model, tree_iter, data):
+        slot = model.get_value(tree_iter, FontSet.COL_SLOT)
+        cell.props.sensitive = self._font_set.core.is_linkable(slot)
+
+    def _metadata_data_func(self, column, cell, model, tree_iter, key):
+        core = self._font_set.core
+        slot = model.get_value(tree_iter, FontSet.COL_SLOT)
+        metadata = font_metadata.cache.peek(core.get_path(slot))
+        cell.props.text = metadata[key] if metadata else None
+        cell.props.sensitive = core.is_linkable(slot)
+
+    def _get_model_font_path(self, model, tree_path):
+        """Return the path of the font from the model of the view.
+
+        tree_path -- Gtk.TreePath or Gtk.TreeIter.
+        """
+        slot = model[tree_path][FontSet.COL_SLOT]
+        return self._font_set.core.get_path(slot)
+
+    def _get_set_path(self, tree_path):
+        """Convert a path in the filter to the path in the current set."""
+        font_set = self._font_set
+        slot = self._filter[tree_path][FontSet.COL_SLOT]
+        return font_set.get_path(font_set.get_slot_iter(slot))
+
+    def _get_selected_rows(self):
+        """Return (font_set, tree_paths) of the selected fonts.
+
+        Unlike Gtk.TreeSelection.get_selected_rows(), the paths are
+        always in the current set rather than in its filter.
+        """
+        selection = self._font_list.get_selection()
+        model, tree_paths = selection.get_selected_rows()
+        if model is not None and model is self._filter:
+            tree_paths = sorted(
+                self._get_set_path(tree_path) for tree_path in tree_paths)
+        return self._font_set, tree_paths
+
+    def _apply_filter(self):
+        """Show only fonts matching the text of the filter entry.
+
+        Rows of the matching fonts are put in a new store that is
+        sorted before it's shown, so the cost depends on the number of
+        matches rather than on the size of the set.
+        """
+        font_set = self._font_set
+        if font_set is None:
+            return
+
+        matches = font_set.search(self._filter_entry.get_text())
+        if matches is None:
+            self._filter = None
+            self._matches = None
+            if self._font_list.get_model() is not font_set:
+                self._font_list.set_model(font_set)
+            return
+
+        # Keep the order chosen in the view.
+        sorted_model = font_set if self._filter is None else self._filter
+        is_sorted, sort_column_id, order = (
+            sorted_model.get_sort_column_id())
+
+        core = font_set.core
+        self._matches = matches
+        self._filter = Gtk.ListStore(int, str)
+        for slot in matches:
+            self._filter.append((slot, core.get_name(slot)))
+        if is_sorted:
+            self._filter.set_sort_column_id(sort_column_id, order)
+        self._font_list.set_model(self._filter)
+
+    def _on_filter_changed(self, entry):
+        self._apply_filter()
+
     def _on_button_press(self, widget, event):
         if event.type != Gdk.EventType.BUTTON_PRESS:
             return Gdk.EVENT_PROPAGATE
@@ -136,6 +301,25 @@ class FontList(Gtk.Grid):
         mi_add.connect('activate', self._on_add)
         menu.append(mi_add)
 
+        mi_add_folder = Gtk.MenuItem(
+            label=_('Add _Folder…'),
+            use_underline=True,
+            tooltip_text=_('Add all fonts from folders')
+            )
+        mi_add_folder.connect('activate', self._on_add_folder)
+        menu.append(mi_add_folder)
+
+        mi_skip_identical = Gtk.CheckMenuItem(
+            label=_('Skip _Identical Files'),
+            use_underline=True,
+            active=settings.get('skip_identical_fonts', False),
+            tooltip_text=_(
+                'Don\'t add files with the same contents as fonts '
+                'already in the set')
+            )
+        mi_skip_identical.connect('toggled', self._on_skip_identical)
+        menu.append(mi_skip_identical)
+
         menu.append(Gtk.SeparatorMenuItem())
 
         mi_open = Gtk.MenuItem(
@@ -167,6 +351,14 @@ class FontList(Gtk.Grid):
 
         menu.append(Gtk.SeparatorMenuItem())
 
+        mi_find_duplicates = Gtk.MenuItem(
+            label=_('Find _Duplicates…'),
+            use_underline=True,
+            tooltip_text=_('Find fonts with identical files in the set')
+            )
+        mi_find_duplicates.connect('activate', self._on_find_duplicates)
+        menu.append(mi_find_duplicates)
+
         mi_remove = Gtk.MenuItem(
             label=_('_Remove'),
             use_underline=True,
@@ -183,8 +375,32 @@ class FontList(Gtk.Grid):
         mi_clear.connect('activate', self._on_clear)
         menu.append(mi_clear)
 
-        font_set, tree_paths = selection.get_selected_rows()
+        menu.append(Gtk.SeparatorMenuItem())
+
+        mi_enable_shown = Gtk.MenuItem(
+            label=_('E_nable Shown'),
+            use_underline=True,
+            tooltip_text=_('Enable all fonts that match the filter')
+            )
+        mi_enable_shown.connect('activate', self._on_set_state_shown, True)
+        menu.append(mi_enable_shown)
+
+        mi_disable_shown = Gtk.MenuItem(
+            label=_('D_isable Shown'),
+            use_underline=True,
+            tooltip_text=_('Disable all fonts that match the filter')
+            )
+        mi_disable_shown.connect(
+            'activate', self._on_set_state_shown, False)
+        menu.append(mi_disable_shown)
+
+        if not self._matches:
+            mi_enable_shown.set_sensitive(False)
+            mi_disable_shown.set_sensitive(False)
+
+        font_set, tree_paths = self._get_selected_rows()
         num_selected = len(tree_paths)
+        path = None
 
         if num_selected != 1:
             mi_open.set_sensitive(False)
@@ -194,15 +410,21 @@ class FontList(Gtk.Grid):
                 mi_remove.set_sensitive(False)
                 mi_copy_path.set_sensitive(False)
         else:
-            path = font_set[tree_paths[0]][FontSet.COL_LINKS][0].source
-            if not os.path.isfile(path):
+            path = font_set.get_font_path(tree_paths[0])
+            dir_path = os.path.dirname(path)
+            kinds = stat_service.get_kinds((path, dir_path))
+            if kinds[path] != FileKind.FILE:
                 mi_open.set_sensitive(False)
-
-                if not os.path.isdir(os.path.dirname(path)):
-                    mi_open_dir.set_sensitive(False)
+            if kinds[dir_path] != FileKind.DIR:
+                mi_open_dir.set_sensitive(False)
 
         if font_set is None or len(font_set) == 0:
             mi_clear.set_sensitive(False)
+            mi_find_duplicates.set_sensitive(False)
+        elif self._duplicates_search is not None:
+            mi_find_duplicates.set_sensitive(False)
+
+        self.emit('populate-popup', menu, path)
 
         menu.show_all()
         menu.popup(None, None, None, None, event.button, event.time)
@@ -215,20 +437,42 @@ class FontList(Gtk.Grid):
         if not points_to_row:
             return False
 
-        font_set, tree_path, tree_iter = context[2:]
-        row = font_set[tree_iter]
-
-        font_path = row[FontSet.COL_LINKS][0].source
-        font_name = row[FontSet.COL_NAME]
+        model, tree_path, tree_iter = context[2:]
+        font_path = self._get_model_font_path(model, tree_iter)
+        font_name = os.path.basename(font_path)
         lines = [font_path]
 
-        if not os.path.isfile(font_path):
+        metadata = font_metadata.cache.peek(font_path)
+        if metadata:
+            for label, value in (
+                    (_('Family'), metadata['family']),
+                    (_('Style'), metadata['style']),
+                    (_('PostScript name'), metadata['ps_name'])):
+                if value:
+                    lines.append('{}: {}'.format(
+                        label, GLib.markup_escape_text(value)))
+            if metadata['num_faces'] > 1:
+                lines.append(
+                    ngettext(
+                        'Collection of {num} font',
+                        'Collection of {num} fonts',
+                        metadata['num_faces']).format(
+                            num=metadata['num_faces']))
+
+        kind = stat_service.get_kind(font_path)
+        if kind == FileKind.UNKNOWN:
+            lines.append(_('• File is not available: the drive does not '
+                           'respond'))
+        elif kind != FileKind.FILE:
             lines.append(_('• File does not exist'))
 
-        if font_name in font_utils.INSTALLED_FONTS:
+        installed_dir = font_utils.installed_fonts.get(font_name)
+        if installed_dir is not None:
             lines.append(
                 _('• Already installed in {directory}').format(
-                    directory=font_utils.INSTALLED_FONTS[font_name]))
+                    directory=installed_dir))
+        elif font_utils.installed_fonts.is_loading:
+            lines.append(_('• Checking installed fonts…'))
 
         if len(lines) > 1:
             lines.insert(1, '')
@@ -237,45 +481,240 @@ class FontList(Gtk.Grid):
         tree_view.set_tooltip_row(tooltip, tree_path)
         return True
 
-    def _on_add(self, widget):
-        font_set = self._font_list.get_model()
+    def add_fonts(self, paths):
+        """Add font files to the current set.
+
+        If identical files should be skipped, the files are added in
+        background with import_folders(), since they are hashed.
+        """
+        font_set = self._font_set
         if font_set is None:
             return
 
+        if settings.get('skip_identical_fonts', False):
+            self.import_folders(paths)
+            return
+
+        dialogs.link_failures(self.get_toplevel(), font_set.add_fonts(paths))
+        self._btn_clear.set_sensitive(len(font_set) > 0)
+        self._read_metadata(font_set, new_only=True)
+
+    def _on_add(self, widget):
+        if self._font_set is None:
+            return
+
         paths = dialogs.open_fonts(self.get_toplevel())
+        if paths:
+            self.add_fonts(paths)
+
+    def _on_skip_identical(self, check_menu_item):
+        settings['skip_identical_fonts'] = check_menu_item.get_active()
+
+    def _on_find_duplicates(self, widget):
+        font_set = self._font_set
+        if font_set is None or self._duplicates_search is not None:
+            return
+
+        # Only the current set is searched, as with "Skip Identical
+        # Files": the same file in several sets is linked only once
+        # anyway, and removing a font from another set because this
+        # one has a copy would break that set when this one is
+        # disabled.
+        core = font_set.core
+        paths = [core.get_path(slot) for slot in core.slots()]
+        self._duplicates_search = threading.Thread(
+            target=self._find_duplicates,
+            args=(font_set, paths),
+            daemon=True)
+        self._duplicates_search.start()
+
+    def _find_duplicates(self, font_set, paths):
+        groups = content_index.index.find_duplicates(paths)
+        GLib.idle_add(self._on_duplicates_found, font_set, groups)
+
+    def _on_duplicates_found(self, font_set, groups):
+        self._duplicates_search = None
+        if not dialogs.duplicates(self.get_toplevel(), groups):
+            return GLib.SOURCE_REMOVE
+
+        # Keep the first file of each group. The set could be changed
+        # during the search, so only the fonts that are still in the
+        # set are removed.
+        to_remove = set()
+        core = font_set.core
+        for group in groups:
+            for path in group[1:]:
+                slot = core.find(os.path.basename(path))
+                if slot is not None and core.get_path(slot) == path:
+                    to_remove.add(slot)
+
+        font_set.remove_fonts(
+            [row.path for row in font_set
+             if row[FontSet.COL_SLOT] in to_remove])
+        if font_set is self._font_set:
+            self._btn_clear.set_sensitive(len(font_set) > 0)
+        return GLib.SOURCE_REMOVE
+
+    def _read_metadata(self, font_set, new_only=False):
+        """Read metadata of fonts from the set in background.
+
+        new_only -- only read fonts that were never read before;
+            otherwise, all fonts are checked for changes.
+        """
+        core = font_set.core
+        paths = [core.get_path(slot) for slot in core.slots()]
+        if new_only:
+            paths = [
+                path for path in paths
+                if not font_metadata.cache.contains(path)]
         if not paths:
             return
-        font_set.add_fonts(paths)
-        self._btn_clear.set_sensitive(len(font_set) > 0)
+
+        # Paths requested while the reader is busy are read next.
+        self._metadata_paths.extend(paths)
+        if self._metadata_reader is None:
+            self._start_metadata_reader()
+
+    def _start_metadata_reader(self):
+        paths = self._metadata_paths
+        self._metadata_paths = []
+        self._metadata_reader = threading.Thread(
+            target=self._read_metadata_thread,
+            args=(paths,),
+            daemon=True)
+        self._metadata_reader.start()
+
+    def _read_metadata_thread(self, paths):
+        font_metadata.cache.get_metadata(paths)
+        GLib.idle_add(self._on_metadata_read, paths)
+
+    def _on_metadata_read(self, paths):
+        self._metadata_reader = None
+        if self._font_set is not None:
+            self._font_set.update_search_texts(paths)
+            if self._matches is not None:
+                # Fonts can match by their family names now.
+                self._apply_filter()
+        self._font_list.queue_draw()
+        if self._metadata_paths:
+            self._start_metadata_reader()
+        return GLib.SOURCE_REMOVE
+
+    def _on_add_folder(self, widget):
+        if self._font_set is None:
+            return
+
+        paths = dialogs.open_folders(self.get_toplevel())
+        if paths:
+            self.import_folders(paths)
+
+    def import_folders(self, paths):
+        """Recursively add fonts from folders to the current set.
+
+        The folders are scanned in background, and the found fonts are
+        added in batches. Paths of font files can be given as well. If
+        identical files should be skipped, they are also hashed in
+        background. Only one import can run at a time; a new one
+        cancels the previous.
+        """
+        font_set = self._font_set
+        if font_set is None:
+            return
+
+        self.cancel_import()
+
+        known_paths = None
+        if settings.get('skip_identical_fonts', False):
+            # Only the current set: sets are enabled independently,
+            # so a font skipped because another set has an identical
+            # file would be missing whenever that set is disabled.
+            core = font_set.core
+            known_paths = [core.get_path(slot) for slot in core.slots()]
+
+        self._scanner = FontScanner(paths, known_paths=known_paths)
+        self._import_font_set = font_set
+        self._update_import_progress()
+        self._import_bar.show()
+        GLib.timeout_add(self._IMPORT_POLL_INTERVAL, self._on_import_poll)
+
+    def cancel_import(self, font_set=None):
+        """Cancel the folder import.
+
+        If font_set is not None, the import is only cancelled if it
+        adds fonts to this set.
+        """
+        if self._scanner is None:
+            return
+        if font_set is not None and font_set is not self._import_font_set:
+            return
+
+        self._scanner.cancel()
+        self._finish_import()
+
+    def _finish_import(self):
+        self._scanner = None
+        self._import_font_set = None
+        self._import_bar.hide()
+
+    def _update_import_progress(self):
+        self._import_progress.set_text(
+            ngettext(
+                'Found {num} font',
+                'Found {num} fonts',
+                self._scanner.num_fonts).format(num=self._scanner.num_fonts))
+        self._import_progress.pulse()
+
+    def _on_import_poll(self):
+        if self._scanner is None:
+            return GLib.SOURCE_REMOVE
+
+        # Check before taking fonts so that nothing is lost if the
+        # search finishes in between.
+        is_done = self._scanner.is_done
+
+        fonts = self._scanner.get_fonts(self._IMPORT_BATCH_SIZE)
+        if fonts:
+            self._import_font_set.add_fonts(fonts)
+            if self._import_font_set is self._font_set:
+                self._btn_clear.set_sensitive(len(self._import_font_set) > 0)
+                self._read_metadata(self._font_set, new_only=True)
+
+        if is_done and len(fonts) < self._IMPORT_BATCH_SIZE:
+            self._finish_import()
+            return GLib.SOURCE_REMOVE
+
+        self._update_import_progress()
+        return GLib.SOURCE_CONTINUE
+
+    def _on_cancel_import(self, button):
+        self.cancel_import()
 
     def _on_path_action(self, widget, path_action):
-        selection = self._font_list.get_selection()
-        font_set, tree_paths = selection.get_selected_rows()
+        font_set, tree_paths = self._get_selected_rows()
         if font_set is None or not tree_paths:
             return
 
         if path_action == self._PathAction.COPY:
             paths = []
             for tree_path in tree_paths:
-                paths.append(font_set[tree_path][FontSet.COL_LINKS][0].source)
+                paths.append(font_set.get_font_path(tree_path))
 
             clipboard = Gtk.Clipboard.get(Gdk.SELECTION_CLIPBOARD)
             clipboard.set_text('\n'.join(paths), -1)
         else:
-            path = font_set[tree_paths[0]][FontSet.COL_LINKS][0].source
+            path = font_set.get_font_path(tree_paths[0])
 
             if path_action == self._PathAction.OPEN_DIR:
                 path = os.path.dirname(path)
-                if not os.path.isdir(path):
+                if stat_service.get_kind(path) != FileKind.DIR:
                     return
-            elif not os.path.isfile(path):
+            elif stat_service.get_kind(path) != FileKind.FILE:
                 return
 
             _show_uri(GLib.filename_to_uri(path), self.get_toplevel())
 
     def _on_remove(self, widget):
-        selection = self._font_list.get_selection()
-        font_set, tree_paths = selection.get_selected_rows()
+        font_set, tree_paths = self._get_selected_rows()
         if font_set is None or not tree_paths:
             return
 
@@ -297,11 +736,20 @@ class FontList(Gtk.Grid):
             self._btn_clear.set_sensitive(len(font_set) > 0)
 
     def _on_toggled(self, cell_toggle, tree_path):
-        font_set = self._font_list.get_model()
-        font_set.toggle_state(tree_path)
+        font_set = self._font_set
+        tree_path = Gtk.TreePath(tree_path)
+        if self._font_list.get_model() is not self._filter:
+            dialogs.link_failures(
+                self.get_toplevel(), font_set.toggle_state(tree_path))
+            return
+
+        failures = font_set.toggle_state(self._get_set_path(tree_path))
+        # The filter doesn't get "row-changed" of the set.
+        self._filter.row_changed(tree_path, self._filter.get_iter(tree_path))
+        dialogs.link_failures(self.get_toplevel(), failures)
 
     def _on_clear(self, widget):
-        font_set = self._font_list.get_model()
+        font_set = self._font_set
         if (font_set is not None and
                 dialogs.confirmation(
                     self.get_toplevel(),
@@ -311,22 +759,94 @@ class FontList(Gtk.Grid):
             font_set.remove_all_fonts()
             self._btn_clear.set_sensitive(False)
 
+    def _on_set_state_shown(self, widget, enabled):
+        font_set = self._font_set
+        if font_set is None or not self._matches:
+            return
+
+        font_set.set_state_all_async(
+            enabled, self._matches,
+            lambda failures: dialogs.link_failures(
+                self.get_toplevel(), failures))
+
     def _on_row_activated(self, font_list, tree_path, column):
         if column == font_list.get_column(self._ViewColumn.NAME):
-            font_set = font_list.get_model()
-            path = font_set[tree_path][FontSet.COL_LINKS][0].source
-            if not os.path.isfile(path):
+            path = self._get_model_font_path(
+                font_list.get_model(), tree_path)
+            if stat_service.get_kind(path) != FileKind.FILE:
                 return
 
             _show_uri(GLib.filename_to_uri(path), self.get_toplevel())
 
+    def select_font(self, font_path):
+        """Select the font of the current set and scroll to it.
+
+        The filter is cleared if it hides the font.
+        """
+        font_set = self._font_set
+        if font_set is None:
+            return
+
+        core = font_set.core
+        slot = core.find(os.path.basename(font_path))
+        if slot is None or core.get_path(slot) != font_path:
+            return
+
+        if self._matches is not None and slot not in self._matches:
+            self._filter_entry.set_text('')
+            self._apply_filter()
+
+        if self._font_list.get_model() is self._filter:
+            for row in self._filter:
+                if row[FontSet.COL_SLOT] == slot:
+                    tree_path = row.path
+                    break
+            else:
+                return
+        else:
+            tree_path = font_set.get_path(font_set.get_slot_iter(slot))
+        self._font_list.set_cursor(tree_path, None, False)
+        self._font_list.scroll_to_cell(tree_path, None, True, 0.5, 0)
+
+    def _on_states_changed(self, font_set):
+        self._font_list.queue_draw()
+
+    def _on_fonts_changed(self, font_set, added_paths, removed_paths):
+        if self._matches is not None:
+            # The filter is not updated with the rows of the set.
+            self._apply_filter()
+
+    def _on_bulk_update(self, font_set, started):
+        if started:
+            # The view would process each new row.
+            self._font_list.set_model(None)
+            self._filter = None
+        else:
+            self._font_list.set_model(font_set)
+            self._apply_filter()
+            self._font_list.set_search_column(FontSet.COL_NAME)
+
     @property
     def font_set(self):
-        return self._font_list.get_model()
+        return self._font_set
 
     @font_set.setter
     def font_set(self, font_set):
+        for handler in self._font_set_handlers:
+            self._font_set.disconnect(handler)
+        self._font_set_handlers = []
+
+        self._font_set = font_set
         self._font_list.set_model(font_set)
+        self._filter = None
+        self._matches = None
         if font_set is not None:
+            self._font_set_handlers = [
+                font_set.connect('bulk-update', self._on_bulk_update),
+                font_set.connect('states-changed', self._on_states_changed),
+                font_set.connect('fonts-changed', self._on_fonts_changed),
+                ]
             self._font_list.set_search_column(FontSet.COL_NAME)
             self._btn_clear.set_sensitive(len(font_set) > 0)
+            self._read_metadata(font_set)
+            self._apply_filter()
@@ -1,182 +1,533 @@
 
-from functools import wraps
+from functools import partial, wraps
 from collections import OrderedDict
+from contextlib import contextmanager
 import os
 
-from gi.repository import Gtk, GObject
+from gi.repository import Gtk, GLib, GObject
 
-from .. import config
+from .. import file_status
+from .. import font_metadata
 from .. import linker
-from .. import font_utils
+from ..link_worker import LinkJob, worker
 from .. import utils
+from ..font_search import SearchIndex
+from ..font_set_core import FontSetCore
+from .dir_watcher import dir_watcher
 
 
-def _watch_num_active(method):
-    """Automatically notify if FontSet.num_active was changed by method."""
+def _watch_changes(method):
+    """Automatically notify about changes made by FontSet method.
+
+    "notify::num-active" is emitted if FontSet.num_active was changed,
+    and "modified" if the saved state of the set was changed.
+    """
     @wraps(method)
     def wrapper(font_set, *args, **kwargs):
         num_active_before = font_set.num_active
-        method(font_set, *args, **kwargs)
+        generation_before = font_set.core.generation
+        result = method(font_set, *args, **kwargs)
         if font_set.num_active != num_active_before:
             font_set.notify('num-active')
+        if font_set.core.generation != generation_before:
+            font_set.emit('modified')
+        return result
     return wrapper
 
 
-class FontSet(Gtk.ListStore):
+def _get_paths(core, slots):
+    return [core.get_path(slot) for slot in slots]
 
-    # COL_LINKS is a tuple of linker.Link.
-    # The first pair is always present and describes the main font file.
-    # Others (if any) are additional files (.afm, .pfm, etc.).
-    COL_LINKS = 0
-    COL_ENABLED = 1
 
-    # COL_LINKABLE is True if the file exists and the font with the
-    # same filename wasn't installed in the system at the moment of
-    # FontLink launch.
-    COL_LINKABLE = 2
-    COL_NAME = 3
+def _check_files(paths, callback, timeout=None):
+    """Check font files without blocking the main thread.
 
-    def __init__(self):
+    See file_status.FileStatusCache.check_files(); callback is called
+    in the main thread with statuses checked after the timeout.
+
+    Returns {path: FileStatus} of the files checked within the timeout.
+    """
+    return file_status.cache.check_files(
+        paths,
+        timeout,
+        lambda statuses: GLib.idle_add(callback, statuses))
+
+
+def _change_links(enabled, changes):
+    """Create or remove links of changes from plan_state_all()."""
+    link_groups = [link_group for slot, name, link_group in changes]
+    if enabled:
+        return linker.create_links_batch(link_groups)
+    return linker.remove_links_batch(link_groups)
+
+
+def _load_json_set(json_set, read_fonts=None):
+    """Create FontSetCore from JSON, linking its enabled fonts.
+
+    Doesn't touch GTK, so it can be called by the link worker.
+
+    read_fonts -- see SetStore.load_json_async().
+
+    Returns (name, core, failures).
+    """
+    fonts = json_set['fonts'] if read_fonts is None else read_fonts(
+        json_set)
+    core = FontSetCore()
+    core.db_id = json_set.get('id')
+    failures = []
+    if 'dir' in json_set:
+        failures.extend(core.set_separate_dir(
+            True, json_set['dir'], json_set.get('active', True)))
+    slots, add_failures = core.add_fonts(
+        (f['path'], f['enabled']) for f in fonts)
+    failures.extend(add_failures)
+    return json_set['name'], core, failures
+
+
+class FontSet(Gtk.ListStore):
+    """Gtk.TreeModel of FontSetCore.
+
+    Rows only contain slots of fonts in the core and filenames (for
+    sorting and searching); everything else is stored in the core.
+    Bulk operations don't touch the rows, so views should get states
+    of fonts from the core and redraw on "states-changed".
+    """
+
+    COL_SLOT = 0
+    COL_NAME = 1
+
+    # Minimal number of new rows to add them in bulk mode.
+    _BULK_THRESHOLD = 100
+
+    # Number of fonts whose links are changed in one chunk by
+    # set_state_all_async(); states are updated after each chunk.
+    _LINK_CHUNK_SIZE = 500
+    # Interval (ms) of polling the link job.
+    _LINK_POLL_INTERVAL = 100
+
+    __gsignals__ = {
+        # Emitted with True before and with False after adding many
+        # rows at once. Views should detach from the model in between
+        # to avoid processing each row separately.
+        'bulk-update': (GObject.SignalFlags.RUN_FIRST, None, (bool,)),
+        # Emitted when fonts are added, removed, or change their state.
+        'modified': (GObject.SignalFlags.RUN_FIRST, None, ()),
+        # Emitted when states of many fonts may have been changed
+        # without "row-changed".
+        'states-changed': (GObject.SignalFlags.RUN_FIRST, None, ()),
+        # Emitted with lists of paths of added and removed fonts.
+        'fonts-changed': (
+            GObject.SignalFlags.RUN_FIRST, None, (object, object)),
+        }
+
+    def __init__(self, core=None):
+        """Create a set.
+
+        core -- FontSetCore to take the fonts from. Links of its
+            enabled fonts must already be created, and their
+            directories must be watched.
+        """
         super().__init__(
-            object,
-            bool,
-            bool,
+            int,
             str,
             )
 
-        # Number of currently active fonts.
-        self._num_active = 0
-        # Cached font names for faster filtering of existing fonts.
-        self._fonts = set()
+        self._core = FontSetCore() if core is None else core
+        # {slot: Gtk.TreeIter} of all rows. Iters of Gtk.ListStore
+        # stay valid until their rows are removed.
+        self._iters_by_slot = {}
+        self._bulk_depth = 0
+        self._saved_sort = None
+        # Built on the first search() and then kept up to date.
+        self._search_index = None
+
+        self._link_job = None
+        self._link_poll_source = None
+        self._link_enabled = False
+        self._link_failures = []
+        self._link_callback = None
 
         self.set_sort_column_id(self.COL_NAME, Gtk.SortType.ASCENDING)
+        self._append_slots(list(self._core.slots()))
+
+    @property
+    def core(self):
+        return self._core
+
+    @contextmanager
+    def bulk_update(self):
+        """Context manager to add many rows at once.
+
+        Sorting is disabled and views are asked to detach (see the
+        "bulk-update" signal) until the outermost context is left,
+        so the rows are sorted only once.
+        """
+        if self._bulk_depth == 0:
+            self.emit('bulk-update', True)
+            is_sorted, sort_column_id, order = self.get_sort_column_id()
+            if is_sorted:
+                self._saved_sort = (sort_column_id, order)
+                self.set_sort_column_id(
+                    Gtk.TREE_SORTABLE_UNSORTED_SORT_COLUMN_ID, order)
+        self._bulk_depth += 1
+        try:
+            yield
+        finally:
+            self._bulk_depth -= 1
+            if self._bulk_depth == 0:
+                if self._saved_sort is not None:
+                    self.set_sort_column_id(*self._saved_sort)
+                    self._saved_sort = None
+                self.emit('bulk-update', False)
+
+    def _get_search_text(self, slot):
+        text = self._core.get_name(slot)
+        metadata = font_metadata.cache.peek(self._core.get_path(slot))
+        if metadata:
+            text = ' '.join(
+                [text] + [
+                    metadata[key] for key in ('family', 'style')
+                    if metadata[key]])
+        return text
+
+    def search(self, query):
+        """Return a set of slots of fonts matching the query.
+
+        See SearchIndex.search().
+        """
+        if self._search_index is None:
+            self._search_index = SearchIndex()
+            for slot in self._core.slots():
+                self._search_index.add(slot, self._get_search_text(slot))
+        return self._search_index.search(query)
+
+    def update_search_texts(self, paths):
+        """Update search texts of fonts, e.g. after reading metadata."""
+        if self._search_index is None:
+            return
+
+        core = self._core
+        for path in paths:
+            slot = core.find(os.path.basename(path))
+            if slot is not None and core.get_path(slot) == path:
+                self._search_index.add(slot, self._get_search_text(slot))
+
+    def _append_slots(self, slots):
+        core = self._core
+        if self._search_index is not None:
+            for slot in slots:
+                self._search_index.add(slot, self._get_search_text(slot))
+
+        if len(slots) < self._BULK_THRESHOLD:
+            for slot in slots:
+                self._iters_by_slot[slot] = self.append(
+                    (slot, core.get_name(slot)))
+            return
+
+        with self.bulk_update():
+            for slot in slots:
+                self._iters_by_slot[slot] = self.append(
+                    (slot, core.get_name(slot)))
+
+    def get_slot(self, tree_path):
+        """Return the slot of the font in the core.
+
+        tree_path -- Gtk.TreePath or Gtk.TreeIter.
+        """
+        return self[tree_path][self.COL_SLOT]
+
+    def get_slot_iter(self, slot):
+        """Return Gtk.TreeIter of the row of the slot or None."""
+        return self._iters_by_slot.get(slot)
+
+    def get_font_path(self, tree_path):
+        return self._core.get_path(self.get_slot(tree_path))
 
     @GObject.Property
     def num_active(self):
         """Number of currently active (linked) fonts."""
-        return self._num_active
+        return self._core.num_active
+
+    @property
+    def as_json(self):
+        """See FontSetCore.as_json."""
+        return self._core.as_json
 
-    @_watch_num_active
+    @_watch_changes
     def add_fonts(self, items):
         """Add fonts to the set.
 
-        items -- iterable of paths and/or pairs (path, state).
-        """
-        for item in items:
-            if isinstance(item, str):
-                path = item
-                enabled = True
-            else:
-                path, enabled = item
-
-            font_dir, font_name = os.path.split(path)
-            font_root_name, font_ext = os.path.splitext(font_name)
-            if (font_ext.lower() not in font_utils.FONT_EXTENSIONS or
-                    font_name in self._fonts or
-                    font_dir.startswith(config.FONTS_DIR)):
-                continue
+        See FontSetCore.add_fonts() for the arguments. Files are checked
+        by stat_service, so a hung mount doesn't block the main thread;
+        fonts whose files are not checked within its timeout are added
+        as missing, and updated once the check is done.
 
-            links = [
-                linker.Link(path, os.path.join(config.FONTS_DIR, font_name))]
-
-            installed = font_name in font_utils.INSTALLED_FONTS
-            file_exists = os.path.isfile(path)
-            if installed:
-                enabled = True
-            elif not file_exists:
-                enabled = False
-            elif font_ext.lower() in font_utils.FONT_EXTENSIONS_PS:
-                metrics_path = font_utils.find_metrics(
-                    font_dir, font_root_name)
-                if metrics_path:
-                    links.append(
-                        linker.Link(
-                            metrics_path,
-                            os.path.join(
-                                config.FONTS_DIR,
-                                os.path.basename(metrics_path))))
-
-            links = tuple(links)
-
-            self.append(
-                (
-                    links,
-                    enabled,
-                    file_exists and not installed,
-                    font_name))
-            self._fonts.add(font_name)
-
-            if enabled:
-                self._num_active += 1
-                if not installed:
-                    linker.create_links(links)
-
-    @_watch_num_active
+        Returns a list of failed linker.LinkResult.
+        """
+        items = list(items)
+        statuses = _check_files(
+            (item if isinstance(item, str) else item[0] for item in items),
+            self._on_files_checked)
+        slots, failures = self._core.add_fonts(items, statuses)
+        self._append_slots(slots)
+        paths = _get_paths(self._core, slots)
+        dir_watcher.watch_paths(paths)
+        if paths:
+            self.emit('fonts-changed', paths, [])
+        return failures
+
+    @_watch_changes
     def add_fonts_from(self, font_set):
-        for row in font_set:
-            font_name = row[font_set.COL_NAME]
-            if font_name in self._fonts:
-                continue
-
-            self.append(row[:])
-            self._fonts.add(font_name)
-
-            if row[font_set.COL_ENABLED]:
-                self._num_active += 1
-                if row[font_set.COL_LINKABLE]:
-                    linker.create_links(row[font_set.COL_LINKS])
+        """Add fonts from another FontSet or FontSetRecord.
 
-    @_watch_num_active
+        Returns a list of failed linker.LinkResult.
+        """
+        slots, failures = self._core.add_fonts_from(font_set.core)
+        self._append_slots(slots)
+        paths = _get_paths(self._core, slots)
+        dir_watcher.watch_paths(paths)
+        if paths:
+            self.emit('fonts-changed', paths, [])
+        return failures
+
+    @_watch_changes
     def remove_fonts(self, tree_paths):
+        slots = [self.get_slot(tree_path) for tree_path in tree_paths]
+        paths = _get_paths(self._core, slots)
+        self._core.remove_fonts(slots)
+        if self._search_index is not None:
+            for slot in slots:
+                self._search_index.remove(slot)
+        for slot in slots:
+            del self._iters_by_slot[slot]
         for tree_path in reversed(tree_paths):
-            row = self[tree_path]
-            if row[self.COL_ENABLED]:
-                self._num_active -= 1
-                if row[self.COL_LINKABLE]:
-                    linker.remove_links(row[self.COL_LINKS])
-            self._fonts.discard(row[self.COL_NAME])
             self.remove(self.get_iter(tree_path))
+        dir_watcher.unwatch_paths(paths)
+        if paths:
+            self.emit('fonts-changed', [], paths)
 
-    @_watch_num_active
+    @_watch_changes
     def remove_all_fonts(self):
-        for row in self:
-            if row[self.COL_LINKABLE] and row[self.COL_ENABLED]:
-                linker.remove_links(row[self.COL_LINKS])
-        self._fonts.clear()
+        paths = _get_paths(self._core, self._core.slots())
+        self._core.remove_all_fonts()
+        if self._search_index is not None:
+            self._search_index.clear()
+        self._iters_by_slot.clear()
         self.clear()
-        self._num_active = 0
+        dir_watcher.unwatch_paths(paths)
+        if paths:
+            self.emit('fonts-changed', [], paths)
 
+    @_watch_changes
     def toggle_state(self, tree_path):
-        row = self[tree_path]
-        if not row[self.COL_LINKABLE]:
+        """Toggle the state of the font.
+
+        Returns a list of failed linker.LinkResult.
+        """
+        slot = self.get_slot(tree_path)
+        if not self._core.is_linkable(slot):
+            return []
+
+        failures = self._core.toggle_state(slot)
+        self.row_changed(tree_path, self.get_iter(tree_path))
+        return failures
+
+    @_watch_changes
+    def update_installed(self):
+        """See FontSetCore.update_installed()."""
+        if self._core.update_installed():
+            self.emit('states-changed')
+
+    @_watch_changes
+    def update_files(self, statuses):
+        """See FontSetCore.update_files().
+
+        Returns a list of failed linker.LinkResult.
+        """
+        changed, failures = self._core.update_files(statuses)
+        if changed:
+            self.emit('states-changed')
+        return failures
+
+    def _on_files_checked(self, statuses):
+        self.update_files(statuses)
+        return GLib.SOURCE_REMOVE
+
+    @_watch_changes
+    def set_state_all(self, state, slots=None):
+        """See FontSetCore.set_state_all()."""
+        self.cancel_link_job()
+        failures = self._core.set_state_all(state, slots)
+        self.emit('states-changed')
+        return failures
+
+    @property
+    def link_job(self):
+        """LinkJob of set_state_all_async() in progress, or None."""
+        return self._link_job
+
+    @_watch_changes
+    def set_state_all_async(self, state, slots=None, callback=None):
+        """Like set_state_all(), but change links in background.
+
+        Links are changed by the link worker, and states of fonts are
+        updated in batches as their links are done. A previous job in
+        progress is cancelled first.
+
+        callback -- called with a list of failed linker.LinkResult
+            when all links are done or the job is cancelled.
+
+        Returns LinkJob.
+        """
+        self.cancel_link_job()
+
+        changes = self._core.plan_state_all(state, slots)
+        # Fonts with missing files could be disabled right away.
+        self.emit('states-changed')
+
+        size = self._LINK_CHUNK_SIZE
+        self._link_job = worker.submit(LinkJob(
+            partial(_change_links, state),
+            [changes[i:i + size] for i in range(0, len(changes), size)]))
+        self._link_enabled = state
+        self._link_failures = []
+        self._link_callback = callback
+        self._link_poll_source = GLib.timeout_add(
+            self._LINK_POLL_INTERVAL, self._on_link_poll)
+        return self._link_job
+
+    def cancel_link_job(self):
+        """Cancel set_state_all_async() in progress.
+
+        Blocks until the chunk being processed is done; states of
+        fonts from done chunks are updated.
+        """
+        if self._link_job is None:
             return
 
-        new_state = not row[self.COL_ENABLED]
-        row[self.COL_ENABLED] = new_state
-        if new_state:
-            linker.create_links(row[self.COL_LINKS])
-            self._num_active += 1
-        else:
-            linker.remove_links(row[self.COL_LINKS])
-            self._num_active -= 1
+        self._link_job.cancel()
+        self._link_job.wait()
+        GLib.source_remove(self._link_poll_source)
+        self._on_link_poll()
+
+    def _on_link_poll(self):
+        job = self._link_job
+        if job is None:
+            # The callback runs a nested main loop (e.g. a dialog).
+            return GLib.SOURCE_REMOVE
+
+        # Check before taking results so that nothing is lost if the
+        # job finishes in between.
+        is_finished = job.is_finished
+        self._finish_link_chunks(job.take_results())
+        if not is_finished:
+            return GLib.SOURCE_CONTINUE
+
+        self._link_job = None
+        self._link_poll_source = None
+        if self._link_callback is not None:
+            self._link_callback(self._link_failures)
+        return GLib.SOURCE_REMOVE
+
+    @_watch_changes
+    def _finish_link_chunks(self, results):
+        if not results:
+            return
 
-        self.notify('num-active')
+        for changes, link_results in results:
+            self._link_failures.extend(
+                result for result in link_results if result.failed)
+            self._link_failures.extend(
+                self._core.finish_state_all(self._link_enabled, changes))
+        self.emit('states-changed')
 
-    @_watch_num_active
-    def set_state_all(self, state):
-        """Set the state for all fonts in the set."""
-        for row in self:
-            if (not row[self.COL_LINKABLE]
-                    or row[self.COL_ENABLED] == state):
-                continue
+    @_watch_changes
+    def plan_switch(self, enabled):
+        """See FontSetCore.plan_switch().
 
-            if state:
-                linker.create_links(row[self.COL_LINKS])
-                self._num_active += 1
-            else:
-                linker.remove_links(row[self.COL_LINKS])
-                self._num_active -= 1
-            row[self.COL_ENABLED] = state
+        set_state_all_async() in progress is cancelled first.
+        """
+        self.cancel_link_job()
+        changes = self._core.plan_switch(enabled)
+        self.emit('states-changed')
+        return changes
+
+    @_watch_changes
+    def finish_switch(self, enabled, changes):
+        """See FontSetCore.finish_switch()."""
+        failures = self._core.finish_switch(enabled, changes)
+        self.emit('states-changed')
+        return failures
+
+    @_watch_changes
+    def set_separate_dir(self, enabled):
+        """See FontSetCore.set_separate_dir()."""
+        self.cancel_link_job()
+        failures = self._core.set_separate_dir(enabled)
+        self.emit('states-changed')
+        return failures
+
+
+class FontSetRecord:
+    """Lightweight stand-in for a FontSet that is not shown.
+
+    The record is just a FontSetCore without a Gtk.TreeModel. It's
+    turned into a FontSet with materialize() once the set needs to be
+    shown or changed as a whole.
+    """
+
+    def __init__(self, core):
+        """Create a record.
+
+        core -- FontSetCore with already linked fonts.
+        """
+        self.core = core
+        dir_watcher.watch_paths(_get_paths(core, core.slots()))
+
+    def __len__(self):
+        return len(self.core)
+
+    @property
+    def num_active(self):
+        return self.core.num_active
+
+    @property
+    def as_json(self):
+        return self.core.as_json
+
+    def update_installed(self):
+        """See FontSetCore.update_installed()."""
+        return self.core.update_installed()
+
+    def update_files(self, statuses):
+        """See FontSetCore.update_files()."""
+        return self.core.update_files(statuses)
+
+    def remove_all_fonts(self):
+        dir_watcher.unwatch_paths(_get_paths(self.core, self.core.slots()))
+        self.core.remove_all_fonts()
+
+    def set_separate_dir(self, enabled):
+        """See FontSetCore.set_separate_dir()."""
+        return self.core.set_separate_dir(enabled)
+
+    def plan_switch(self, enabled):
+        """See FontSetCore.plan_switch()."""
+        return self.core.plan_switch(enabled)
+
+    def finish_switch(self, enabled, changes):
+        """See FontSetCore.finish_switch()."""
+        return self.core.finish_switch(enabled, changes)
+
+    def materialize(self):
+        """Create FontSet from the record.
+
+        The core is passed to the new set, and the record becomes
+        empty.
+        """
+        font_set = FontSet(self.core)
+        self.core = FontSetCore()
+        return font_set
 
 
 class SetStore(Gtk.ListStore):
@@ -184,23 +535,195 @@ class SetStore(Gtk.ListStore):
     COL_NAME = 0
     COL_FONTSET = 1
 
+    # Interval (ms) of polling the loading of sets.
+    _LOAD_POLL_INTERVAL = 100
+
+    __gsignals__ = {
+        # Emitted when sets are added, removed, renamed, reordered, or
+        # when any of their fonts are modified.
+        'modified': (GObject.SignalFlags.RUN_FIRST, None, ()),
+        }
+
     def __init__(self):
         super().__init__(
             str,
             object,
             )
 
-    def _on_set_changed(self, font_set, gproperty):
+        # Failed linker.LinkResult from the last load of as_json.
+        self.link_failures = []
+
+        # True while a FontSetRecord is replaced by FontSet, which
+        # is not a modification.
+        self._materializing = False
+
+        # {FontSetCore: Gtk.TreeIter} of all rows. The core of a set
+        # stays the same when the set is materialized. Rows moved
+        # with drag and drop are copied and then deleted, so the map
+        # is updated whenever a row gets its set.
+        self._iters_by_core = {}
+        # {font path: set of FontSetCore containing the font}; built
+        # on the first find_sets(), and then kept up to date.
+        self._cores_by_path = None
+        # LinkJob of switch_exclusive() in progress and its callback.
+        self._switch_job = None
+        self._switch_callback = None
+
+        for signal in ('row-changed', 'row-inserted', 'row-deleted',
+                       'rows-reordered'):
+            self.connect(signal, self._on_modified)
+        for signal in ('row-changed', 'row-inserted'):
+            self.connect(signal, self._on_row_set)
+
+        dir_watcher.add_callback(self._on_dir_changed)
+
+    def _on_modified(self, *args):
+        if not self._materializing:
+            self.emit('modified')
+
+    def _on_row_set(self, set_store, tree_path, tree_iter):
+        font_set = self[tree_iter][self.COL_FONTSET]
+        if font_set is not None:
+            self._iters_by_core[font_set.core] = tree_iter
+
+    def _index_paths(self, core, paths):
+        if self._cores_by_path is None:
+            return
+        for path in paths:
+            self._cores_by_path.setdefault(path, set()).add(core)
+
+    def _unindex_paths(self, core, paths):
+        if self._cores_by_path is None:
+            return
+        for path in paths:
+            cores = self._cores_by_path.get(path)
+            if cores is None:
+                continue
+            cores.discard(core)
+            if not cores:
+                del self._cores_by_path[path]
+
+    def _on_fonts_changed(self, font_set, added_paths, removed_paths):
+        self._index_paths(font_set.core, added_paths)
+        self._unindex_paths(font_set.core, removed_paths)
+
+    def get_iter_by_core(self, core):
+        """Return Gtk.TreeIter of the set with the FontSetCore.
+
+        Unlike the FontSetRecord, the core stays the same when the
+        set is materialized. Raises KeyError if there's no such set.
+        """
+        return self._iters_by_core[core]
+
+    def find_sets(self, font_path):
+        """Return Gtk.TreeIter of sets that contain the font file.
+
+        The iterators are in the order of the sets. The slot of the
+        font in a set is core.find(os.path.basename(font_path)).
+        """
+        if self._cores_by_path is None:
+            self._cores_by_path = {}
+            for core in self._iters_by_core:
+                self._index_paths(core, _get_paths(core, core.slots()))
+
+        tree_iters = [
+            self._iters_by_core[core]
+            for core in self._cores_by_path.get(font_path, ())]
+        tree_iters.sort(key=lambda i: self.get_path(i).get_indices()[0])
+        return tree_iters
+
+    def update_installed(self):
+        """Re-check fonts of all sets against the installed fonts."""
+        for row in self:
+            font_set = row[self.COL_FONTSET]
+            if isinstance(font_set, FontSetRecord):
+                if font_set.update_installed():
+                    self.row_changed(row.path, row.iter)
+            else:
+                font_set.update_installed()
+
+    def _on_dir_changed(self, dir_paths):
+        # Fonts are checked in background, and all sets are updated
+        # as results arrive.
+        paths = set()
         for row in self:
-            if row[self.COL_FONTSET] == font_set:
-                self.row_changed(row.path, row.iter)
-                break
+            paths.update(
+                row[self.COL_FONTSET].core.get_paths_in_dirs(dir_paths))
+        self._on_files_checked(
+            _check_files(paths, self._on_files_checked, 0))
+
+    def _on_files_checked(self, statuses):
+        for row in self:
+            font_set = row[self.COL_FONTSET]
+            if isinstance(font_set, FontSetRecord):
+                if font_set.update_files(statuses)[0]:
+                    self.row_changed(row.path, row.iter)
+            else:
+                font_set.update_files(statuses)
+        return GLib.SOURCE_REMOVE
+
+    def _connect_set(self, font_set):
+        font_set.connect('notify::num-active', self._on_set_changed)
+        font_set.connect('modified', self._on_modified)
+        font_set.connect('fonts-changed', self._on_fonts_changed)
+
+    def get_font_set(self, tree_iter):
+        """Return FontSet of the row, materializing it if needed."""
+        font_set = self[tree_iter][self.COL_FONTSET]
+        if isinstance(font_set, FontSetRecord):
+            font_set = font_set.materialize()
+            self._connect_set(font_set)
+            self._materializing = True
+            try:
+                self.set_value(tree_iter, self.COL_FONTSET, font_set)
+            finally:
+                self._materializing = False
+        return font_set
+
+    def _on_set_changed(self, font_set, gproperty):
+        tree_iter = self._iters_by_core.get(font_set.core)
+        if tree_iter is not None:
+            self.row_changed(self.get_path(tree_iter), tree_iter)
+
+    def set_active(self, tree_iter, active):
+        """Enable or disable the set with a separate directory.
+
+        See FontSetCore.set_active(). The set is not materialized.
+
+        Returns a list of failed linker.LinkResult.
+        """
+        failures = self[tree_iter][self.COL_FONTSET].core.set_active(active)
+        self.row_changed(self.get_path(tree_iter), tree_iter)
+        return failures
+
+    def set_separate_dir(self, tree_iter, enabled):
+        """See FontSetCore.set_separate_dir().
+
+        Returns a list of failed linker.LinkResult.
+        """
+        failures = self[tree_iter][self.COL_FONTSET].set_separate_dir(
+            enabled)
+        self.row_changed(self.get_path(tree_iter), tree_iter)
+        return failures
+
+    def remove_set(self, tree_iter):
+        """Remove the set, including all its links and directories."""
+        font_set = self[tree_iter][self.COL_FONTSET]
+        if isinstance(font_set, FontSet):
+            font_set.cancel_link_job()
+        core = font_set.core
+        self._unindex_paths(
+            core, (core.get_path(slot) for slot in core.slots()))
+        font_set.remove_all_fonts()
+        font_set.set_separate_dir(False)
+        del self._iters_by_core[core]
+        self.remove(tree_iter)
 
     def add_set(self, name, insert_after=None):
         name = utils.unique_name(name, (row[self.COL_NAME] for row in self))
 
         font_set = FontSet()
-        font_set.connect('notify::num-active', self._on_set_changed)
+        self._connect_set(font_set)
 
         return self.insert_after(insert_after, (name, font_set))
 
@@ -211,29 +734,191 @@ class SetStore(Gtk.ListStore):
 
         font_set = FontSet()
         font_set.add_fonts_from(self[tree_iter][self.COL_FONTSET])
-        font_set.connect('notify::num-active', self._on_set_changed)
+        self._connect_set(font_set)
+        core = font_set.core
+        self._index_paths(
+            core, (core.get_path(slot) for slot in core.slots()))
 
         return self.insert_after(tree_iter, (name, font_set))
 
     @property
     def as_json(self):
+        """Sets as JSON objects.
+
+        Font lists are shared with FontSet.as_json, so only the sets
+        modified since the previous call are serialized again.
+        """
         json_sets = []
         for row in self:
-            fonts = []
-            for font_set in row[self.COL_FONTSET]:
-                fonts.append({
-                    'enabled': font_set[FontSet.COL_ENABLED],
-                    'path': font_set[FontSet.COL_LINKS][0].source
-                    })
-            json_sets.append(OrderedDict((
+            core = row[self.COL_FONTSET].core
+            json_set = OrderedDict((
                 ('name', row[self.COL_NAME]),
-                ('fonts', fonts))))
+                ('fonts', core.as_json)))
+            if core.db_id is not None:
+                json_set['id'] = core.db_id
+            if core.dir_name is not None:
+                json_set['dir'] = core.dir_name
+                json_set['active'] = core.is_active
+            json_sets.append(json_set)
         return json_sets
 
     @as_json.setter
     def as_json(self, json_sets):
-        tree_iter = None
+        """Load sets from JSON, linking their enabled fonts.
+
+        Sets are loaded as FontSetRecord; use get_font_set() to get
+        a FontSet. Failed links are available in link_failures.
+        """
+        self.link_failures = []
+        loaded = []
         for json_set in json_sets:
-            tree_iter = self.add_set(json_set['name'], tree_iter)
-            self[tree_iter][self.COL_FONTSET].add_fonts(
-                ((f['path'], f['enabled']) for f in json_set['fonts']))
+            name, core, failures = _load_json_set(json_set)
+            self.link_failures.extend(failures)
+            loaded.append((name, core))
+        self._append_loaded(loaded)
+
+    def switch_exclusive(self, tree_iter, callback=None):
+        """Enable the set and disable all other sets.
+
+        Links of all sets are changed by the link worker in a single
+        batch (see linker.change_links_batch()), so fonts that the set
+        shares with the disabled sets keep their links instead of being
+        removed and created again, and fontconfig only sees the fonts
+        that actually differ. For sets with a separate directory, only
+        the link to the directory is changed, like with set_active().
+        Sets are not materialized.
+
+        callback -- called with a list of failed linker.LinkResult
+            when all links are done or the job is cancelled.
+
+        A switch that is still in progress is cancelled first, and its
+        links are waited for, since the new one is planned from the
+        states it leaves.
+
+        Returns LinkJob.
+        """
+        if self._switch_job is not None:
+            self._switch_job.cancel()
+            self._switch_job.wait()
+            self._finish_switch()
+
+        target_core = self[tree_iter][self.COL_FONTSET].core
+        plans = []
+        to_create = []
+        to_remove = []
+        for row in self:
+            font_set = row[self.COL_FONTSET]
+            enabled = font_set.core is target_core
+            changes = font_set.plan_switch(enabled)
+            if not changes:
+                continue
+
+            plans.append((font_set.core, enabled, changes))
+            link_groups = to_create if enabled else to_remove
+            link_groups.extend(
+                link_group for slot, name, link_group in changes)
+
+        self._switch_job = worker.submit(LinkJob(
+            lambda chunk: linker.change_links_batch(to_create, to_remove),
+            [plans]))
+        self._switch_callback = callback
+        GLib.timeout_add(
+            self._LOAD_POLL_INTERVAL, self._on_switch_poll, self._switch_job)
+        return self._switch_job
+
+    def _on_switch_poll(self, job):
+        if job is not self._switch_job:
+            # Already finished by the next switch_exclusive().
+            return GLib.SOURCE_REMOVE
+        if not job.is_finished:
+            return GLib.SOURCE_CONTINUE
+
+        self._finish_switch()
+        return GLib.SOURCE_REMOVE
+
+    def _finish_switch(self):
+        """Finish states of the finished switch job."""
+        job = self._switch_job
+        callback = self._switch_callback
+        self._switch_job = None
+        self._switch_callback = None
+
+        failures = []
+        for plans, link_results in job.take_results():
+            failures.extend(
+                result for result in link_results if result.failed)
+            for core, enabled, changes in plans:
+                tree_iter = self._iters_by_core.get(core)
+                if tree_iter is None:
+                    # The set was removed.
+                    failures.extend(core.finish_switch(enabled, changes))
+                    continue
+                failures.extend(
+                    self[tree_iter][self.COL_FONTSET].finish_switch(
+                        enabled, changes))
+
+        for row in self:
+            self.row_changed(row.path, row.iter)
+
+        if callback is not None:
+            callback(failures)
+
+    def cancel_link_jobs(self):
+        """Cancel set_state_all_async() of all sets without waiting.
+
+        switch_exclusive() in progress is cancelled as well.
+        """
+        if self._switch_job is not None:
+            self._switch_job.cancel()
+        for row in self:
+            font_set = row[self.COL_FONTSET]
+            if (isinstance(font_set, FontSet) and
+                    font_set.link_job is not None):
+                font_set.link_job.cancel()
+
+    def _append_loaded(self, loaded):
+        """Append FontSetRecord for [(name, core)] of loaded sets."""
+        all_names = set(row[self.COL_NAME] for row in self)
+        for name, core in loaded:
+            name = utils.unique_name(name, all_names)
+            all_names.add(name)
+
+            self._index_paths(
+                core, (core.get_path(slot) for slot in core.slots()))
+            self.append((name, FontSetRecord(core)))
+
+    def load_json_async(self, json_sets, context=None, callback=None,
+                        read_fonts=None):
+        """Load sets like as_json, but link their fonts in background.
+
+        Sets are appended as they are loaded by the link worker.
+
+        context -- see LinkJob.
+        callback -- called once all sets are loaded.
+        read_fonts -- if not None, called with each JSON set in the
+            link worker to get its "fonts" (e.g. set_db.db.read_fonts).
+
+        Returns LinkJob.
+        """
+        self.link_failures = []
+        job = worker.submit(LinkJob(
+            partial(_load_json_set, read_fonts=read_fonts),
+            json_sets,
+            context))
+        GLib.timeout_add(
+            self._LOAD_POLL_INTERVAL, self._on_load_poll, job, callback)
+        return job
+
+    def _on_load_poll(self, job, callback):
+        is_finished = job.is_finished
+        loaded = []
+        for json_set, (name, core, failures) in job.take_results():
+            self.link_failures.extend(failures)
+            loaded.append((name, core))
+        self._append_loaded(loaded)
+
+        if not is_finished:
+            return GLib.SOURCE_CONTINUE
+        if callback is not None:
+            callback()
+        return GLib.SOURCE_REMOVE
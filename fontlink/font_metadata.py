@@ -0,0 +1,355 @@
+
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+import zlib
+
+from . import config
+from . import utils
+
+
+_SFNT_VERSIONS = frozenset((b'\x00\x01\x00\x00', b'OTTO', b'true'))
+
+_NAME_FAMILY = 1
+_NAME_STYLE = 2
+_NAME_FULL = 4
+_NAME_PS = 6
+_NAME_TYPO_FAMILY = 16
+_NAME_TYPO_STYLE = 17
+_NAME_IDS = frozenset((
+    _NAME_FAMILY,
+    _NAME_STYLE,
+    _NAME_FULL,
+    _NAME_PS,
+    _NAME_TYPO_FAMILY,
+    _NAME_TYPO_STYLE,
+    ))
+
+_LANG_ENGLISH_US = 0x409
+
+# Size of the Type 1 header to search for FontInfo.
+_TYPE1_HEADER_SIZE = 16384
+_TYPE1_STRING_RE = re.compile(
+    rb'/(FamilyName|FullName|Weight)\s*\(((?:[^()\\]|\\.)*)\)')
+_TYPE1_FONT_NAME_RE = re.compile(rb'/FontName\s*/([^\s/\[\]{}()<>]+)')
+
+
+def _get_name_rank(platform_id, encoding_id, language_id):
+    """Return the preference of a name record (less is better).
+
+    Returns None for records that can't be decoded.
+    """
+    if platform_id == 3 and encoding_id in (0, 1, 10):
+        return 0 if language_id == _LANG_ENGLISH_US else 1
+    elif platform_id == 0:
+        return 2
+    elif platform_id == 1 and encoding_id == 0 and language_id == 0:
+        return 3
+    return None
+
+
+def _parse_name_table(table):
+    """Return {name_id: string} of the names we are interested in."""
+    names = {}
+    ranks = {}
+    try:
+        num_records, strings_offset = struct.unpack_from('>HH', table, 2)
+        for i in range(num_records):
+            (platform_id, encoding_id, language_id, name_id, length,
+             offset) = struct.unpack_from('>6H', table, 6 + i * 12)
+            if name_id not in _NAME_IDS:
+                continue
+
+            rank = _get_name_rank(platform_id, encoding_id, language_id)
+            if rank is None or rank >= ranks.get(name_id, rank + 1):
+                continue
+
+            start = strings_offset + offset
+            raw = table[start:start + length]
+            try:
+                name = raw.decode(
+                    'mac_roman' if platform_id == 1 else 'utf-16-be')
+            except UnicodeDecodeError:
+                continue
+
+            name = name.strip('\0 ')
+            if name:
+                names[name_id] = name
+                ranks[name_id] = rank
+    except struct.error:
+        pass
+
+    return names
+
+
+def _read_sfnt_tables(data, offset):
+    """Return {tag: bytes} of the "name" and "OS/2" tables.
+
+    offset -- offset of the table directory of the font in data.
+    """
+    tables = {}
+    num_tables, = struct.unpack_from('>H', data, offset + 4)
+    for i in range(num_tables):
+        tag, checksum, table_offset, length = struct.unpack_from(
+            '>4s3L', data, offset + 12 + i * 16)
+        if tag in (b'name', b'OS/2'):
+            tables[tag] = data[table_offset:table_offset + length]
+    return tables
+
+
+def _read_woff_tables(data):
+    tables = {}
+    num_tables, = struct.unpack_from('>H', data, 12)
+    for i in range(num_tables):
+        tag, table_offset, comp_length, orig_length = struct.unpack_from(
+            '>4s3L', data, 44 + i * 20)
+        if tag not in (b'name', b'OS/2'):
+            continue
+
+        table = data[table_offset:table_offset + comp_length]
+        if comp_length < orig_length:
+            table = zlib.decompress(table)
+        tables[tag] = table
+    return tables
+
+
+def _metadata_from_tables(tables, num_faces):
+    names = _parse_name_table(tables.get(b'name', b''))
+
+    weight = None
+    os2 = tables.get(b'OS/2', b'')
+    if len(os2) >= 6:
+        weight, = struct.unpack_from('>H', os2, 4)
+
+    return {
+        'family': names.get(_NAME_TYPO_FAMILY, names.get(_NAME_FAMILY)),
+        'style': names.get(_NAME_TYPO_STYLE, names.get(_NAME_STYLE)),
+        'full_name': names.get(_NAME_FULL),
+        'ps_name': names.get(_NAME_PS),
+        'weight': weight,
+        'num_faces': num_faces,
+        }
+
+
+def _read_sfnt_metadata(f):
+    size = os.fstat(f.fileno()).st_size
+    if size < 12:
+        return None
+
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        tag = data[:4]
+        if tag in _SFNT_VERSIONS:
+            return _metadata_from_tables(_read_sfnt_tables(data, 0), 1)
+        elif tag == b'ttcf':
+            num_faces, first_offset = struct.unpack_from('>2L', data, 8)
+            if num_faces == 0:
+                return None
+            return _metadata_from_tables(
+                _read_sfnt_tables(data, first_offset), num_faces)
+        elif tag == b'wOFF':
+            return _metadata_from_tables(_read_woff_tables(data), 1)
+
+    return None
+
+
+def _unescape_ps_string(s):
+    return re.sub(
+        rb'\\([0-7]{1,3}|.)',
+        lambda m: (
+            bytes((int(m.group(1), 8) & 0xff,))
+            if m.group(1)[:1].isdigit() else m.group(1)),
+        s)
+
+
+def _read_type1_metadata(f):
+    header = f.read(_TYPE1_HEADER_SIZE)
+    if header[:2] == b'\x80\x01':
+        # PFB: the cleartext part is the first segment.
+        if len(header) < 6:
+            return None
+        length, = struct.unpack_from('<L', header, 2)
+        header = header[6:6 + length]
+    elif not header.startswith((b'%!PS-AdobeFont', b'%!FontType1')):
+        return None
+
+    eexec = header.find(b'eexec')
+    if eexec >= 0:
+        header = header[:eexec]
+
+    names = {}
+    for key, value in _TYPE1_STRING_RE.findall(header):
+        names.setdefault(
+            key, _unescape_ps_string(value).decode('latin-1').strip())
+
+    font_name = _TYPE1_FONT_NAME_RE.search(header)
+    if font_name is None and not names:
+        return None
+
+    family = names.get(b'FamilyName') or None
+    full_name = names.get(b'FullName') or None
+    style = None
+    if family and full_name and full_name.startswith(family):
+        style = full_name[len(family):].strip(' -') or None
+    if style is None:
+        style = names.get(b'Weight') or None
+
+    return {
+        'family': family,
+        'style': style,
+        'full_name': full_name,
+        'ps_name': (
+            font_name.group(1).decode('latin-1') if font_name else None),
+        'weight': None,
+        'num_faces': 1,
+        }
+
+
+def read_metadata(path):
+    """Read metadata of a font file.
+
+    Metadata is read only from the parts of the file that contain it:
+    the table directory and the "name" and "OS/2" tables of OpenType
+    fonts (including collections and WOFF), and the cleartext header
+    of Type 1 fonts. The rest of the file is never touched.
+
+    Returns a dict:
+        family, style -- family and style names, or None.
+        full_name -- full font name, or None.
+        ps_name -- PostScript name, or None.
+        weight -- usWeightClass from the "OS/2" table, or None.
+        num_faces -- number of fonts in the file (more than 1 for
+            collections); the other fields are of the first font.
+
+    Returns None if the file can't be read or has an unsupported
+    format (e.g. WOFF2, which needs Brotli to read any table).
+    """
+    try:
+        with open(path, 'rb') as f:
+            metadata = _read_sfnt_metadata(f)
+            if metadata is None:
+                f.seek(0)
+                metadata = _read_type1_metadata(f)
+            return metadata
+    except (OSError, ValueError, struct.error, zlib.error):
+        return None
+
+
+class FontMetadataCache:
+    """Persistent cache of font metadata.
+
+    Files are read by a pool of worker threads. Metadata is cached by
+    path, modification time, and size, so each file is read only once
+    unless it's changed.
+
+    The cache is thread-safe.
+    """
+
+    _FILE = os.path.join(config.CACHE_DIR, 'font_metadata.json')
+    _VERSION = 1
+
+    # Minimal number of files to read them in the pool.
+    _MIN_POOL_FILES = 16
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        # {path: [mtime, size, metadata]}
+        self._entries = {}
+        self._dirty = False
+
+    def _load(self):
+        try:
+            with open(self._FILE, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+            if cache['version'] == self._VERSION:
+                self._entries = cache['entries']
+        except (KeyError, TypeError, ValueError, OSError):
+            pass
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            data = json.dumps(
+                {'version': self._VERSION, 'entries': self._entries},
+                ensure_ascii=False,
+                separators=(',', ':'))
+            self._dirty = False
+
+        try:
+            utils.write_atomic(self._FILE, data)
+        except OSError:
+            pass
+
+    def peek(self, path):
+        """Return the cached metadata without checking the file.
+
+        Returns None if there's no metadata for the path yet, so this
+        is cheap enough to be called while drawing.
+        """
+        entry = self._entries.get(path)
+        return entry[2] if entry is not None else None
+
+    def contains(self, path):
+        """Return True if the path was already read."""
+        return path in self._entries
+
+    def get_metadata(self, paths):
+        """Return {path: metadata} for the paths.
+
+        Paths of files that don't exist are omitted; files that can't
+        be read have None metadata.
+        """
+        with self._lock:
+            if not self._loaded:
+                self._load()
+                self._loaded = True
+
+        result = {}
+        to_read = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+
+            key = [st.st_mtime_ns, st.st_size]
+            with self._lock:
+                entry = self._entries.get(path)
+            if entry is not None and entry[:2] == key:
+                result[path] = entry[2]
+            else:
+                to_read.append((path, key))
+
+        if not to_read:
+            return result
+
+        paths_to_read = [path for path, key in to_read]
+        if len(to_read) < self._MIN_POOL_FILES:
+            metadata_list = [read_metadata(path) for path in paths_to_read]
+        else:
+            # Imported here, since it's not needed for small batches
+            # and takes a noticeable part of the startup.
+            from concurrent.futures import ThreadPoolExecutor
+
+            with ThreadPoolExecutor(
+                    max_workers=os.cpu_count() or 1) as executor:
+                metadata_list = list(
+                    executor.map(read_metadata, paths_to_read))
+
+        with self._lock:
+            # Copy on write so that peek() doesn't need the lock.
+            entries = dict(self._entries)
+            for (path, key), metadata in zip(to_read, metadata_list):
+                result[path] = metadata
+                entries[path] = key + [metadata]
+            self._entries = entries
+            self._dirty = True
+
+        return result
+
+
+cache = FontMetadataCache()
@@ -0,0 +1,178 @@
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+
+from . import content_index
+from . import font_utils
+
+
+def _is_font(path):
+    ext = os.path.splitext(path)[1].lower()
+    return ext in font_utils.FONT_EXTENSIONS
+
+
+class FontScanner:
+    """Recursive search for fonts in directories.
+
+    Directories are read with os.scandir() by a pool of worker
+    threads; each directory is a separate task, so deep and wide trees
+    are traversed in parallel. Found paths are accumulated until
+    they are taken with get_fonts(), which makes it possible to stream
+    the results while the search is still running.
+
+    Symbolic links to directories are not followed. Paths of font files
+    can be given instead of directories; they are found as is.
+    """
+
+    def __init__(self, dirs, num_workers=None, known_paths=None):
+        """Start the search.
+
+        known_paths -- if not None, found files are hashed with
+            content_index, and files with the same contents as the
+            fonts at these paths (e.g. fonts already in a set) or as
+            files found before them are skipped. Hashing is done by
+            the search threads, and the known fonts are hashed once
+            the first directory is read.
+        """
+        if num_workers is None:
+            num_workers = min(16, (os.cpu_count() or 1) * 2)
+
+        self._lock = threading.Lock()
+        self._fonts = []
+        self._num_pending = 0
+        self._num_dirs = 0
+        self._num_fonts = 0
+        self._cancelled = False
+        self._done = threading.Event()
+        self._known_paths = known_paths
+        # Digests of known and found files; built by the first
+        # _skip_identical() call under self._digests_lock, which is
+        # separate so that hashing doesn't block get_fonts().
+        self._digests = None
+        self._digests_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=num_workers)
+
+        dirs = list(dirs)
+        if not dirs:
+            self._finish()
+            return
+
+        # Count all paths first, so that the search doesn't finish
+        # (and shut down the executor) if the first path is done
+        # before the others are submitted.
+        self._num_pending = len(dirs)
+        for path in dirs:
+            self._executor.submit(self._scan_dir, path)
+
+    @property
+    def is_done(self):
+        """True if the search is finished or cancelled."""
+        return self._done.is_set()
+
+    @property
+    def num_dirs(self):
+        """Number of directories scanned so far."""
+        return self._num_dirs
+
+    @property
+    def num_fonts(self):
+        """Number of fonts found so far."""
+        return self._num_fonts
+
+    def wait(self, timeout=None):
+        """Block until the search is done.
+
+        Returns False on timeout.
+        """
+        return self._done.wait(timeout)
+
+    def cancel(self):
+        """Stop the search.
+
+        Directories that are already being read will be finished, but
+        their results are discarded.
+        """
+        with self._lock:
+            self._cancelled = True
+            self._fonts.clear()
+
+    def get_fonts(self, max_count=None):
+        """Take up to max_count paths found since the previous call."""
+        with self._lock:
+            if max_count is None or max_count >= len(self._fonts):
+                fonts = self._fonts
+                self._fonts = []
+            else:
+                fonts = self._fonts[:max_count]
+                del self._fonts[:max_count]
+        return fonts
+
+    def _submit(self, path):
+        with self._lock:
+            self._num_pending += 1
+        self._executor.submit(self._scan_dir, path)
+
+    def _scan_dir(self, path):
+        fonts = []
+        subdirs = []
+        if not self._cancelled:
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                subdirs.append(entry.path)
+                                continue
+                        except OSError:
+                            continue
+
+                        if _is_font(entry.name):
+                            fonts.append(entry.path)
+            except NotADirectoryError:
+                if _is_font(path):
+                    fonts.append(path)
+            except OSError:
+                pass
+
+        for subdir in subdirs:
+            self._submit(subdir)
+
+        if fonts and self._known_paths is not None and not self._cancelled:
+            fonts = self._skip_identical(fonts)
+
+        with self._lock:
+            if not self._cancelled:
+                self._fonts.extend(fonts)
+                self._num_fonts += len(fonts)
+                self._num_dirs += 1
+            self._num_pending -= 1
+            finished = self._num_pending == 0
+
+        if finished:
+            self._finish()
+
+    def _skip_identical(self, fonts):
+        with self._digests_lock:
+            if self._digests is None:
+                self._digests = set(
+                    content_index.index.get_hashes(
+                        self._known_paths, parallel=False).values())
+            digests = self._digests
+
+        hashes = content_index.index.get_hashes(fonts, parallel=False)
+
+        unique = []
+        with self._digests_lock:
+            for path in fonts:
+                digest = hashes.get(path)
+                # Files that can't be read are not skipped.
+                if digest is None or digest not in digests:
+                    unique.append(path)
+                    if digest is not None:
+                        digests.add(digest)
+        return unique
+
+    def _finish(self):
+        self._done.set()
+        self._executor.shutdown(wait=False)
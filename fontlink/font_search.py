@@ -0,0 +1,172 @@
+
+import re
+
+
+# Length of n-grams in the index.
+_GRAM_SIZE = 3
+
+# Tokens are runs of letters and digits.
+_TOKEN_RE = re.compile(r'[^\W_]+')
+
+
+def _get_grams(text):
+    return {
+        text[i:i + _GRAM_SIZE] for i in range(len(text) - _GRAM_SIZE + 1)}
+
+
+def normalize(text):
+    """Convert text for case-insensitive search."""
+    return text.casefold()
+
+
+class SearchIndex:
+    """Token and trigram index for substring search of fonts.
+
+    Each font (identified by its slot in FontSetCore) has a text: its
+    filename and, if known, family and style names. Texts are split
+    into tokens (runs of letters and digits), and only the distinct
+    tokens are split into trigrams; fonts of a family share most of
+    their tokens, so the index stays small.
+
+    A query consists of terms separated by whitespace; a font matches
+    if its text contains all terms. A term is looked up by finding
+    the tokens that contain its parts, so only fonts with these tokens
+    are checked.
+
+    Queries are incremental: if the query extends the previous one
+    (e.g. while the user is typing), only fonts that matched the
+    previous query are checked.
+    """
+
+    def __init__(self):
+        # {slot: normalized text}
+        self._texts = {}
+        # {token: set of slots}
+        self._slots_by_token = {}
+        # {trigram: set of tokens}
+        self._tokens_by_gram = {}
+        self._last_query = None
+        self._last_matches = None
+
+    def __len__(self):
+        return len(self._texts)
+
+    def add(self, slot, text):
+        """Add or replace the text of a font."""
+        if slot in self._texts:
+            self.remove(slot)
+
+        text = normalize(text)
+        self._texts[slot] = text
+        for token in set(_TOKEN_RE.findall(text)):
+            slots = self._slots_by_token.get(token)
+            if slots is None:
+                slots = self._slots_by_token[token] = set()
+                for gram in _get_grams(token):
+                    self._tokens_by_gram.setdefault(gram, set()).add(token)
+            slots.add(slot)
+
+        self._last_query = None
+
+    def remove(self, slot):
+        text = self._texts.pop(slot, None)
+        if text is None:
+            return
+
+        for token in set(_TOKEN_RE.findall(text)):
+            slots = self._slots_by_token[token]
+            slots.discard(slot)
+            if slots:
+                continue
+
+            del self._slots_by_token[token]
+            for gram in _get_grams(token):
+                tokens = self._tokens_by_gram[gram]
+                tokens.discard(token)
+                if not tokens:
+                    del self._tokens_by_gram[gram]
+
+        if self._last_matches is not None:
+            self._last_matches.discard(slot)
+
+    def clear(self):
+        self._texts.clear()
+        self._slots_by_token.clear()
+        self._tokens_by_gram.clear()
+        self._last_query = None
+        self._last_matches = None
+
+    def _find_tokens(self, part):
+        """Return tokens containing the part (a token of a query)."""
+        if len(part) < _GRAM_SIZE:
+            tokens = self._slots_by_token
+        else:
+            # Intersect starting from the rarest trigram.
+            token_sets = sorted(
+                (self._tokens_by_gram.get(gram, frozenset())
+                 for gram in _get_grams(part)),
+                key=len)
+            tokens = token_sets[0]
+            for other_tokens in token_sets[1:]:
+                if not tokens:
+                    break
+                tokens = tokens & other_tokens
+
+        # Trigrams can be in a different order in the token.
+        return [token for token in tokens if part in token]
+
+    def _find_term(self, term, candidates):
+        """Return slots from candidates whose texts contain the term.
+
+        candidates -- slots to check, or None for all fonts.
+        """
+        if candidates is None:
+            parts = _TOKEN_RE.findall(term)
+            if not parts:
+                candidates = self._texts
+
+            for part in sorted(parts, key=len, reverse=True):
+                slots = set()
+                for token in self._find_tokens(part):
+                    slots.update(self._slots_by_token[token])
+                if candidates is None:
+                    candidates = slots
+                else:
+                    candidates &= slots
+                if not candidates:
+                    return candidates
+
+            if parts == [term]:
+                # The term can only be found within a token.
+                return candidates
+
+        texts = self._texts
+        return {slot for slot in candidates if term in texts[slot]}
+
+    def search(self, query):
+        """Return a set of slots of fonts matching the query.
+
+        Returns None if the query has no terms, i.e. everything
+        matches. The returned set must not be modified.
+        """
+        query = normalize(query)
+        terms = query.split()
+        if not terms:
+            self._last_query = None
+            self._last_matches = None
+            return None
+
+        candidates = None
+        if (self._last_query is not None and
+                query.startswith(self._last_query)):
+            candidates = self._last_matches
+
+        # Longer terms are usually more selective.
+        for term in sorted(terms, key=len, reverse=True):
+            candidates = self._find_term(term, candidates)
+            if not candidates:
+                break
+
+        self._last_query = query
+        self._last_matches = candidates
+        return candidates
@@ -0,0 +1,678 @@
+
+from array import array
+from collections import OrderedDict
+import os
+import sys
+import uuid
+
+from . import app_info
+from . import config
+from . import file_status
+from . import font_utils
+from . import linker
+
+
+# State flags of a font.
+_ENABLED = 1
+# The file exists and the font with the same filename is not installed
+# in the system. While the index of installed fonts is loading, all
+# fonts are considered not installed; see
+# FontSetCore.update_installed().
+_LINKABLE = 2
+# The font is enabled, but its file is missing at the moment. It's
+# saved as enabled, and is enabled again as soon as the file is back;
+# see FontSetCore.update_files().
+_SUSPENDED = 4
+
+_ENABLED_LINKABLE = _ENABLED | _LINKABLE
+
+
+def _failed(link_results):
+    return [result for result in link_results if result.failed]
+
+
+class FontSetCore:
+    """Fonts of a set and their states, independent of GTK.
+
+    Each font occupies a slot: an index in parallel arrays of directory
+    ids, filenames, and state flags. Directories are interned and
+    stored once per set, and links are built on demand, so a font
+    costs little more than its filename. Slots of removed fonts are
+    reused; slots() iterates over slots of existing fonts.
+
+    Methods that change states of fonts also create or remove their
+    links.
+    """
+
+    __slots__ = (
+        '_dirs',
+        '_dir_ids',
+        '_dir_ids_by_path',
+        '_slots_by_dir_id',
+        '_names',
+        '_states',
+        '_metrics',
+        '_slots_by_name',
+        '_free_slots',
+        '_links_dir',
+        '_dir_name',
+        '_active',
+        '_num_active',
+        '_generation',
+        '_json',
+        '_db_id',
+        )
+
+    def __init__(self):
+        # The directory of a font is self._dirs[self._dir_ids[slot]].
+        self._dirs = []
+        self._dir_ids = array('l')
+        self._dir_ids_by_path = {}
+        # Sets of slots of fonts in each directory, by dir_id.
+        self._slots_by_dir_id = []
+        # Filenames are None in free slots.
+        self._names = []
+        self._states = bytearray()
+        # {slot: path} of PostScript metrics.
+        self._metrics = {}
+        self._slots_by_name = {}
+        self._free_slots = []
+
+        # Directory where fonts are linked; see set_separate_dir().
+        self._links_dir = config.FONTS_DIR
+        self._dir_name = None
+        self._active = True
+
+        self._num_active = 0
+        self._generation = 0
+        # Cached result of as_json; reset on every modification.
+        self._json = None
+        self._db_id = None
+
+    def __len__(self):
+        return len(self._slots_by_name)
+
+    @property
+    def num_active(self):
+        """Number of enabled fonts."""
+        return self._num_active
+
+    @property
+    def generation(self):
+        """Number that changes whenever the saved state is modified.
+
+        That is, when fonts are added or removed, or change their
+        states. Changes made by update_files() don't count, since the
+        fonts that are missing are still saved as enabled.
+        """
+        return self._generation
+
+    @property
+    def dir_name(self):
+        """Name of the separate directory of links or None.
+
+        See set_separate_dir().
+        """
+        return self._dir_name
+
+    @property
+    def is_active(self):
+        """False if the separate directory of the set is not linked."""
+        return self._active
+
+    @property
+    def db_id(self):
+        """Id of the set in set_db or None if not saved yet."""
+        return self._db_id
+
+    @db_id.setter
+    def db_id(self, db_id):
+        self._db_id = db_id
+
+    def _set_modified(self):
+        self._generation += 1
+        self._json = None
+
+    def slots(self):
+        """Return an iterator over slots of all fonts."""
+        return iter(self._slots_by_name.values())
+
+    def find(self, font_name):
+        """Return the slot of the font or None."""
+        return self._slots_by_name.get(font_name)
+
+    def get_name(self, slot):
+        return self._names[slot]
+
+    def get_dir(self, slot):
+        return self._dirs[self._dir_ids[slot]]
+
+    def get_path(self, slot):
+        return os.path.join(self._dirs[self._dir_ids[slot]], self._names[slot])
+
+    def is_enabled(self, slot):
+        return bool(self._states[slot] & _ENABLED)
+
+    def is_linkable(self, slot):
+        return bool(self._states[slot] & _LINKABLE)
+
+    def get_links(self, slot):
+        """Return a tuple of linker.Link of the font.
+
+        The first link is always present and describes the main font
+        file. Others (if any) are additional files (.afm, .pfm, etc.).
+        """
+        font_name = self._names[slot]
+        links = [
+            linker.Link(
+                self.get_path(slot),
+                os.path.join(self._links_dir, font_name))]
+
+        metrics_path = self._metrics.get(slot)
+        if metrics_path:
+            links.append(
+                linker.Link(
+                    metrics_path,
+                    os.path.join(
+                        self._links_dir, os.path.basename(metrics_path))))
+        return tuple(links)
+
+    def _get_enabled_links(self):
+        return [
+            self.get_links(slot) for slot in self.slots()
+            if self._states[slot] == _ENABLED_LINKABLE]
+
+    def _get_dir_link(self):
+        return linker.Link(
+            self._links_dir,
+            os.path.join(
+                config.FONTS_DIR,
+                '{}-{}'.format(app_info.NAME, self._dir_name)))
+
+    def set_separate_dir(self, enabled, dir_name=None, active=True):
+        """Link fonts to a separate directory of the set.
+
+        Fonts are linked to a directory in config.SET_LINKS_DIR, and
+        only a link to this directory is created in config.FONTS_DIR.
+        This way, the whole set is enabled or disabled with a single
+        link (see set_active()), while the states of individual fonts
+        are kept. Links in the directory are not removed on exit (see
+        linker.remove_all_links()), so they are reused in the next
+        session.
+
+        If enabled is False, fonts are linked directly to
+        config.FONTS_DIR again, and the directory is removed. If the
+        set was not active, all its fonts are disabled.
+
+        dir_name -- name of the directory of the set, e.g. from the
+            saved state. A new name is generated if None.
+        active -- see set_active().
+
+        Returns a list of failed linker.LinkResult.
+        """
+        if enabled == (self._dir_name is not None):
+            return []
+
+        failures = _failed(
+            linker.remove_links_batch(self._get_enabled_links()))
+
+        if enabled:
+            self._dir_name = dir_name or uuid.uuid4().hex
+            self._links_dir = os.path.join(
+                config.SET_LINKS_DIR, self._dir_name)
+            try:
+                os.makedirs(self._links_dir, exist_ok=True)
+            except OSError:
+                # Links will fail with the error.
+                pass
+
+            self._active = active
+            if active:
+                failures.extend(
+                    _failed(linker.create_links((self._get_dir_link(),))))
+        else:
+            if self._active:
+                failures.extend(
+                    _failed(linker.remove_links((self._get_dir_link(),))))
+            else:
+                # Otherwise the fonts would become active.
+                for slot in self.slots():
+                    if self._states[slot] == _ENABLED_LINKABLE:
+                        self._states[slot] = _LINKABLE
+                        self._num_active -= 1
+
+            try:
+                os.rmdir(self._links_dir)
+            except OSError:
+                pass
+
+            self._links_dir = config.FONTS_DIR
+            self._dir_name = None
+            self._active = True
+
+        failures.extend(
+            _failed(linker.create_links_batch(self._get_enabled_links())))
+        self._set_modified()
+        return failures
+
+    def set_active(self, active):
+        """Link or unlink the separate directory of the set.
+
+        Does nothing if the set has no separate directory; see
+        set_separate_dir().
+
+        Returns a list of failed linker.LinkResult.
+        """
+        if self._dir_name is None or active == self._active:
+            return []
+
+        self._active = active
+        self._set_modified()
+        if active:
+            return _failed(linker.create_links((self._get_dir_link(),)))
+        return _failed(linker.remove_links((self._get_dir_link(),)))
+
+    def _add(self, dir_path, font_name, state, metrics_path):
+        dir_id = self._dir_ids_by_path.get(dir_path)
+        if dir_id is None:
+            dir_id = len(self._dirs)
+            dir_path = sys.intern(dir_path)
+            self._dirs.append(dir_path)
+            self._dir_ids_by_path[dir_path] = dir_id
+            self._slots_by_dir_id.append(set())
+
+        if self._free_slots:
+            slot = self._free_slots.pop()
+            self._dir_ids[slot] = dir_id
+            self._names[slot] = font_name
+            self._states[slot] = state
+        else:
+            slot = len(self._names)
+            self._dir_ids.append(dir_id)
+            self._names.append(font_name)
+            self._states.append(state)
+
+        if metrics_path:
+            self._metrics[slot] = metrics_path
+        self._slots_by_name[font_name] = slot
+        self._slots_by_dir_id[dir_id].add(slot)
+        if state & _ENABLED:
+            self._num_active += 1
+        return slot
+
+    def _free(self, slot):
+        if self._states[slot] & _ENABLED:
+            self._num_active -= 1
+        del self._slots_by_name[self._names[slot]]
+        self._slots_by_dir_id[self._dir_ids[slot]].discard(slot)
+        self._names[slot] = None
+        self._states[slot] = 0
+        self._metrics.pop(slot, None)
+        self._free_slots.append(slot)
+
+    def add_fonts(self, items, statuses=None):
+        """Add fonts to the set.
+
+        items -- iterable of paths and/or pairs (path, state).
+        statuses -- {path: file_status.FileStatus} of the files (see
+            file_status.FileStatusCache.check_files()), or None to
+            check the files here, which can block on a hung mount.
+            Fonts without a status are added as if their files were
+            missing until they are passed to update_files().
+
+        Fonts that are already in the set (by filename), as well as
+        files that are not fonts, are skipped.
+
+        Returns a pair (slots, failures), where slots is a list of
+        slots of the added fonts, and failures is a list of failed
+        linker.LinkResult.
+        """
+        new_fonts = []
+        new_names = set()
+        for item in items:
+            if isinstance(item, str):
+                path = item
+                enabled = True
+            else:
+                path, enabled = item
+
+            font_dir, font_name = os.path.split(path)
+            font_ext = os.path.splitext(font_name)[1]
+            if (font_ext.lower() not in font_utils.FONT_EXTENSIONS or
+                    font_name in self._slots_by_name or
+                    font_name in new_names or
+                    font_dir.startswith(config.FONTS_DIR) or
+                    font_dir.startswith(config.SET_LINKS_DIR)):
+                continue
+
+            new_names.add(font_name)
+            new_fonts.append((path, enabled, font_dir, font_name))
+
+        slots = []
+        to_link = []
+        for path, enabled, font_dir, font_name in new_fonts:
+            if statuses is None:
+                status = file_status.cache.get(path)
+            else:
+                status = statuses.get(path, file_status.MISSING)
+            if font_utils.installed_fonts.get(font_name) is not None:
+                state = _ENABLED
+            elif not status.exists:
+                state = _SUSPENDED if enabled else 0
+            elif enabled:
+                state = _ENABLED_LINKABLE
+            else:
+                state = _LINKABLE
+
+            slot = self._add(font_dir, font_name, state, status.metrics_path)
+            slots.append(slot)
+            if state == _ENABLED_LINKABLE:
+                to_link.append(self.get_links(slot))
+
+        if slots:
+            self._set_modified()
+        return slots, _failed(linker.create_links_batch(to_link))
+
+    def add_fonts_from(self, core):
+        """Add fonts from another FontSetCore with their states.
+
+        Returns a pair (slots, failures); see add_fonts().
+        """
+        slots = []
+        to_link = []
+        for font_name, other_slot in core._slots_by_name.items():
+            if font_name in self._slots_by_name:
+                continue
+
+            state = core._states[other_slot]
+            slot = self._add(
+                core.get_dir(other_slot),
+                font_name,
+                state,
+                core._metrics.get(other_slot))
+            slots.append(slot)
+            if state == _ENABLED_LINKABLE:
+                to_link.append(self.get_links(slot))
+
+        if slots:
+            self._set_modified()
+        return slots, _failed(linker.create_links_batch(to_link))
+
+    def remove_fonts(self, slots):
+        linker.remove_links_batch(
+            self.get_links(slot) for slot in slots
+            if self._states[slot] == _ENABLED_LINKABLE)
+        for slot in slots:
+            self._free(slot)
+        if slots:
+            self._set_modified()
+
+    def remove_all_fonts(self):
+        linker.remove_links_batch(
+            self.get_links(slot) for slot in self.slots()
+            if self._states[slot] == _ENABLED_LINKABLE)
+        if len(self) > 0:
+            self._set_modified()
+
+        self._dirs = []
+        self._dir_ids = array('l')
+        self._dir_ids_by_path = {}
+        self._slots_by_dir_id = []
+        self._names = []
+        self._states = bytearray()
+        self._metrics = {}
+        self._slots_by_name = {}
+        self._free_slots = []
+        self._num_active = 0
+
+    def toggle_state(self, slot):
+        """Toggle the state of the font.
+
+        Returns a list of failed linker.LinkResult.
+        """
+        state = self._states[slot]
+        if not state & _LINKABLE:
+            return []
+
+        if state & _ENABLED:
+            self._states[slot] = _LINKABLE
+            self._num_active -= 1
+            results = linker.remove_links(self.get_links(slot))
+        else:
+            self._states[slot] = _ENABLED_LINKABLE
+            self._num_active += 1
+            results = linker.create_links(self.get_links(slot))
+
+        self._set_modified()
+        return _failed(results)
+
+    def set_state_all(self, enabled, slots=None):
+        """Set the state for all fonts in the set.
+
+        All links are created or removed in a single batch. Disabling
+        also disables fonts whose files are missing.
+
+        slots -- slots of fonts to change instead of all fonts.
+
+        Returns a list of failed linker.LinkResult.
+        """
+        changes = self.plan_state_all(enabled, slots)
+        link_groups = [link_group for slot, name, link_group in changes]
+        if enabled:
+            results = linker.create_links_batch(link_groups)
+        else:
+            results = linker.remove_links_batch(link_groups)
+        return _failed(results) + self.finish_state_all(enabled, changes)
+
+    def plan_state_all(self, enabled, slots=None):
+        """Prepare set_state_all() with links changed elsewhere.
+
+        This allows to create or remove links in another thread (see
+        link_worker) while the set stays consistent: fonts whose files
+        are missing are disabled right away, and other fonts change
+        their states in finish_state_all() once their links are done.
+
+        Returns a list of changes (slot, font_name, link_group); pass
+        the link groups to linker.create_links_batch() or
+        linker.remove_links_batch(), and then the changes to
+        finish_state_all(), in any number of chunks.
+        """
+        new_state = _ENABLED_LINKABLE if enabled else _LINKABLE
+        changes = []
+        modified = False
+        for slot in self.slots() if slots is None else slots:
+            state = self._states[slot]
+            if state & _SUSPENDED and not enabled:
+                self._states[slot] = 0
+                modified = True
+            elif state & _LINKABLE and state != new_state:
+                changes.append(
+                    (slot, self._names[slot], self.get_links(slot)))
+
+        if modified:
+            self._set_modified()
+        return changes
+
+    def finish_state_all(self, enabled, changes):
+        """Set states of fonts whose links were changed.
+
+        changes -- changes from plan_state_all().
+
+        Fonts that were removed or changed their states since
+        plan_state_all() are left as is, and the change of their links
+        is reverted: whatever changed them meanwhile (toggle_state(),
+        remove_fonts(), etc.) already took or released their own
+        reference, so keeping the change would count it twice and,
+        for fonts shared with other sets, unlink fonts that are still
+        enabled there.
+
+        Returns a list of failed linker.LinkResult.
+        """
+        new_state = _ENABLED_LINKABLE if enabled else _LINKABLE
+        old_state = _LINKABLE if enabled else _ENABLED_LINKABLE
+        stale = []
+        num_changed = 0
+        for slot, font_name, link_group in changes:
+            if (slot < len(self._names) and
+                    self._names[slot] == font_name and
+                    self._states[slot] == old_state):
+                self._states[slot] = new_state
+                num_changed += 1
+            else:
+                stale.append(link_group)
+
+        if num_changed:
+            if enabled:
+                self._num_active += num_changed
+            else:
+                self._num_active -= num_changed
+            self._set_modified()
+
+        if not stale:
+            return []
+        if enabled:
+            return _failed(linker.remove_links_batch(stale))
+        return _failed(linker.create_links_batch(stale))
+
+    def plan_switch(self, enabled):
+        """Prepare enabling or disabling the set as a whole.
+
+        This is like plan_state_all() for all fonts, or, for a set with
+        a separate directory, like set_active(). It allows to change
+        links of many sets in one batch (see SetStore.switch_exclusive()).
+
+        Returns a list of changes in the format of plan_state_all();
+        pass them to finish_switch() once their links are done.
+        """
+        if self._dir_name is None:
+            return self.plan_state_all(enabled)
+        if enabled == self._active:
+            return []
+        return [(None, None, (self._get_dir_link(),))]
+
+    def finish_switch(self, enabled, changes):
+        """Finish plan_switch().
+
+        Returns a list of failed linker.LinkResult.
+        """
+        if not changes or changes[0][0] is not None:
+            return self.finish_state_all(enabled, changes)
+
+        # The link of the separate directory.
+        if self._dir_name is not None and enabled != self._active:
+            self._active = enabled
+            self._set_modified()
+        return []
+
+    def update_installed(self):
+        """Re-check fonts against the index of installed fonts.
+
+        Should be called once the index is loaded.
+
+        Returns True if any font was changed.
+        """
+        changed = False
+        to_unlink = []
+        for font_name, slot in self._slots_by_name.items():
+            state = self._states[slot]
+            # Only installed fonts are enabled and not linkable.
+            if (state == _ENABLED
+                    or font_utils.installed_fonts.get(font_name) is None):
+                continue
+
+            if state & _ENABLED:
+                to_unlink.append(self.get_links(slot))
+            else:
+                self._num_active += 1
+            self._states[slot] = _ENABLED
+            changed = True
+
+        linker.remove_links_batch(to_unlink)
+
+        if changed:
+            self._set_modified()
+        return changed
+
+    def get_paths_in_dirs(self, dir_paths):
+        """Return a list of paths of fonts from the directories."""
+        paths = []
+        for dir_path in dir_paths:
+            dir_id = self._dir_ids_by_path.get(dir_path)
+            if dir_id is not None:
+                paths.extend(
+                    os.path.join(dir_path, self._names[slot])
+                    for slot in self._slots_by_dir_id[dir_id])
+        return paths
+
+    def update_files(self, statuses):
+        """Update fonts after their files were checked.
+
+        Fonts whose files disappeared are disabled (but still saved as
+        enabled), and fonts whose files are back are enabled again.
+
+        statuses -- {path: file_status.FileStatus}, e.g. of fonts from
+            get_paths_in_dirs() after the directories were changed.
+            Paths of fonts that are not in the set are skipped.
+
+        Returns a pair (changed, failures), where changed is True if
+        any font was changed, and failures is a list of failed
+        linker.LinkResult.
+        """
+        changed = False
+        to_link = []
+        to_unlink = []
+        for path, status in statuses.items():
+            font_dir, font_name = os.path.split(path)
+            slot = self._slots_by_name.get(font_name)
+            if slot is None or self.get_dir(slot) != font_dir:
+                continue
+
+            state = self._states[slot]
+            if state == _ENABLED:
+                continue
+
+            if status.exists == bool(state & _LINKABLE):
+                continue
+
+            changed = True
+            if not status.exists:
+                if state & _ENABLED:
+                    to_unlink.append(self.get_links(slot))
+                    self._num_active -= 1
+                    self._states[slot] = _SUSPENDED
+                else:
+                    self._states[slot] = 0
+                continue
+
+            # Metrics could also appear or disappear.
+            if status.metrics_path:
+                self._metrics[slot] = status.metrics_path
+            else:
+                self._metrics.pop(slot, None)
+
+            if state & _SUSPENDED:
+                self._states[slot] = _ENABLED_LINKABLE
+                self._num_active += 1
+                to_link.append(self.get_links(slot))
+            else:
+                self._states[slot] = _LINKABLE
+
+        failures = _failed(linker.remove_links_batch(to_unlink))
+        failures.extend(_failed(linker.create_links_batch(to_link)))
+        return changed, failures
+
+    @property
+    def as_json(self):
+        """List of fonts as JSON objects, sorted by filenames.
+
+        The list is cached until the set is modified, so it must not
+        be changed by the caller.
+        """
+        if self._json is None:
+            self._json = [
+                OrderedDict((
+                    ('enabled',
+                     bool(self._states[slot] & (_ENABLED | _SUSPENDED))),
+                    ('path', self.get_path(slot))))
+                for font_name, slot in sorted(self._slots_by_name.items())]
+        return self._json
@@ -1,7 +1,14 @@
 
+import hashlib
+import json
 import os
 import subprocess
+import threading
+import time
 
+from . import app_info
+from . import config
+from .profiling import profiler
 from . import utils
 
 
@@ -26,26 +33,304 @@ FONT_SEARCH_PATTERNS = [
     '*{}'.format(utils.string_to_glob(ext)) for ext in FONT_EXTENSIONS]
 
 
-def _get_installed_fonts():
+class InstalledFontIndex:
+    """Index of fonts installed in the system {font_name: font_dir}.
+
+    Listing fonts with fc-list can take seconds on systems with many
+    fonts, so the index is cached on disk and is only rebuilt (in a
+    background thread) if fontconfig's system cache directories or
+    user font directories were modified since the index was created.
+    Links created by FontLink don't count as modifications.
+    """
+
+    _CACHE_FILE = os.path.join(config.CACHE_DIR, 'installed_fonts.json')
+    _CACHE_VERSION = 2
+
+    def __init__(self):
+        self._fonts = {}
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._thread = None
+
+    @property
+    def is_loading(self):
+        """True if the index is not ready yet."""
+        return not self._ready.is_set()
+
+    def get(self, font_name):
+        """Return the directory of the installed font.
+
+        Returns None if the font is not installed or the index is
+        still loading; use is_loading to distinguish the two cases.
+        """
+        return self._fonts.get(font_name)
+
+    def wait(self, timeout=None):
+        """Block until the index is ready.
+
+        Returns False on timeout.
+        """
+        return self._ready.wait(timeout)
+
+    def add_ready_callback(self, callback):
+        """Call callback() once the index is ready.
+
+        The callback is called from the loader thread, or immediately
+        if the index is already loaded.
+        """
+        with self._lock:
+            if not self._ready.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def load(self):
+        """Start loading the index.
+
+        The cached index is loaded synchronously if it's up to date.
+        Otherwise, the index is rebuilt in a background thread.
+        """
+        if self._thread is not None or self._ready.is_set():
+            return
+
+        key = self._get_cache_key()
+        fonts = self._load_cache(key)
+        if fonts is not None:
+            self._set_fonts(fonts)
+            return
+
+        self._thread = threading.Thread(
+            target=self._rebuild, args=(key,), daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _get_fonts_dir_key():
+        """Return a digest of config.FONTS_DIR without our links.
+
+        The directory itself is modified every time fonts are linked,
+        so only entries that are not links count: fonts and
+        subdirectories installed by the user.
+        """
+        entries = []
+        try:
+            with os.scandir(config.FONTS_DIR) as it:
+                for entry in it:
+                    if entry.is_symlink():
+                        continue
+                    try:
+                        entries.append('{}:{}'.format(
+                            entry.name, entry.stat().st_mtime_ns))
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+
+        entries.sort()
+        return hashlib.sha1(
+            '\n'.join(entries).encode('utf-8', 'surrogateescape')
+            ).hexdigest()
+
+    @classmethod
+    def _get_cache_key(cls):
+        key = {}
+        for path in (
+                config.FONTCONFIG_CACHE_DIRS + (config.LEGACY_FONTS_DIR,)):
+            try:
+                key[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                pass
+        key[config.FONTS_DIR] = cls._get_fonts_dir_key()
+        return key
+
+    def _load_cache(self, key):
+        try:
+            with open(self._CACHE_FILE, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+            if (cache['version'] == self._CACHE_VERSION
+                    and cache['key'] == key):
+                return cache['fonts']
+        except (KeyError, TypeError, ValueError, OSError):
+            pass
+        return None
+
+    def _save_cache(self, key, fonts):
+        try:
+            utils.write_atomic(
+                self._CACHE_FILE,
+                json.dumps(
+                    {
+                        'version': self._CACHE_VERSION,
+                        'key': key,
+                        'fonts': fonts,
+                    },
+                    ensure_ascii=False))
+        except OSError:
+            pass
+
+    def _rebuild(self, key):
+        with profiler.phase('fc-list'):
+            fonts = _list_installed_fonts()
+        self._save_cache(key, fonts)
+        self._set_fonts(fonts)
+
+    def _set_fonts(self, fonts):
+        with self._lock:
+            self._fonts = fonts
+            self._ready.set()
+            callbacks = self._callbacks
+            self._callbacks = []
+
+        for callback in callbacks:
+            callback()
+
+
+def _is_set_links_dir(font_dir):
+    """Return True if font_dir is a directory of links of a set.
+
+    See FontSetCore.set_separate_dir(). fontconfig finds these
+    directories through their links "fontlink-<name>" in
+    config.FONTS_DIR, or in config.SET_LINKS_DIR if the font
+    directories are configured so.
+    """
+    return (
+        font_dir.startswith(config.SET_LINKS_DIR + os.sep)
+        or font_dir.startswith(
+            os.path.join(config.FONTS_DIR, app_info.NAME + '-')))
+
+
+def _list_installed_fonts():
     """Create a mapping of installed fonts {font_name: font_dir}."""
     fonts = {}
     try:
-        for path in subprocess.check_output(
-                ['fc-list', ':', 'file'],
-                universal_newlines=True).split():
-            font_dir, font_name = os.path.split(path.rstrip(':'))
-            fonts[font_name] = font_dir
-    except FileNotFoundError:
-        pass
+        # fontconfig can't output NUL bytes (the format is expanded to
+        # a C string), so paths are separated by newlines. Unlike the
+        # default output, this keeps paths with spaces intact.
+        output = subprocess.check_output(
+            ['fc-list', '--format', '%{file}\\n'])
+    except (OSError, subprocess.CalledProcessError):
+        return fonts
+
+    for path in output.split(b'\n'):
+        if not path:
+            continue
+        font_dir, font_name = os.path.split(os.fsdecode(path))
+        # Skip links created by FontLink itself, e.g. left after a
+        # crash or created while the index is rebuilt.
+        if _is_set_links_dir(font_dir) or (
+                font_dir == config.FONTS_DIR
+                and os.path.islink(os.path.join(font_dir, font_name))):
+            continue
+        fonts[font_name] = font_dir
     return fonts
 
 
-INSTALLED_FONTS = _get_installed_fonts()
+installed_fonts = InstalledFontIndex()
 
 
 _AFM_EXTENSIONS = ('.afm', '.AFM', '.Afm')
 _PFM_EXTENSIONS = ('.pfm', '.PFM', '.Pfm')
 
+# Subdirectories of a font's directory where metrics are searched.
+METRICS_SUBDIRS = tuple(
+    ext[1:] for ext in _AFM_EXTENSIONS + _PFM_EXTENSIONS)
+
+# Extensions in the order of preference.
+_METRICS_EXTENSIONS = ('.afm', '.pfm')
+_METRICS_SUBDIR_NAMES = tuple(ext[1:] for ext in _METRICS_EXTENSIONS)
+
+
+class _MetricsFinder:
+    """Finder of PS metrics that caches listings of directories.
+
+    Each font directory and its metrics subdirectories are read once
+    with os.scandir(), and metrics are then matched in memory,
+    case-insensitively. A listing is read again when the
+    modification time of its directory changes; the time is checked
+    at most once per _REVALIDATE_INTERVAL seconds, so importing many
+    fonts from the same directory costs almost no system calls.
+    """
+
+    _REVALIDATE_INTERVAL = 2.0
+
+    def __init__(self):
+        # {dir: (mtime, monotonic time of the last validation,
+        #        {lowercase name: name} of metrics files,
+        #        {lowercase name: [names]} of metrics subdirectories)}
+        self._listings = {}
+
+    def _read_dir(self, dir_path):
+        files = {}
+        subdirs = {}
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                name = entry.name.lower()
+                try:
+                    if name.endswith(_METRICS_EXTENSIONS):
+                        if entry.is_file():
+                            files.setdefault(name, entry.name)
+                    elif name in _METRICS_SUBDIR_NAMES:
+                        if entry.is_dir():
+                            subdirs.setdefault(name, []).append(entry.name)
+                except OSError:
+                    continue
+
+        for names in subdirs.values():
+            names.sort()
+        return files, subdirs
+
+    def _get_listing(self, dir_path):
+        """Return (files, subdirs) of the directory or None."""
+        now = time.monotonic()
+        listing = self._listings.get(dir_path)
+        if (listing is not None
+                and now - listing[1] < self._REVALIDATE_INTERVAL):
+            return listing[2:]
+
+        try:
+            mtime = os.stat(dir_path).st_mtime_ns
+            if listing is not None and listing[0] == mtime:
+                files, subdirs = listing[2:]
+            else:
+                files, subdirs = self._read_dir(dir_path)
+        except OSError:
+            self._listings.pop(dir_path, None)
+            return None
+
+        self._listings[dir_path] = (mtime, now, files, subdirs)
+        return files, subdirs
+
+    def find(self, font_dir, font_name):
+        listing = self._get_listing(font_dir)
+        if listing is None:
+            return ''
+
+        files, subdirs = listing
+        font_name = font_name.lower()
+        for ext in _METRICS_EXTENSIONS:
+            name = files.get(font_name + ext)
+            if name is not None:
+                return os.path.join(font_dir, name)
+
+        for ext in _METRICS_EXTENSIONS:
+            for subdir in subdirs.get(ext[1:], ()):
+                subdir_path = os.path.join(font_dir, subdir)
+                subdir_listing = self._get_listing(subdir_path)
+                if subdir_listing is None:
+                    continue
+                name = subdir_listing[0].get(font_name + ext)
+                if name is not None:
+                    return os.path.join(subdir_path, name)
+
+        return ''
+
+    def invalidate(self, dir_path):
+        """Force revalidation of the directory on the next search."""
+        self._listings.pop(dir_path, None)
+
+
+_metrics_finder = _MetricsFinder()
+
 
 def find_metrics(font_dir, font_name):
     """Find PS metrics (AFM or PFM).
@@ -53,22 +338,14 @@ def find_metrics(font_dir, font_name):
     font_dir -- directory to search in.
     font_name -- font name without extension.
 
+    Metrics are searched case-insensitively in font_dir and then in
+    its afm and pfm subdirectories; AFM is preferred.
+
     Returns an empty string if nothing found.
     """
-    for ext in _AFM_EXTENSIONS + _PFM_EXTENSIONS:
-        path = os.path.join(font_dir, font_name + ext)
-        if os.path.isfile(path):
-            return path
-
-    for extensions in (_AFM_EXTENSIONS, _PFM_EXTENSIONS):
-        for subdir in (ext[1:] for ext in extensions):
-            subpath = os.path.join(font_dir, subdir)
-            if not os.path.isdir(subpath):
-                continue
-
-            for ext in extensions:
-                path = os.path.join(subpath, font_name + ext)
-                if os.path.isfile(path):
-                    return path
-
-    return ''
+    return _metrics_finder.find(font_dir, font_name)
+
+
+def invalidate_metrics(dir_path):
+    """Force re-reading of the directory on the next find_metrics()."""
+    _metrics_finder.invalidate(dir_path)
@@ -0,0 +1,175 @@
+
+from collections import deque
+import threading
+import traceback
+
+
+class LinkJob:
+    """Work on links split into chunks, done by LinkWorker.
+
+    func(chunk) is called in the worker thread for each chunk in order.
+    Results of done chunks are taken with take_results() in the thread
+    that owns the fonts, so states of fonts can be updated in batches
+    as their links appear on disk.
+    """
+
+    def __init__(self, func, chunks, context=None):
+        """Create a job.
+
+        context -- context manager (e.g. linker.reconcile()) that is
+            entered in the worker thread around all chunks.
+        """
+        self._func = func
+        self._chunks = chunks
+        self._context = context
+        self._results = deque()
+        self._num_done = 0
+        self._lock = threading.Lock()
+        self._started = False
+        self._cancelled = False
+        self._finished = threading.Event()
+
+    @property
+    def progress(self):
+        """Fraction of done chunks from 0 to 1."""
+        if not self._chunks:
+            return 1.0
+        return self._num_done / len(self._chunks)
+
+    @property
+    def is_finished(self):
+        """True if all chunks were done or the job was cancelled.
+
+        Check it before take_results(), so that no results are lost.
+        """
+        return self._finished.is_set()
+
+    def cancel(self):
+        """Skip chunks that were not started yet."""
+        with self._lock:
+            self._cancelled = True
+            if not self._started:
+                self._finished.set()
+
+    def wait(self):
+        """Block until the job is finished."""
+        self._finished.wait()
+
+    def take_results(self):
+        """Return [(chunk, result)] of chunks done since the last call."""
+        results = []
+        while self._results:
+            results.append(self._results.popleft())
+        return results
+
+    def _run_chunks(self):
+        for chunk in self._chunks:
+            if self._cancelled:
+                break
+            self._results.append((chunk, self._func(chunk)))
+            self._num_done += 1
+
+    def _run(self):
+        with self._lock:
+            if self._cancelled:
+                return
+            self._started = True
+
+        try:
+            if self._context is None:
+                self._run_chunks()
+            else:
+                with self._context:
+                    self._run_chunks()
+        finally:
+            self._finished.set()
+
+
+class LinkWorker:
+    """Thread that runs LinkJob one at a time in order.
+
+    Creating or removing thousands of links can take long on slow
+    file systems (NFS, encrypted home directories), so bulk changes
+    are done here instead of the main thread. The linker is
+    thread-safe, so single fonts can still be linked in the main
+    thread meanwhile.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._jobs = deque()
+        self._current_job = None
+        self._thread = None
+        self._callbacks = []
+
+    @property
+    def is_busy(self):
+        """True if any job is pending or running."""
+        with self._cond:
+            return self._current_job is not None or bool(self._jobs)
+
+    @property
+    def progress(self):
+        """Progress of the running job from 0 to 1, or None."""
+        job = self._current_job
+        return None if job is None else job.progress
+
+    def add_callback(self, callback):
+        """Call callback(is_busy) when the worker starts or stops.
+
+        The callback is called from an arbitrary thread.
+        """
+        self._callbacks.append(callback)
+
+    def _notify(self, is_busy):
+        for callback in self._callbacks:
+            callback(is_busy)
+
+    def submit(self, job):
+        """Schedule the LinkJob and return it."""
+        with self._cond:
+            if self._current_job is None and not self._jobs:
+                self._notify(True)
+            self._jobs.append(job)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+        return job
+
+    def cancel_all(self):
+        """Cancel all pending jobs and the running one."""
+        with self._cond:
+            for job in self._jobs:
+                job.cancel()
+            if self._current_job is not None:
+                self._current_job.cancel()
+
+    def wait(self):
+        """Block until all jobs are finished."""
+        with self._cond:
+            while self._current_job is not None or self._jobs:
+                self._cond.wait()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._jobs:
+                    self._cond.wait()
+                job = self._current_job = self._jobs.popleft()
+
+            try:
+                job._run()
+            except Exception:
+                # A failed job must not stop the worker.
+                traceback.print_exc()
+            finally:
+                with self._cond:
+                    self._current_job = None
+                    if not self._jobs:
+                        self._notify(False)
+                    self._cond.notify_all()
+
+
+worker = LinkWorker()
@@ -1,52 +1,486 @@
 
-from collections import namedtuple, Counter
+from collections import namedtuple, Counter, OrderedDict
+from contextlib import contextmanager
+import itertools
+import json
 import os
+import threading
+
+from .async_writer import writer
 
 
 Link = namedtuple('Link', 'source target')
 
 
+class LinkStatus:
+    # The link was created.
+    CREATED = 'created'
+    # The target is already a link to the same source.
+    EXISTS = 'exists'
+    # The target is occupied by another file.
+    COLLISION = 'collision'
+    # The link was removed.
+    REMOVED = 'removed'
+    # Other error (permission denied, no such directory, etc.);
+    # LinkResult.error contains the exception.
+    ERROR = 'error'
+
+
+class LinkResult(namedtuple('LinkResult', 'link status error')):
+
+    __slots__ = ()
+
+    @property
+    def failed(self):
+        return self.status in (LinkStatus.COLLISION, LinkStatus.ERROR)
+
+
+class _Journal:
+    """Append-only journal of links created by FontLink.
+
+    Each line is a JSON array: ["+", target, source] for a created
+    link, or ["-", target] for a removed one. A truncated last line
+    (e.g. after a power loss) is ignored.
+
+    Appended records are synced to disk by async_writer, so toggling
+    a font doesn't wait for fsync() in the main thread, and a batch
+    of appends costs a single fsync(). Use writer.flush() to wait for
+    it.
+    """
+
+    def __init__(self):
+        self.path = None
+
+    def read(self):
+        """Replay the journal and return {target: source}."""
+        links = {}
+        if self.path is None:
+            return links
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        if record[0] == '+':
+                            links[record[1]] = record[2]
+                        elif record[0] == '-':
+                            links.pop(record[1], None)
+                    except (ValueError, IndexError, TypeError):
+                        continue
+        except OSError:
+            pass
+
+        return links
+
+    def _write(self, mode, records, sync):
+        if self.path is None:
+            return
+
+        try:
+            with open(self.path, mode, encoding='utf-8') as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False))
+                    f.write('\n')
+                f.flush()
+                if sync:
+                    os.fsync(f.fileno())
+        except OSError:
+            pass
+
+    def _sync(self, path):
+        with open(path, 'rb') as f:
+            os.fsync(f.fileno())
+
+    def append(self, results):
+        """Record linker.LinkResult of created and removed links."""
+        records = []
+        for result in results:
+            if result.status in (LinkStatus.CREATED, LinkStatus.EXISTS):
+                records.append(
+                    ('+', result.link.target, result.link.source))
+            elif result.status == LinkStatus.REMOVED:
+                records.append(('-', result.link.target))
+
+        if records:
+            self._write('a', records, False)
+            if self.path is not None:
+                path = self.path
+                writer.call(path, lambda: self._sync(path))
+
+    def rewrite(self, links):
+        """Replace the journal with {target: source} links."""
+        self._write(
+            'w',
+            (('+', target, source) for target, source in links.items()),
+            True)
+
+
+_journal = _Journal()
+
+# Links are created and removed both in the main thread and by the
+# link worker (see link_worker), so the functions that change the
+# state below hold the lock.
+_lock = threading.RLock()
+
 _refcounter = Counter()
 
+# Targets {target: source} that were created (or found already linked
+# to the same source) by FontLink and therefore can be unlinked.
+# Targets that collided with other files are never removed.
+_owned_targets = {}
+
+# Links {target: source} left from the previous session that can be
+# reused instead of being recreated; see reconcile().
+_adoptable = None
+
+_change_callbacks = []
+
+_USE_DIR_FD = {os.open, os.symlink, os.readlink, os.unlink} <= \
+    os.supports_dir_fd
+
+
+def _group_by_dir(links):
+    """Group links by target directory {dir: [(name, link), ...]}."""
+    groups = OrderedDict()
+    for link in links:
+        target_dir, name = os.path.split(link.target)
+        groups.setdefault(target_dir, []).append((name, link))
+    return groups
+
+
+def _open_dir(path):
+    if not _USE_DIR_FD:
+        return None
+    return os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+
+
+def _symlink(link, name, dir_fd):
+    if dir_fd is None:
+        target, kwargs = link.target, {}
+    else:
+        target, kwargs = name, {'dir_fd': dir_fd}
+
+    if _adoptable is not None and link.target in _adoptable:
+        if _adoptable.pop(link.target) == link.source:
+            _owned_targets[link.target] = link.source
+            return LinkResult(link, LinkStatus.EXISTS, None)
+
+        # Our old link points to another source; replace it.
+        try:
+            os.unlink(target, **kwargs)
+        except OSError:
+            pass
+
+    try:
+        os.symlink(link.source, target, **kwargs)
+    except FileExistsError:
+        try:
+            if os.readlink(target, **kwargs) == link.source:
+                _owned_targets[link.target] = link.source
+                return LinkResult(link, LinkStatus.EXISTS, None)
+        except OSError:
+            # Not a link.
+            pass
+        return LinkResult(link, LinkStatus.COLLISION, None)
+    except OSError as e:
+        return LinkResult(link, LinkStatus.ERROR, e)
+
+    _owned_targets[link.target] = link.source
+    return LinkResult(link, LinkStatus.CREATED, None)
+
+
+def _is_owned(link):
+    """Return True if the target is our link to the source of link.
+
+    A target that collided with another file may still be owned
+    through a different link (e.g. a font with the same name from
+    another directory), which must stay.
+    """
+    return _owned_targets.get(link.target) == link.source
+
+
+def _unlink(link, name, dir_fd):
+    if dir_fd is None:
+        target, kwargs = link.target, {}
+    else:
+        target, kwargs = name, {'dir_fd': dir_fd}
+
+    _owned_targets.pop(link.target, None)
+    try:
+        os.unlink(target, **kwargs)
+    except FileNotFoundError:
+        return None
+    except OSError as e:
+        return LinkResult(link, LinkStatus.ERROR, e)
+    return LinkResult(link, LinkStatus.REMOVED, None)
+
+
+def add_change_callback(callback):
+    """Call callback(dirs) after links were created or removed.
+
+    dirs -- set of target directories that were changed.
+    """
+    _change_callbacks.append(callback)
+
+
+def _apply(func, links, changed_dirs):
+    """Apply func to links, adding changed directories to changed_dirs."""
+    results = []
+    for target_dir, dir_links in _group_by_dir(links).items():
+        try:
+            dir_fd = _open_dir(target_dir)
+        except OSError as e:
+            results.extend(
+                LinkResult(link, LinkStatus.ERROR, e)
+                for name, link in dir_links)
+            continue
+
+        try:
+            for name, link in dir_links:
+                result = func(link, name, dir_fd)
+                if result is None:
+                    continue
+                results.append(result)
+                if result.status in (
+                        LinkStatus.CREATED, LinkStatus.REMOVED):
+                    changed_dirs.add(target_dir)
+        finally:
+            if dir_fd is not None:
+                os.close(dir_fd)
+
+    return results
+
+
+def _notify(changed_dirs):
+    if changed_dirs:
+        for callback in _change_callbacks:
+            callback(changed_dirs)
+
+
+def create_links_batch(link_groups):
+    """Create (link) many link groups at once.
+
+    link_groups -- iterable of link groups (tuples of linker.Link).
+
+    Each target directory is opened only once, and links are created
+    relative to its descriptor. Only groups that were not already
+    linked touch the file system.
+
+    Returns a list of linker.LinkResult for every link that was
+    processed on disk.
+    """
+    with _lock:
+        links = []
+        for link_group in link_groups:
+            if _refcounter[link_group] == 0:
+                links.extend(link_group)
+            _refcounter[link_group] += 1
+
+        changed_dirs = set()
+        results = _apply(_symlink, links, changed_dirs)
+        _journal.append(results)
+        _notify(changed_dirs)
+        return results
+
+
+def remove_links_batch(link_groups):
+    """Remove (unlink) many link groups linked by create_links_batch().
+
+    Returns a list of linker.LinkResult for every link that was
+    removed or failed to be removed.
+    """
+    with _lock:
+        links = []
+        for link_group in link_groups:
+            if _refcounter[link_group] == 0:
+                continue
+
+            _refcounter[link_group] -= 1
+            if _refcounter[link_group] == 0:
+                del _refcounter[link_group]
+                links.extend(
+                    link for link in link_group if _is_owned(link))
+
+        changed_dirs = set()
+        results = _apply(_unlink, links, changed_dirs)
+        _journal.append(results)
+        _notify(changed_dirs)
+        return results
+
+
+def change_links_batch(to_create, to_remove):
+    """Create and remove link groups in a single batch.
+
+    The result is the same as of create_links_batch(to_create)
+    followed by remove_links_batch(to_remove), but only the difference
+    touches the file system: groups that are both created and removed
+    keep their links (or stay unlinked) instead of being recreated.
+    Links are removed before new ones are created, so that a new link
+    can take the name of a removed one, and change callbacks are
+    called once.
+
+    Returns a list of linker.LinkResult for every link that was
+    processed on disk.
+    """
+    with _lock:
+        was_linked = {}
+        for link_group in itertools.chain(to_create, to_remove):
+            if link_group not in was_linked:
+                was_linked[link_group] = _refcounter[link_group] > 0
+
+        for link_group in to_create:
+            _refcounter[link_group] += 1
+        for link_group in to_remove:
+            if _refcounter[link_group] > 0:
+                _refcounter[link_group] -= 1
+
+        links_to_remove = []
+        links_to_create = []
+        for link_group, linked in was_linked.items():
+            if _refcounter[link_group] > 0:
+                if not linked:
+                    links_to_create.extend(link_group)
+                continue
+
+            del _refcounter[link_group]
+            if linked:
+                links_to_remove.extend(
+                    link for link in link_group if _is_owned(link))
+
+        changed_dirs = set()
+        results = _apply(_unlink, links_to_remove, changed_dirs)
+        results.extend(_apply(_symlink, links_to_create, changed_dirs))
+        _journal.append(results)
+        _notify(changed_dirs)
+        return results
+
 
 def create_links(link_group):
     """Create (link) group of linker.Link.
 
     link_group -- tuple of linker.Link
-    """
-    if _refcounter[link_group] == 0:
-        for link in link_group:
-            try:
-                os.symlink(*link)
-            except OSError:
-                pass
-    _refcounter[link_group] += 1
-
 
-def _unlink_group(link_group):
-    for link in link_group:
-        if os.path.islink(link.target):
-            try:
-                os.unlink(link.target)
-            except OSError:
-                pass
+    Returns a list of linker.LinkResult; see create_links_batch().
+    """
+    return create_links_batch((link_group,))
 
 
 def remove_links(link_group):
     """Remove (unlink) link group linked by create_links()."""
-    if _refcounter[link_group] == 0:
-        return
+    return remove_links_batch((link_group,))
 
-    _refcounter[link_group] -= 1
-    if _refcounter[link_group] == 0:
-        _unlink_group(link_group)
 
+def remove_all_links(links_dir=None):
+    """Remove (unlink) all link groups liked by create_links().
 
-def remove_all_links():
-    """Remove (unlink) all link groups liked by create_links()."""
-    for link_group, refcount in _refcounter.items():
-        if refcount == 0:
-            continue
-        _unlink_group(link_group)
+    links_dir -- if not None, only groups with links in this directory
+        are removed. Other links stay in the journal, so they can be
+        reused in the next session; see reconcile().
+    """
+    with _lock:
+        links = []
+        for link_group in list(_refcounter):
+            if (links_dir is not None
+                    and os.path.dirname(link_group[0].target) != links_dir):
+                continue
+
+            del _refcounter[link_group]
+            links.extend(
+                link for link in link_group if _is_owned(link))
+
+        changed_dirs = set()
+        results = _apply(_unlink, links, changed_dirs)
+        journaled = {}
+        if _adoptable is not None:
+            # Within reconcile(); orphans are removed on its exit.
+            journaled.update(_adoptable)
+        journaled.update(_owned_targets)
+        _journal.rewrite(journaled)
+        _notify(changed_dirs)
+        return results
+
+
+def set_journal(path):
+    """Set the path of the journal of created links.
+
+    The journal makes it possible to clean up links left after a crash;
+    see reconcile().
+    """
+    _journal.path = path
+
+
+def read_journal():
+    """Return links {target: source} recorded in the journal."""
+    return _journal.read()
+
+
+def find_journaled_links(links_dir):
+    """Return journaled links {target: source} that exist in links_dir.
+
+    The directory is read once with os.scandir(); the links
+    themselves are not resolved.
+    """
+    return _find_links(links_dir, _journal.read())
+
+
+def _find_links(links_dir, journaled):
+    links = {}
+    try:
+        with os.scandir(links_dir) as it:
+            for entry in it:
+                source = journaled.get(entry.path)
+                if source is not None and entry.is_symlink():
+                    links[entry.path] = source
+    except OSError:
+        pass
+    return links
+
+
+@contextmanager
+def reconcile(*links_dirs, remove_orphans=True):
+    """Reuse links left in links_dirs from the previous session.
+
+    Links recorded in the journal that still exist in links_dirs are
+    found with find_journaled_links(). While in the context, creating
+    a link that already exists with the same source costs nothing.
+    On exit, journaled links that were not requested again (orphans)
+    are removed if remove_orphans is True, or kept as owned otherwise,
+    and the journal is compacted. Links changed in the context are
+    journaled right away as usual, so that they can be cleaned up
+    after a crash in the middle of the context.
+
+    Yields a list to which failed linker.LinkResult of the orphan
+    removal are appended on exit.
+    """
+    global _adoptable
+
+    journaled = _journal.read()
+    adoptable = {}
+    for links_dir in links_dirs:
+        adoptable.update(_find_links(links_dir, journaled))
 
-    _refcounter.clear()
+    failures = []
+    with _lock:
+        _adoptable = adoptable
+    try:
+        yield failures
+    finally:
+        with _lock:
+            _adoptable = None
+            if remove_orphans:
+                # Links that are already owned were created before the
+                # context and are still in use.
+                orphans = [
+                    Link(source, target)
+                    for target, source in adoptable.items()
+                    if _owned_targets.get(target) != source]
+                changed_dirs = set()
+                failures.extend(
+                    result
+                    for result in _apply(_unlink, orphans, changed_dirs)
+                    if result.failed)
+                _notify(changed_dirs)
+            else:
+                _owned_targets.update(adoptable)
+            _journal.rewrite(_owned_targets)
@@ -0,0 +1,169 @@
+
+from collections import Counter
+from contextlib import contextmanager
+import functools
+import os
+import sys
+import threading
+import time
+
+
+ENV_VAR = 'FONTLINK_PROFILE'
+# Path to write cProfile statistics of the main thread to.
+DUMP_ENV_VAR = 'FONTLINK_PROFILE_DUMP'
+
+# Functions of the os module whose calls are counted.
+_COUNTED_FUNCTIONS = (
+    'stat',
+    'lstat',
+    'scandir',
+    'listdir',
+    'symlink',
+    'readlink',
+    'unlink',
+    )
+
+
+class Profiler:
+    """Recorder of phase timings and system call counters.
+
+    Profiling of the startup is enabled with the --profile option or
+    the FONTLINK_PROFILE environment variable. The report is printed
+    to stderr when the program exits, so that users can attach it to
+    bug reports.
+
+    Phases are recorded with monotonic timestamps relative to the
+    creation of the profiler (bin/fontlink imports this module first)
+    even if profiling is disabled, since the decision is made only
+    after the command line is parsed; recording a phase is cheap. For
+    the same reason, this module imports nothing heavy.
+
+    The profiler is thread-safe, so phases can be recorded from
+    background threads (e.g. fc-list or the link worker).
+    """
+
+    def __init__(self):
+        self._start_time = time.monotonic()
+        self._lock = threading.Lock()
+        self.enabled = False
+        self._dump_path = None
+        self._cprofile = None
+        # [(name, start, end)]
+        self._phases = []
+        # {name: start} of phases that are not finished yet.
+        self._open_phases = {}
+        self._counters = Counter()
+
+    @property
+    def start_time(self):
+        """Monotonic time the profiler was created."""
+        return self._start_time
+
+    def enable(self, dump_path=None):
+        """Enable counters and the report.
+
+        dump_path -- if not None, the main thread is also profiled with
+            cProfile, and the statistics are written to this file by
+            report(); view them with the pstats module.
+
+        Calls of the functions of the os module that touch the file
+        system (stat(), symlink(), etc.) are counted from now on, in
+        all threads.
+        """
+        if self.enabled:
+            return
+        self.enabled = True
+
+        for name in _COUNTED_FUNCTIONS:
+            func = getattr(os, name, None)
+            if func is not None:
+                setattr(os, name, self._wrap(name, func))
+
+        if dump_path:
+            import cProfile
+
+            self._dump_path = dump_path
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def enable_from_env(self):
+        """Enable the profiler if requested by the environment."""
+        if os.environ.get(ENV_VAR) or os.environ.get(DUMP_ENV_VAR):
+            self.enable(os.environ.get(DUMP_ENV_VAR))
+
+    def _wrap(self, name, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            self.count(name)
+            return func(*args, **kwargs)
+        return wrapper
+
+    def count(self, name, n=1):
+        """Increment the counter if the profiler is enabled."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] += n
+
+    def begin(self, name):
+        """Start a phase that is finished with end()."""
+        with self._lock:
+            self._open_phases[name] = time.monotonic()
+
+    def end(self, name):
+        """Finish the phase started with begin()."""
+        now = time.monotonic()
+        with self._lock:
+            start = self._open_phases.pop(name, None)
+            if start is not None:
+                self._phases.append((name, start, now))
+
+    def add_phase(self, name, start, end):
+        """Record a phase from monotonic start and end times."""
+        with self._lock:
+            self._phases.append((name, start, end))
+
+    @contextmanager
+    def phase(self, name):
+        """Context manager that records the phase."""
+        self.begin(name)
+        try:
+            yield
+        finally:
+            self.end(name)
+
+    def report(self, file=None):
+        """Print the report and write the cProfile dump, if enabled."""
+        if not self.enabled:
+            return
+
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            try:
+                self._cprofile.dump_stats(self._dump_path)
+            except OSError as e:
+                print('Can\'t write profile: {}'.format(e), file=sys.stderr)
+            self._cprofile = None
+
+        if file is None:
+            file = sys.stderr
+
+        with self._lock:
+            phases = sorted(self._phases, key=lambda phase: phase[1])
+            counters = sorted(self._counters.items())
+
+        print('Profile (seconds since start):', file=file)
+        print('  {:<24} {:>9} {:>9}'.format('phase', 'start', 'time'),
+              file=file)
+        for name, start, end in phases:
+            print(
+                '  {:<24} {:>9.3f} {:>9.3f}'.format(
+                    name, start - self._start_time, end - start),
+                file=file)
+
+        print('  {:<24} {:>9}'.format('call', 'count'), file=file)
+        for name, count in counters:
+            print('  {:<24} {:>9}'.format(name, count), file=file)
+
+
+profiler = Profiler()
@@ -0,0 +1,311 @@
+
+import json
+import os
+import threading
+
+try:
+    import sqlite3
+except ImportError:
+    # Python can be built without SQLite; sets are kept in JSON then.
+    sqlite3 = None
+
+from . import config
+from .settings import settings
+
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sets (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    position INTEGER NOT NULL,
+    dir TEXT,
+    active INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS fonts (
+    set_id INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    enabled INTEGER NOT NULL,
+    PRIMARY KEY (set_id, path)
+) WITHOUT ROWID;
+'''
+
+
+def is_enabled():
+    """Return True if sets are stored in SQLite.
+
+    Settings must already be loaded.
+    """
+    return sqlite3 is not None and settings.get('sets_storage') == 'sqlite'
+
+
+class _SavedSet:
+    """State of a set in the database."""
+
+    __slots__ = (
+        'id', 'name', 'position', 'dir', 'active', 'fonts', 'states')
+
+    def __init__(self, set_id, name, position, dir_name, active):
+        self.id = set_id
+        self.name = name
+        self.position = position
+        self.dir = dir_name
+        self.active = active
+        # The "fonts" list of the last saved JSON set. Lists of fonts
+        # are cached by FontSetCore until the set is modified, so
+        # unchanged sets are skipped by identity.
+        self.fonts = None
+        # {path: enabled}, or None if fonts were not read yet.
+        self.states = None
+
+
+class SetDatabase:
+    """SQLite database of sets.
+
+    This is an optional storage of sets, enabled by setting
+    "sets_storage" to "sqlite" in settings.json. Unlike sets.json,
+    which is rewritten as a whole, only the rows of sets and fonts
+    that were changed since the previous save are written, and fonts
+    of each set are read with an indexed query. On the first use,
+    sets are migrated from sets.json, which is left intact.
+
+    Sets are passed in and out in the same JSON format as sets.json
+    (see SetStore.as_json); sets read from the database have an
+    additional "id" and no "fonts", which are read with read_fonts().
+    Sets are stored by their ids, so renaming a set only updates its
+    row. Sets passed to save() without "id" (new sets) get one; the
+    ids are returned, and should be passed with the sets from now on.
+
+    The database is thread-safe: sets are read in the main thread,
+    fonts by the link worker, and saved by the async writer.
+    """
+
+    _VERSION = 1
+
+    def __init__(self, path, json_path):
+        """Create the database.
+
+        path -- path to the database file.
+        json_path -- path to sets.json to migrate from.
+        """
+        self._path = path
+        self._json_path = json_path
+        self._lock = threading.Lock()
+        self._conn = None
+        # {id: _SavedSet} of all sets in the database, or None if the
+        # state is unknown, in which case the next save rewrites
+        # everything.
+        self._saved = None
+
+    def _connect(self):
+        if self._conn is not None:
+            return self._conn
+
+        is_new = not os.path.exists(self._path)
+        conn = sqlite3.connect(self._path, check_same_thread=False)
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            with conn:
+                conn.executescript(_SCHEMA)
+                conn.execute('PRAGMA user_version={}'.format(self._VERSION))
+            if is_new:
+                self._migrate(conn)
+        except sqlite3.Error:
+            conn.close()
+            raise
+
+        self._conn = conn
+        return conn
+
+    def _migrate(self, conn):
+        """Import sets from sets.json."""
+        try:
+            with open(self._json_path, 'r', encoding='utf-8') as f:
+                json_sets = json.load(f)
+        except (ValueError, OSError):
+            return
+
+        self._saved = {}
+        try:
+            with conn:
+                self._save(conn, json_sets)
+        except (KeyError, TypeError, AttributeError):
+            # Malformed sets; the transaction was rolled back, so the
+            # database starts empty.
+            self._saved = None
+
+    def read_sets(self, with_fonts=False):
+        """Return the list of sets in the JSON format.
+
+        with_fonts -- include "fonts" of each set; otherwise, they
+            should be read with read_fonts().
+
+        Raises OSError if the database can't be read.
+        """
+        with self._lock:
+            try:
+                conn = self._connect()
+                rows = conn.execute(
+                    'SELECT id, name, dir, active FROM sets '
+                    'ORDER BY position').fetchall()
+            except sqlite3.Error as e:
+                raise OSError(e) from e
+
+            self._saved = {}
+            json_sets = []
+            for position, (set_id, name, dir_name, active) in enumerate(
+                    rows):
+                json_set = {'id': set_id, 'name': name}
+                if dir_name is not None:
+                    json_set['dir'] = dir_name
+                    json_set['active'] = bool(active)
+                json_sets.append(json_set)
+                self._saved[set_id] = _SavedSet(
+                    set_id, name, position, dir_name, bool(active))
+
+        if with_fonts:
+            for json_set in json_sets:
+                json_set['fonts'] = self.read_fonts(json_set)
+        return json_sets
+
+    def read_fonts(self, json_set):
+        """Return "fonts" of a set returned by read_sets().
+
+        Fonts that can't be read are omitted.
+        """
+        with self._lock:
+            try:
+                rows = self._connect().execute(
+                    'SELECT path, enabled FROM fonts WHERE set_id = ?',
+                    (json_set['id'],)).fetchall()
+            except sqlite3.Error:
+                return []
+
+            saved = None
+            if self._saved is not None:
+                saved = self._saved.get(json_set['id'])
+            if saved is not None:
+                saved.states = {
+                    path: bool(enabled) for path, enabled in rows}
+
+        return [
+            {'enabled': bool(enabled), 'path': path}
+            for path, enabled in rows]
+
+    def save(self, json_sets):
+        """Write changes of sets since the previous save or read.
+
+        json_sets -- sets in the JSON format (see SetStore.as_json).
+
+        All changes are written in a single transaction.
+
+        Returns the list of ids of the sets, or None on error.
+        """
+        with self._lock:
+            try:
+                conn = self._connect()
+                with conn:
+                    if self._saved is None:
+                        conn.execute('DELETE FROM fonts')
+                        conn.execute('DELETE FROM sets')
+                        self._saved = {}
+                    return self._save(conn, json_sets)
+            except sqlite3.Error:
+                # The transaction was rolled back.
+                self._saved = None
+                return None
+
+    def _match_saved(self, json_sets):
+        """Return _SavedSet or None for each of json_sets."""
+        matches = [
+            self._saved.get(json_set.get('id')) for json_set in json_sets]
+        # Sets without a known id (e.g. saved again before their ids
+        # came back, or migrated) are matched by name.
+        matched_ids = set(saved.id for saved in matches if saved)
+        unmatched_by_name = {
+            saved.name: saved for saved in self._saved.values()
+            if saved.id not in matched_ids}
+        for i, json_set in enumerate(json_sets):
+            if matches[i] is None:
+                matches[i] = unmatched_by_name.pop(json_set['name'], None)
+        return matches
+
+    def _save(self, conn, json_sets):
+        matches = self._match_saved(json_sets)
+
+        matched_ids = set(saved.id for saved in matches if saved)
+        for set_id in [i for i in self._saved if i not in matched_ids]:
+            del self._saved[set_id]
+            conn.execute('DELETE FROM fonts WHERE set_id = ?', (set_id,))
+            conn.execute('DELETE FROM sets WHERE id = ?', (set_id,))
+
+        # Names are unique, so a set whose name is taken by another one
+        # (e.g. when two sets swap their names) gets a temporary name
+        # first.
+        names = set(json_set['name'] for json_set in json_sets)
+        for json_set, saved in zip(json_sets, matches):
+            if (saved is not None and saved.name != json_set['name']
+                    and saved.name in names):
+                saved.name = '\0{}'.format(saved.id)
+                conn.execute(
+                    'UPDATE sets SET name = ? WHERE id = ?',
+                    (saved.name, saved.id))
+
+        ids = []
+        for position, (json_set, saved) in enumerate(
+                zip(json_sets, matches)):
+            name = json_set['name']
+            dir_name = json_set.get('dir')
+            active = json_set.get('active', True)
+
+            if saved is None:
+                set_id = conn.execute(
+                    'INSERT INTO sets (id, name, position, dir, active) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (json_set.get('id'), name, position, dir_name, active)
+                    ).lastrowid
+                saved = self._saved[set_id] = _SavedSet(
+                    set_id, name, position, dir_name, active)
+                saved.states = {}
+            elif (saved.name, saved.position, saved.dir, saved.active) != (
+                    name, position, dir_name, active):
+                conn.execute(
+                    'UPDATE sets SET name = ?, position = ?, dir = ?, '
+                    'active = ? WHERE id = ?',
+                    (name, position, dir_name, active, saved.id))
+                saved.name = name
+                saved.position = position
+                saved.dir = dir_name
+                saved.active = active
+
+            fonts = json_set['fonts']
+            if fonts is not saved.fonts:
+                self._save_fonts(conn, saved, fonts)
+                saved.fonts = fonts
+            ids.append(saved.id)
+        return ids
+
+    def _save_fonts(self, conn, saved, fonts):
+        if saved.states is None:
+            saved.states = {
+                path: bool(enabled) for path, enabled in conn.execute(
+                    'SELECT path, enabled FROM fonts WHERE set_id = ?',
+                    (saved.id,))}
+
+        old_states = saved.states
+        states = {font['path']: font['enabled'] for font in fonts}
+
+        conn.executemany(
+            'DELETE FROM fonts WHERE set_id = ? AND path = ?',
+            ((saved.id, path) for path in old_states if path not in states))
+        conn.executemany(
+            'INSERT OR REPLACE INTO fonts (set_id, path, enabled) '
+            'VALUES (?, ?, ?)',
+            ((saved.id, path, enabled)
+             for path, enabled in states.items()
+             if old_states.get(path) != enabled))
+
+        saved.states = states
+
+
+db = SetDatabase(config.SETS_DB_FILE, config.SETS_FILE)
@@ -2,6 +2,7 @@
 import json
 import os
 
+from .async_writer import writer
 from . import config
 
 
@@ -9,20 +10,44 @@ class _Settings(dict):
 
     _FILE = os.path.join(config.CONFIG_DIR, 'settings.json')
 
+    def __init__(self):
+        super().__init__()
+        self._dirty = False
+        self._change_callbacks = []
+
+    def add_change_callback(self, callback):
+        """Call callback() after a setting was changed."""
+        self._change_callbacks.append(callback)
+
+    def __setitem__(self, key, value):
+        changed = key not in self or self[key] != value
+        super().__setitem__(key, value)
+        if changed:
+            self._dirty = True
+            for callback in self._change_callbacks:
+                callback()
+
     def load(self):
         try:
             with open(self._FILE, 'r', encoding='utf-8') as f:
                 self.update(json.load(f))
         except (ValueError, OSError):
             pass
+        self._dirty = False
 
     def save(self):
-        try:
-            with open(self._FILE, 'w', encoding='utf-8') as f:
-                json.dump(
-                    self, f, ensure_ascii=False, indent=2, sort_keys=True)
-        except OSError:
-            pass
+        """Save settings if they were changed since the last save.
+
+        The file is written in background by async_writer; use
+        writer.flush() to wait for it.
+        """
+        if not self._dirty:
+            return
+        # Serialized here, since settings can be changed while the
+        # file is written.
+        data = json.dumps(self, ensure_ascii=False, indent=2, sort_keys=True)
+        writer.write(self._FILE, lambda: data)
+        self._dirty = False
 
 
 settings = _Settings()
@@ -0,0 +1,347 @@
+
+from collections import Counter, deque
+import os
+import re
+import stat
+import threading
+import time
+import traceback
+
+
+_MOUNTS_FILE = '/proc/self/mounts'
+
+
+def _read_mount_points():
+    """Return mount points, longest first, or None if unknown.
+
+    Reading /proc doesn't touch the mounted file systems, so it never
+    blocks on a hung mount.
+    """
+    try:
+        with open(_MOUNTS_FILE, 'rb') as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+
+    mount_points = set()
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 2:
+            continue
+        # Spaces and other special characters are escaped as \ooo.
+        mount_point = re.sub(
+            rb'\\([0-7]{3})',
+            lambda match: bytes((int(match.group(1), 8),)),
+            fields[1])
+        mount_points.add(os.fsdecode(mount_point))
+
+    return sorted(mount_points, key=len, reverse=True)
+
+
+class FileKind:
+    # No answer within the timeout; the file system doesn't respond.
+    UNKNOWN = 'unknown'
+    # The file doesn't exist or can't be accessed.
+    MISSING = 'missing'
+    FILE = 'file'
+    DIR = 'dir'
+    # Other kinds of files (devices, sockets, etc.).
+    OTHER = 'other'
+
+
+class _Request:
+
+    __slots__ = (
+        'path', 'mount', 'kind', 'func', 'result', 'callback', 'abandoned',
+        'done')
+
+    def __init__(self, path, mount, func=None, callback=None):
+        """Create a request.
+
+        func -- if not None, it's called instead of stat(); see
+            StatService.call().
+        """
+        self.path = path
+        self.mount = mount
+        self.kind = FileKind.UNKNOWN
+        self.func = func
+        self.result = None
+        self.callback = callback
+        # True if the caller stopped waiting for the result.
+        self.abandoned = False
+        self.done = threading.Event()
+
+
+class StatService:
+    """Thread pool that calls stat() with timeouts and caches results.
+
+    These are checks of files for the interface that never block for
+    long. On a hung network mount (NFS, SMB), os.stat() can block for
+    minutes, which would freeze the window if called in the main
+    thread. The service calls stat() in its own threads and waits only
+    for a short time; if there's no answer yet, the file is reported
+    as unknown, and the answer is cached once it arrives.
+
+    A hung mount must not take all threads, so that files on other
+    mounts can still be checked: only a few stats run at once on each
+    mount, and threads stuck in stat() are replaced with new ones.
+
+    The service is thread-safe. A path that is already being checked is
+    not checked again; it's reported as unknown right away.
+    """
+
+    # Default time (seconds) to wait for an answer.
+    _TIMEOUT = 0.1
+    # Time (seconds) results and the list of mounts are cached.
+    _TTL = 2.0
+    # Expired results are removed when the cache grows beyond this.
+    _MAX_CACHE_SIZE = 4096
+    # Maximal number of stats that run at once on a single mount.
+    _MAX_PER_MOUNT = 2
+    # Time (seconds) after which a thread is considered stuck in
+    # stat(). Stuck threads don't count toward max_workers.
+    _STUCK_TIME = 1.0
+
+    def __init__(self, stat_func=os.stat, max_workers=8):
+        """Create the service.
+
+        stat_func -- function like os.stat() to check files with, e.g.
+            a slow stand-in in tests.
+        max_workers -- maximal number of threads that are not stuck.
+            Threads are started on demand while all others are busy.
+        """
+        self._stat_func = stat_func
+        self._max_workers = max_workers
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        # _Request waiting for a thread, in order of arrival.
+        self._queue = deque()
+        self._num_threads = 0
+        # Number of threads waiting for requests.
+        self._num_idle = 0
+        # {thread: monotonic time} of threads running stat().
+        self._busy_since = {}
+        # {mount: number of stats running on it}
+        self._num_running = Counter()
+        self._mount_points = None
+        self._mounts_time = None
+        # {path: (kind, monotonic time)}
+        self._cache = {}
+        # {path: _Request} of paths being checked.
+        self._pending = {}
+
+    def get_kind(self, path, timeout=None):
+        """Return FileKind of the path.
+
+        timeout -- time (seconds) to wait for an answer, or None for
+            the default. FileKind.UNKNOWN is returned on timeout.
+        """
+        return self.get_kinds((path,), timeout)[path]
+
+    def get_kinds(self, paths, timeout=None):
+        """Return {path: FileKind} for the paths.
+
+        All paths are checked in parallel, and the timeout is for the
+        whole batch. Paths that are still being checked since a
+        previous call are reported as unknown without waiting.
+        """
+        if timeout is None:
+            timeout = self._TIMEOUT
+        deadline = time.monotonic() + timeout
+
+        kinds = {}
+        requests = []
+        with self._lock:
+            now = time.monotonic()
+            for path in paths:
+                entry = self._cache.get(path)
+                if entry is not None and now - entry[1] < self._TTL:
+                    kinds[path] = entry[0]
+                elif path in self._pending:
+                    kinds[path] = FileKind.UNKNOWN
+                else:
+                    request = _Request(path, self._get_mount(path, now))
+                    self._pending[path] = request
+                    self._queue.append(request)
+                    requests.append(request)
+
+            if requests:
+                self._cond.notify(len(requests))
+                self._start_threads(now)
+
+        for request in requests:
+            request.done.wait(max(0.0, deadline - time.monotonic()))
+            kinds[request.path] = request.kind
+        return kinds
+
+    def call(self, funcs, timeout=None, callback=None):
+        """Call functions that access files in threads of the service.
+
+        This is for checks that need more than the kind of a file; the
+        functions are limited like stat() of their paths, so a hung
+        mount doesn't take all threads. Results are not cached.
+
+        funcs -- {path: func}, where func() accesses the file system
+            at the path, e.g. checks files in the directory.
+        timeout -- time (seconds) to wait for all results, or None for
+            the default.
+        callback -- if not None, callback(path, result) is called in
+            a thread of the service for each func that is done after
+            the timeout.
+
+        Returns {path: result} of funcs done within the timeout.
+        """
+        if timeout is None:
+            timeout = self._TIMEOUT
+        deadline = time.monotonic() + timeout
+
+        requests = []
+        with self._lock:
+            now = time.monotonic()
+            for path, func in funcs.items():
+                request = _Request(
+                    path, self._get_mount(path, now), func, callback)
+                self._queue.append(request)
+                requests.append(request)
+
+            if requests:
+                self._cond.notify(len(requests))
+                self._start_threads(now)
+
+        for request in requests:
+            request.done.wait(max(0.0, deadline - time.monotonic()))
+
+        results = {}
+        with self._lock:
+            for request in requests:
+                if request.done.is_set():
+                    results[request.path] = request.result
+                else:
+                    request.abandoned = True
+        return results
+
+    def invalidate(self):
+        """Forget all cached results."""
+        with self._lock:
+            self._cache.clear()
+
+    def _get_mount(self, path, now):
+        if (self._mounts_time is None
+                or now - self._mounts_time >= self._TTL):
+            self._mount_points = _read_mount_points()
+            self._mounts_time = now
+
+        if self._mount_points is not None:
+            for mount_point in self._mount_points:
+                if (path == mount_point
+                        or path.startswith(mount_point.rstrip('/') + '/')):
+                    return mount_point
+        # Mounts are unknown; the directory is the best guess.
+        return os.path.dirname(path)
+
+    def _num_stuck(self, now):
+        return sum(
+            1 for start in self._busy_since.values()
+            if now - start >= self._STUCK_TIME)
+
+    def _take_request(self):
+        """Remove and return a request whose mount has a free slot."""
+        for i, request in enumerate(self._queue):
+            if self._num_running[request.mount] < self._MAX_PER_MOUNT:
+                del self._queue[i]
+                return request
+        return None
+
+    def _start_threads(self, now):
+        num_ready = 0
+        num_running = Counter(self._num_running)
+        for request in self._queue:
+            if num_running[request.mount] < self._MAX_PER_MOUNT:
+                num_running[request.mount] += 1
+                num_ready += 1
+
+        num_ready -= self._num_idle
+        num_active = self._num_threads - self._num_stuck(now)
+        while num_ready > 0 and num_active < self._max_workers:
+            self._num_threads += 1
+            threading.Thread(target=self._run, daemon=True).start()
+            num_ready -= 1
+            num_active += 1
+
+    def _stat(self, path):
+        try:
+            mode = self._stat_func(path).st_mode
+        except (OSError, ValueError):
+            return FileKind.MISSING
+
+        if stat.S_ISREG(mode):
+            return FileKind.FILE
+        elif stat.S_ISDIR(mode):
+            return FileKind.DIR
+        return FileKind.OTHER
+
+    def _call(self, func, *args):
+        # An error must not kill the thread.
+        try:
+            return func(*args)
+        except Exception:
+            traceback.print_exc()
+            return None
+
+    def _prune_cache(self, now):
+        expired = [
+            path for path, (kind, time_added) in self._cache.items()
+            if now - time_added >= self._TTL]
+        for path in expired:
+            del self._cache[path]
+
+    def _run(self):
+        thread = threading.current_thread()
+        with self._lock:
+            while True:
+                request = self._take_request()
+                if request is None:
+                    self._num_idle += 1
+                    self._cond.wait()
+                    self._num_idle -= 1
+                    continue
+
+                self._num_running[request.mount] += 1
+                self._busy_since[thread] = time.monotonic()
+                self._lock.release()
+                try:
+                    if request.func is None:
+                        request.kind = self._stat(request.path)
+                    else:
+                        request.result = self._call(request.func)
+                finally:
+                    self._lock.acquire()
+                del self._busy_since[thread]
+                self._num_running[request.mount] -= 1
+                if not self._num_running[request.mount]:
+                    del self._num_running[request.mount]
+
+                now = time.monotonic()
+                if request.func is None:
+                    if len(self._cache) >= self._MAX_CACHE_SIZE:
+                        self._prune_cache(now)
+                    self._cache[request.path] = (request.kind, now)
+                    del self._pending[request.path]
+                request.done.set()
+
+                if request.abandoned and request.callback is not None:
+                    self._lock.release()
+                    try:
+                        self._call(
+                            request.callback, request.path, request.result)
+                    finally:
+                        self._lock.acquire()
+
+                # A thread that was stuck has been replaced meanwhile.
+                if (self._num_threads - self._num_stuck(now)
+                        > self._max_workers):
+                    self._num_threads -= 1
+                    return
+
+
+service = StatService()
@@ -1,4 +1,7 @@
 
+import os
+
+
 def string_to_glob(string):
     """Create case-insensetive search pattern from the string.
 
@@ -35,3 +38,25 @@ def unique_name(name, all_names):
             i += 1
         else:
             return new_name
+
+
+def write_atomic(path, data, encoding='utf-8'):
+    """Atomically replace the file at path with data.
+
+    The data is first written to a temporary file in the same
+    directory, which is then renamed over the original, so readers
+    never see a partially written file.
+    """
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        with open(tmp_path, 'w', encoding=encoding) as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
@@ -91,12 +91,13 @@ class MainWindow(Gtk.ApplicationWindow):
         return Gdk.EVENT_PROPAGATE
 
     def save_state(self):
-        self._library.save_state()
-
         settings['window_maximized'] = self._maximized
         settings['window_x'], settings['window_y'] = self.get_position()
         settings['window_width'], settings['window_height'] = self.get_size()
 
+        # Saves the settings as well.
+        self._library.save_state()
+
     def load_state(self):
         try:
             if settings['window_maximized']: